@@ -20,6 +20,8 @@ CREATE TABLE users (
     last_login TIMESTAMP,
     is_synced INTEGER DEFAULT 0,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     CONSTRAINT username_not_empty CHECK (TRIM(username) != ''),
     CONSTRAINT created_at_format CHECK (created_at GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]'),
     CONSTRAINT updated_at_format CHECK (updated_at GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]'),
@@ -39,6 +41,8 @@ CREATE TABLE patients (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_synced INTEGER DEFAULT 0,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     CONSTRAINT first_name_not_empty CHECK (TRIM(first_name) != ''),
     CONSTRAINT last_name_not_empty CHECK (TRIM(last_name) != ''),
     CONSTRAINT contact_not_empty CHECK (TRIM(contact) != ''),
@@ -51,7 +55,8 @@ CREATE TABLE patients (
 CREATE TABLE drugs (
     drug_id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL UNIQUE,
-    quantity INTEGER NOT NULL CHECK (quantity >= 0),
+    quantity INTEGER NOT NULL DEFAULT 0 CHECK (quantity >= 0),
+    opening_quantity INTEGER NOT NULL DEFAULT 0,
     batch_number TEXT NOT NULL,
     expiry_date TEXT NOT NULL,
     price REAL NOT NULL CHECK (price >= 0),
@@ -59,6 +64,8 @@ CREATE TABLE drugs (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_synced INTEGER DEFAULT 0,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     CONSTRAINT name_not_empty CHECK (TRIM(name) != ''),
     CONSTRAINT batch_number_not_empty CHECK (TRIM(batch_number) != ''),
     CONSTRAINT expiry_date_not_empty CHECK (TRIM(expiry_date) != ''),
@@ -81,6 +88,8 @@ CREATE TABLE suppliers (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_synced INTEGER DEFAULT 0,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     CONSTRAINT name_not_empty CHECK (TRIM(name) != ''),
     CONSTRAINT created_at_format CHECK (created_at GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]'),
     CONSTRAINT updated_at_format CHECK (updated_at GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]')
@@ -102,6 +111,8 @@ CREATE TABLE prescriptions (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_synced INTEGER DEFAULT 0,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL,
     FOREIGN KEY (drug_id) REFERENCES drugs(drug_id) ON DELETE CASCADE,
@@ -124,6 +135,8 @@ CREATE TABLE sales (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_synced INTEGER DEFAULT 0,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL,
     CONSTRAINT mode_of_payment_not_empty CHECK (TRIM(mode_of_payment) != ''),
@@ -141,11 +154,35 @@ CREATE TABLE sale_items (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_synced INTEGER DEFAULT 0,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     FOREIGN KEY (sale_id) REFERENCES sales(sale_id) ON DELETE CASCADE,
     FOREIGN KEY (drug_id) REFERENCES drugs(drug_id) ON DELETE CASCADE,
     CONSTRAINT updated_at_format CHECK (updated_at GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]')
 );
 
+-- Stock movements table: Append-only ledger of stock changes. A drug's
+-- quantity is its opening_quantity plus the sum of its movements.
+CREATE TABLE stock_movements (
+    stock_movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    drug_id INTEGER NOT NULL,
+    movement_type TEXT NOT NULL CHECK (movement_type IN ('receipt', 'sale', 'return', 'adjustment', 'write_off')),
+    quantity INTEGER NOT NULL CHECK (quantity != 0),
+    sale_id INTEGER,
+    user_id INTEGER,
+    note TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_synced INTEGER DEFAULT 0,
+    sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
+    FOREIGN KEY (drug_id) REFERENCES drugs(drug_id) ON DELETE CASCADE,
+    FOREIGN KEY (sale_id) REFERENCES sales(sale_id) ON DELETE SET NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL,
+    CONSTRAINT updated_at_format CHECK (updated_at GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]')
+);
+
 -- Sync queue table
 CREATE TABLE sync_queue (
     queue_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -155,10 +192,26 @@ CREATE TABLE sync_queue (
     data TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'synced', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0 CHECK (attempts >= 0),
+    next_retry_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
     CONSTRAINT table_name_not_empty CHECK (TRIM(table_name) != ''),
     CONSTRAINT created_at_format CHECK (created_at GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]')
 );
 
+-- Sync queue archive: synced sync_queue rows past the retention age,
+-- stored as zlib-compressed JSON batches
+CREATE TABLE sync_queue_archive (
+    archive_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first_queue_id INTEGER NOT NULL,
+    last_queue_id INTEGER NOT NULL,
+    row_count INTEGER NOT NULL CHECK (row_count > 0),
+    oldest_created_at TIMESTAMP,
+    newest_created_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    rows BLOB NOT NULL
+);
+
 -- Config table: Stores application configuration settings
 CREATE TABLE config (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -185,6 +238,9 @@ CREATE INDEX idx_sales_sale_date ON sales(sale_date);
 CREATE INDEX idx_sales_updated_at ON sales(updated_at);
 CREATE INDEX idx_sale_items_sale_id ON sale_items(sale_id);
 CREATE INDEX idx_sale_items_updated_at ON sale_items(updated_at);
+CREATE INDEX idx_stock_movements_drug_id ON stock_movements(drug_id, quantity);
+CREATE INDEX idx_stock_movements_updated_at ON stock_movements(updated_at);
 CREATE INDEX idx_sync_queue_status ON sync_queue(status);
 CREATE INDEX idx_sync_queue_created_at ON sync_queue(created_at);
+CREATE INDEX idx_sync_queue_due ON sync_queue(status, next_retry_at);
 CREATE INDEX idx_config_key ON config(key);
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+
+
+class PooledConnection:
+    """Wrapper around a shared SQLite connection.
+
+    Database methods still call conn.close() when they are done; for a pooled
+    connection that only discards uncommitted work (as a real close would) and
+    leaves the underlying connection open for the next caller on this thread.
+    """
+
+    def __init__(self, conn):
+        object.__setattr__(self, "_conn", conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        """Return the connection to the manager, rolling back any open transaction."""
+        if self._conn.in_transaction:
+            self._conn.rollback()
+
+
+class ConnectionManager:
+    """Hands out one long-lived SQLite connection per thread.
+
+    PRAGMAs are applied once when a thread's connection is opened instead of on
+    every Database call.
+    """
+
+    def __init__(self, db_path, pragmas=None):
+        self.db_path = db_path
+        self.pragmas = dict(pragmas or {})
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def get(self):
+        """Borrow the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return PooledConnection(conn)
+
+    def close_all(self):
+        """Close every connection handed out so far (e.g. before replacing the db file).
+
+        Threads that may still use their connections must be stopped first.
+        Raises RuntimeError, closing nothing, if another thread's connection
+        is in the middle of a transaction.
+        """
+        own = getattr(self._local, "conn", None)
+        with self._lock:
+            if any(conn.in_transaction for conn in self._connections if conn is not own):
+                raise RuntimeError("A database connection is still in use on another thread.")
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Error closing connection: {e}")
+        self._local = threading.local()
@@ -8,18 +8,197 @@ import requests
 import json
 import pytz
 import re
+import time
+import random
+import threading
+import zlib
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby
+from postgrest.exceptions import APIError
+from db.connection import ConnectionManager
+
+# SQLite storage profiles selectable via "storage_profile" in config.json.
+# Both run in WAL mode so the reporting dashboard can read while the sales
+# counter writes; "fast" trades durability of the last few commits on power
+# loss (synchronous=NORMAL) for far fewer fsyncs.
+STORAGE_PROFILES = {
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -8000,
+        "temp_store": "MEMORY",
+        "mmap_size": 0,
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -32000,
+        "temp_store": "MEMORY",
+        "mmap_size": 268435456,
+    },
+}
+
+# Sync order for cloud push and pull. Each stage only references tables in
+# earlier stages, so the tables inside a stage are synced in parallel.
+SYNC_STAGES = [
+    ["users"],
+    ["patients", "drugs", "suppliers"],
+    ["prescriptions", "sales"],
+    ["sale_items", "stock_movements"],
+]
+
+# Columns kept locally and never synced. drugs.quantity is the cached on-hand
+# balance: opening_quantity plus the drug's stock_movements, which are what
+# sync exchanges (see create_stock_triggers).
+SYNC_DERIVED_COLUMNS = {
+    "drugs": ("quantity",),
+}
+
+# Retry schedule for queue rows whose push failed. The n-th retry waits a
+# random time between half and all of SYNC_RETRY_BASE_SECONDS * 2**(n-1),
+# capped at SYNC_RETRY_MAX_SECONDS, so clinics that lost the network together
+# do not all retry at the same moment. After SYNC_MAX_ATTEMPTS rejections by
+# Supabase the row is dead-lettered (status 'failed') with its last error
+# kept. Network errors never use up attempts; their n is the number of pushes
+# in a row that failed to reach Supabase, so an outage only delays the queue.
+SYNC_RETRY_BASE_SECONDS = 30
+SYNC_RETRY_MAX_SECONDS = 3600
+SYNC_MAX_ATTEMPTS = 8
+
+# sync_queue.data encoding. Rows written before payloads were versioned hold
+# plain JSON text. Versioned payloads are BLOBs: a version byte, then for
+# version 1 a flag byte (1 = zlib-compressed) and compact JSON in which the
+# timestamp columns are microseconds since the epoch (UTC) and the
+# is_synced/sync_status flags, which are the same for every queued change,
+# are left out. Bodies of SYNC_PAYLOAD_COMPRESS_MIN bytes or more are
+# compressed when that makes them smaller.
+SYNC_PAYLOAD_VERSION = 1
+SYNC_PAYLOAD_COMPRESS_MIN = 200
+SYNC_TIMESTAMP_COLUMNS = ('created_at', 'updated_at', 'registration_date', 'prescription_date', 'sale_date')
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+
+def resolve_remote_wins(base, local, remote):
+    return remote
+
+
+def resolve_local_wins(base, local, remote):
+    return local
+
+
+def resolve_sum_deltas(base, local, remote):
+    """Keep both sides' changes to a counter: remote plus the local change since base."""
+    if base is None:
+        return remote
+    return remote + (local - base)
+
+
+# Conflict resolvers by name. A resolver gets a column's value in the last
+# synced state (base, None if unknown), locally and remotely, and returns the
+# merged value. It is only called when both sides changed the column.
+CONFLICT_RESOLVERS = {
+    "remote_wins": resolve_remote_wins,
+    "local_wins": resolve_local_wins,
+    "sum_deltas": resolve_sum_deltas,
+}
+
+# Per-table conflict policies: column -> resolver name (or a callable), with
+# "*" for every other column. Tables and columns not listed use remote_wins,
+# so every node converges on whichever change reached Supabase first. Stock
+# levels need none: they sync as stock_movements rows, which never conflict.
+SYNC_CONFLICT_POLICIES = {}
+
+# stock_movements rows are appended on every till and must never collide on
+# sync, so their ids are not autoincremented: the top STOCK_MOVEMENT_NODE_BITS
+# are the leading bits of the node_id and the low STOCK_MOVEMENT_ID_BITS count
+# up per node. 62 bits in all, so ids, and the id ranges of the digest tree
+# above them, fit a signed 64-bit integer in SQLite and Postgres. Two tills
+# can still draw the same prefix (about 1 in 2**30 per pair); their colliding
+# movements are caught on pull and renumbered (see rekey_local_row).
+STOCK_MOVEMENT_NODE_BITS = 30
+STOCK_MOVEMENT_ID_BITS = 32
+
+# Stock movement types and the sign of their quantity in stock_movements;
+# adjustments carry their own sign.
+STOCK_MOVEMENT_SIGNS = {
+    "receipt": 1,
+    "return": 1,
+    "sale": -1,
+    "write_off": -1,
+    "adjustment": None,
+}
+
+# Stock held for an open cart (stock_reservations) lapses this long after the
+# cart was last added to, so a till that is closed or walked away from gives
+# its stock back without writing anything.
+STOCK_RESERVATION_SECONDS = 15 * 60
+
+# Table digests for finding rows that differ from Supabase without reading
+# them. Rows are grouped into buckets of SYNC_DIGEST_BUCKET_SIZE ids; a
+# bucket's digest is the sum, modulo SYNC_DIGEST_MODULUS, of a hash of each
+# row's (id, row_version, updated_at). Sums can be updated one row at a time
+# and merged, so SYNC_DIGEST_FANOUT neighbouring buckets add up to a bucket
+# of the level above, forming a tree whose root covers the whole table. The
+# same hash is computed by the sync_bucket_digests function in Supabase
+# (db/supabase_schema.sql); all arithmetic stays below 2**63 so SQLite and
+# Postgres agree.
+SYNC_DIGEST_BUCKET_SIZE = 1024
+SYNC_DIGEST_FANOUT = 16
+SYNC_DIGEST_MODULUS = 2147483647
+
+# FROM clauses and the patient name expression for the sales and prescription
+# views, which page through them with fetch_page (see ui/sql_table_model.py).
+# Missing patients or drugs show as 'Unknown' rather than dropping the row.
+PATIENT_NAME_SQL = "COALESCE(p.first_name || ' ' || p.last_name, 'Unknown')"
+SALES_WITH_PATIENTS_SQL = "sales s LEFT JOIN patients p ON s.patient_id = p.patient_id"
+PRESCRIPTIONS_WITH_DETAILS_SQL = """
+    prescriptions pr
+    LEFT JOIN patients p ON pr.patient_id = p.patient_id
+    LEFT JOIN drugs d ON pr.drug_id = d.drug_id
+"""
+
+
+def sync_row_hash_sql(alias, id_column):
+    """SQL expression hashing one row of alias into [0, SYNC_DIGEST_MODULUS)."""
+    m = SYNC_DIGEST_MODULUS
+    x = (f"((({alias}.{id_column} % {m}) * 48271 + ({alias}.row_version % {m}) * 69621"
+         f" + (COALESCE(CAST(strftime('%s', {alias}.updated_at) AS INTEGER), 0) % {m}) * 16807) % {m})")
+    return f"(({x} * {x} + {x} + 1) % {m})"
+
+
+class SyncCancelled(Exception):
+    """Raised inside sync_data when the caller's cancel event is set."""
+
 
 class Database:
     def __init__(self):
         self.db_path = "database/clinic.db"
         self.schema_path = "database/schema.sql"
         self.config_path = "database/config.json"
+        self.storage_profile = self.load_storage_profile()
+        pragmas = {"busy_timeout": 5000}
+        pragmas.update(STORAGE_PROFILES[self.storage_profile])
+        self.connections = ConnectionManager(self.db_path, pragmas)
         load_dotenv()
         self.supabase_url = os.getenv("SUPABASE_URL")
         self.supabase_key = os.getenv("SUPABASE_KEY")
         self.supabase: Client = None
         self.sync_enabled = False
+        self.sync_capture_enabled = None
+        self.node_id = None
+        self.conflict_policies = {table: dict(policy) for table, policy in SYNC_CONFLICT_POLICIES.items()}
         self.last_sync_time = None
+        self.push_batch_size = 100
+        self.pull_page_size = 500
+        self.sync_workers = 3
+        self.sync_retention_days = 30
+        self.sync_executor = None
+        self.push_outages = 0
+        self.push_outages_lock = threading.Lock()
+        self.last_sync_timings = {}
+        self.change_listeners = []
+        self.online_status = None
         if self.supabase_url and self.supabase_key:
             self.supabase = create_client(self.supabase_url, self.supabase_key)
         self.init_database()
@@ -30,9 +209,13 @@ class Database:
         if not os.path.exists(self.db_path) or not self.table_exists("users"):
             with open(self.schema_path, 'r') as f:
                 schema = f.read()
-            conn = sqlite3.connect(self.db_path)
+            conn = self.connect()
             conn.executescript(schema)
             conn.commit()
+            # Lets the sync queue retention job hand freed pages back a few at a
+            # time; switching modes needs a VACUUM, which is instant while empty
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
             conn.close()
 
         # Create sync_queue table in SQLite if not exists
@@ -45,7 +228,76 @@ class Database:
                 record_id INTEGER NOT NULL,
                 data TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'pending'
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_retry_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_error TEXT
+            )
+        """)
+        # Older databases predate the retry columns
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sync_queue)")}
+        if "attempts" not in columns:
+            conn.execute("ALTER TABLE sync_queue ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        if "next_retry_at" not in columns:
+            conn.execute("ALTER TABLE sync_queue ADD COLUMN next_retry_at TIMESTAMP")
+            conn.execute("UPDATE sync_queue SET next_retry_at = created_at WHERE next_retry_at IS NULL")
+        if "last_error" not in columns:
+            conn.execute("ALTER TABLE sync_queue ADD COLUMN last_error TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_queue_due ON sync_queue(status, next_retry_at)")
+        # Synced queue rows past the retention age, zlib-compressed in batches
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_queue_archive (
+                archive_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                first_queue_id INTEGER NOT NULL,
+                last_queue_id INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                oldest_created_at TIMESTAMP,
+                newest_created_at TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                rows BLOB NOT NULL
+            )
+        """)
+        # Whether the sync triggers below record changes (mirrors sync_enabled),
+        # and this install's node id, stamped on every row it changes
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_capture (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                enabled INTEGER NOT NULL DEFAULT 0,
+                node_id TEXT
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO sync_capture (id, enabled) VALUES (1, 0)")
+        if "node_id" not in {row[1] for row in conn.execute("PRAGMA table_info(sync_capture)")}:
+            conn.execute("ALTER TABLE sync_capture ADD COLUMN node_id TEXT")
+        conn.execute("UPDATE sync_capture SET node_id = ? WHERE id = 1 AND node_id IS NULL", (uuid.uuid4().hex,))
+        self.node_id = conn.execute("SELECT node_id FROM sync_capture WHERE id = 1").fetchone()[0]
+        # Last synced state of rows with unpushed local changes (see create_sync_triggers)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_base (
+                table_name TEXT NOT NULL,
+                record_id INTEGER NOT NULL,
+                row_version INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (table_name, record_id)
+            )
+        """)
+        # Per-table position of the last pulled remote row, so pulls can resume
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_checkpoints (
+                table_name TEXT PRIMARY KEY,
+                last_updated_at TEXT NOT NULL,
+                last_id INTEGER NOT NULL
+            )
+        """)
+        # Pulled rows that could not be merged (see apply_remote_rows)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_pull_failures (
+                table_name TEXT NOT NULL,
+                record_id INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                error TEXT NOT NULL,
+                failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (table_name, record_id)
             )
         """)
         # Create suppliers table in SQLite if not exists
@@ -66,6 +318,68 @@ class Database:
                 sync_status TEXT DEFAULT 'pending'
             )
         """)
+        # Stock ledger, for databases created before it existed
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_movements (
+                stock_movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                drug_id INTEGER NOT NULL,
+                movement_type TEXT NOT NULL CHECK (movement_type IN ('receipt', 'sale', 'return', 'adjustment', 'write_off')),
+                quantity INTEGER NOT NULL CHECK (quantity != 0),
+                sale_id INTEGER,
+                user_id INTEGER,
+                note TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_synced INTEGER DEFAULT 0,
+                sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+                row_version INTEGER NOT NULL DEFAULT 0,
+                origin_id TEXT,
+                FOREIGN KEY (drug_id) REFERENCES drugs(drug_id) ON DELETE CASCADE,
+                FOREIGN KEY (sale_id) REFERENCES sales(sale_id) ON DELETE SET NULL,
+                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_drug_id ON stock_movements(drug_id, quantity)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_updated_at ON stock_movements(updated_at)")
+        # Stock held for open carts. Local to this database and never synced:
+        # a hold is either turned into sale movements at checkout or lapses.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_reservations (
+                cart_id TEXT NOT NULL,
+                drug_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL CHECK (quantity > 0),
+                expires_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (cart_id, drug_id),
+                FOREIGN KEY (drug_id) REFERENCES drugs(drug_id) ON DELETE CASCADE
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_reservations_drug_id ON stock_reservations(drug_id, expires_at)")
+        # Stock held before the ledger existed becomes each drug's opening
+        # balance. It is not queued: every clinic already agrees on it.
+        drug_columns = {row[1] for row in conn.execute("PRAGMA table_info(drugs)")}
+        if drug_columns and "opening_quantity" not in drug_columns:
+            conn.execute("ALTER TABLE drugs ADD COLUMN opening_quantity INTEGER NOT NULL DEFAULT 0")
+            conn.execute("UPDATE drugs SET opening_quantity = quantity")
+        # Older databases predate row versions
+        for table in [table for stage in SYNC_STAGES for table in stage]:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if columns and "row_version" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0")
+            if columns and "origin_id" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN origin_id TEXT")
+        self.create_sync_triggers(conn)
+        self.create_stock_triggers(conn)
+        # Bucket digests of each synced table (see SYNC_DIGEST_BUCKET_SIZE)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_digests (
+                table_name TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                digest INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                PRIMARY KEY (table_name, bucket)
+            )
+        """)
+        self.create_digest_triggers(conn)
         # Insert initial config values for demo period and activation
         current_time = datetime.now(pytz.timezone('Africa/Nairobi')).strftime("%Y-%m-%d %H:%M:%S")
         conn.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)",
@@ -77,6 +391,221 @@ class Database:
         conn.commit()
         conn.close()
 
+    def create_sync_triggers(self, conn):
+        """(Re)create the change-capture triggers that fill sync_queue.
+
+        Every insert, update and delete on a synced table queues itself inside
+        the writing transaction, so a change and its outbox row always commit
+        together. Only rows written with is_synced = 0 are captured: every
+        local write sets it, while marking rows pushed and merging pulled rows
+        set it to 1 and so never echo back to Supabase. An UPDATE queues just
+        the columns that changed, plus the key and updated_at. Payloads use
+        the version 1 encoding (see SYNC_PAYLOAD_VERSION); timestamps stored
+        as 'YYYY-MM-DD HH:MM:SS' are turned into epoch microseconds here, and
+        coalesce_sync_queue compresses the payloads before they are pushed.
+
+        Each captured write also bumps the row's row_version and stamps it
+        with this node's origin_id. When a synced row first gets a local
+        change, its last synced state is kept in sync_base as the common
+        ancestor for conflict resolution on pull; it is dropped once the row
+        is synced again. The triggers are rebuilt on every start so they
+        always cover the current columns. Columns in SYNC_DERIVED_COLUMNS are
+        left out of payloads, and updates that set nothing else are ignored.
+        """
+        capturing = "EXISTS (SELECT 1 FROM sync_capture WHERE enabled = 1)"
+        node = "(SELECT node_id FROM sync_capture WHERE id = 1)"
+        for table in [table for stage in SYNC_STAGES for table in stage]:
+            id_column = f"{table[:-1]}_id"
+            derived = SYNC_DERIVED_COLUMNS.get(table, ())
+            all_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] not in derived]
+            columns = [column for column in all_columns if column not in ('is_synced', 'sync_status')]
+            if not columns:
+                continue
+
+            def row_json(alias):
+                return "json_object(" + ", ".join(f"'{column}', {alias}.{column}" for column in columns) + ")"
+
+            def compact_value(alias, column):
+                if column not in SYNC_TIMESTAMP_COLUMNS:
+                    return f"{alias}.{column}"
+                # Only text that converts back exactly, so nothing is lost
+                value = f"{alias}.{column}"
+                return (f"CASE WHEN strftime('%Y-%m-%d %H:%M:%S', {value}) = {value}"
+                        f" THEN CAST(strftime('%s', {value}) AS INTEGER) * 1000000 ELSE {value} END")
+
+            def payload_json(alias):
+                return "json_object(" + ", ".join(f"'{column}', {compact_value(alias, column)}" for column in columns) + ")"
+
+            def queue(operation, record_id, data):
+                return f"""
+                    INSERT INTO sync_queue (table_name, operation, record_id, data, status, next_retry_at)
+                    SELECT '{table}', '{operation}', {record_id}, {data}, 'pending', CURRENT_TIMESTAMP
+                    WHERE {capturing};
+                """
+
+            def versioned(data, alias):
+                return f"CAST(X'0100' || json_set({data}, '$.row_version', {alias}.row_version + 1, '$.origin_id', {node}) AS BLOB)"
+
+            def bump(alias):
+                return f"""
+                    UPDATE {table} SET row_version = {alias}.row_version + 1, origin_id = {node}
+                    WHERE {id_column} = NEW.{id_column};
+                """
+
+            changed = f"""(
+                SELECT json_group_object(n.key, n.value)
+                FROM json_each({payload_json('NEW')}) AS n
+                JOIN json_each({payload_json('OLD')}) AS o ON o.key = n.key
+                WHERE n.key IN ('{id_column}', 'updated_at') OR n.value IS NOT o.value
+            )"""
+            forget_base = f"DELETE FROM sync_base WHERE table_name = '{table}' AND record_id = OLD.{id_column};"
+            triggers = {
+                # The version bump is an UPDATE that changes row_version, which
+                # the update trigger below ignores, so it is never queued twice
+                "insert": f"AFTER INSERT ON {table} WHEN NEW.is_synced = 0 BEGIN"
+                          + queue('INSERT', f"NEW.{id_column}", versioned(payload_json('NEW'), 'NEW'))
+                          + bump('NEW') + "END",
+                "update": f"AFTER UPDATE OF {', '.join(all_columns)} ON {table}"
+                          + " WHEN NEW.is_synced = 0 AND NEW.row_version = OLD.row_version BEGIN"
+                          + f"""
+                    INSERT OR REPLACE INTO sync_base (table_name, record_id, row_version, data)
+                    SELECT '{table}', OLD.{id_column}, OLD.row_version, {row_json('OLD')}
+                    WHERE OLD.is_synced = 1;
+                """
+                          + queue('UPDATE', f"NEW.{id_column}", versioned(changed, 'OLD'))
+                          + bump('OLD') + "END",
+                "synced": f"AFTER UPDATE OF is_synced ON {table} WHEN NEW.is_synced = 1 AND OLD.is_synced = 0 BEGIN "
+                          + forget_base + " END",
+                "delete": f"AFTER DELETE ON {table} BEGIN"
+                          + queue('DELETE', f"OLD.{id_column}", "NULL") + forget_base + " END",
+            }
+            for event, body in triggers.items():
+                conn.execute(f"DROP TRIGGER IF EXISTS sync_capture_{table}_{event}")
+                conn.execute(f"CREATE TRIGGER sync_capture_{table}_{event} {body}")
+
+    def create_stock_triggers(self, conn):
+        """(Re)create the triggers that keep drugs.quantity equal to the stock ledger.
+
+        drugs.quantity caches opening_quantity plus the sum of the drug's
+        stock_movements and is updated by each movement as it is written,
+        whether locally or by a pull. It is never written by sync itself (see
+        SYNC_DERIVED_COLUMNS). The cache cannot go below zero: if tills that
+        sold offline together oversold a drug it stays at zero, and
+        get_stock_discrepancies reports the drug until a stock count
+        (adjust_stock) settles it.
+        """
+        if not conn.execute("PRAGMA table_info(drugs)").fetchall():
+            return
+        triggers = {
+            "movement_insert": """AFTER INSERT ON stock_movements BEGIN
+                UPDATE drugs SET quantity = MAX(0, quantity + NEW.quantity) WHERE drug_id = NEW.drug_id;
+            END""",
+            "movement_update": """AFTER UPDATE OF drug_id, quantity ON stock_movements BEGIN
+                UPDATE drugs SET quantity = MAX(0, quantity - OLD.quantity) WHERE drug_id = OLD.drug_id;
+                UPDATE drugs SET quantity = MAX(0, quantity + NEW.quantity) WHERE drug_id = NEW.drug_id;
+            END""",
+            "movement_delete": """AFTER DELETE ON stock_movements BEGIN
+                UPDATE drugs SET quantity = MAX(0, quantity - OLD.quantity) WHERE drug_id = OLD.drug_id;
+            END""",
+            "drug_insert": """AFTER INSERT ON drugs BEGIN
+                UPDATE drugs SET quantity = MAX(0, NEW.opening_quantity
+                    + COALESCE((SELECT SUM(quantity) FROM stock_movements WHERE drug_id = NEW.drug_id), 0))
+                WHERE drug_id = NEW.drug_id;
+            END""",
+            "drug_opening": """AFTER UPDATE OF opening_quantity ON drugs BEGIN
+                UPDATE drugs SET quantity = MAX(0, quantity + NEW.opening_quantity - OLD.opening_quantity)
+                WHERE drug_id = NEW.drug_id;
+            END""",
+        }
+        for name, body in triggers.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS stock_{name}")
+            conn.execute(f"CREATE TRIGGER stock_{name} {body}")
+
+    def create_digest_triggers(self, conn):
+        """(Re)create the triggers that keep sync_digests current on every write.
+
+        Each trigger adds the new row's hash to its bucket and subtracts the
+        old row's, as upserts, so the result does not depend on the order in
+        which they fire alongside the change-capture triggers. Buckets left
+        empty are dropped. Tables that have rows but no digests yet, e.g. on
+        the first start after upgrading, are digested in full.
+        """
+        s, m = SYNC_DIGEST_BUCKET_SIZE, SYNC_DIGEST_MODULUS
+        for table in [table for stage in SYNC_STAGES for table in stage]:
+            id_column = f"{table[:-1]}_id"
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if not columns:
+                continue
+
+            def add(alias, sign):
+                digest = sync_row_hash_sql(alias, id_column)
+                if sign < 0:
+                    digest = f"({m} - {digest}) % {m}"
+                return f"""
+                    INSERT INTO sync_digests (table_name, bucket, digest, row_count)
+                    VALUES ('{table}', {alias}.{id_column} / {s}, {digest}, {sign})
+                    ON CONFLICT(table_name, bucket) DO UPDATE SET
+                        digest = (digest + excluded.digest) % {m}, row_count = row_count + excluded.row_count;
+                """
+
+            def drop_empty(alias):
+                return f"""
+                    DELETE FROM sync_digests WHERE table_name = '{table}' AND bucket = {alias}.{id_column} / {s}
+                    AND row_count = 0 AND digest = 0;
+                """
+
+            triggers = {
+                "insert": f"AFTER INSERT ON {table} BEGIN" + add("NEW", 1) + "END",
+                "update": f"AFTER UPDATE OF {id_column}, row_version, updated_at ON {table} BEGIN"
+                          + add("OLD", -1) + add("NEW", 1) + drop_empty("OLD") + "END",
+                "delete": f"AFTER DELETE ON {table} BEGIN" + add("OLD", -1) + drop_empty("OLD") + "END",
+            }
+            for event, body in triggers.items():
+                conn.execute(f"DROP TRIGGER IF EXISTS sync_digest_{table}_{event}")
+                conn.execute(f"CREATE TRIGGER sync_digest_{table}_{event} {body}")
+
+            if (conn.execute("SELECT 1 FROM sync_digests WHERE table_name = ? LIMIT 1", (table,)).fetchone() is None
+                    and conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is not None):
+                self.rebuild_sync_digests(conn, table)
+
+    def rebuild_sync_digests(self, conn, table):
+        """Recompute every bucket digest of table from its rows."""
+        id_column = f"{table[:-1]}_id"
+        conn.execute("DELETE FROM sync_digests WHERE table_name = ?", (table,))
+        conn.execute(f"""
+            INSERT INTO sync_digests (table_name, bucket, digest, row_count)
+            SELECT ?, {id_column} / {SYNC_DIGEST_BUCKET_SIZE},
+                   SUM({sync_row_hash_sql(table, id_column)}) % {SYNC_DIGEST_MODULUS}, COUNT(*)
+            FROM {table} GROUP BY {id_column} / {SYNC_DIGEST_BUCKET_SIZE}
+        """, (table,))
+
+    def set_sync_capture(self, enabled):
+        """Switch the sync_queue triggers on or off to match sync_enabled."""
+        enabled = 1 if enabled else 0
+        if self.sync_capture_enabled == enabled:
+            return
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE sync_capture SET enabled = ? WHERE id = 1", (enabled,))
+            conn.commit()
+        finally:
+            conn.close()
+        self.sync_capture_enabled = enabled
+
+    def load_storage_profile(self):
+        """Read the SQLite storage profile name from config.json, defaulting to 'safe'."""
+        profile = "safe"
+        try:
+            if os.path.exists(self.config_path):
+                with open(self.config_path, 'r') as f:
+                    profile = json.load(f).get("storage_profile", profile)
+        except Exception as e:
+            print(f"Error loading storage profile: {e}")
+        if profile not in STORAGE_PROFILES:
+            print(f"Unknown storage profile '{profile}', falling back to 'safe'.")
+            profile = "safe"
+        return profile
+
     def load_config(self):
         """Load settings from config.json and database config table."""
         default_config = {
@@ -87,6 +616,12 @@ class Database:
             "contact_details": "",
             "currency_symbol": "KSh",
             "sync_enabled": False,
+            "auto_sync_interval": 300,
+            "push_batch_size": 100,
+            "pull_page_size": 500,
+            "sync_workers": 3,
+            "sync_retention_days": 30,
+            "storage_profile": "safe",
             "first_launch_date": None,
             "activation_code": None,
             "is_activated": "false"
@@ -107,6 +642,11 @@ class Database:
             default_config.update(db_config)
 
             self.sync_enabled = default_config["sync_enabled"]
+            self.set_sync_capture(self.sync_enabled)
+            self.push_batch_size = int(default_config["push_batch_size"])
+            self.pull_page_size = int(default_config["pull_page_size"])
+            self.sync_workers = max(1, int(default_config["sync_workers"]))
+            self.sync_retention_days = int(default_config["sync_retention_days"])
             if os.path.exists("last_sync.txt"):
                 with open("last_sync.txt", "r") as f:
                     last_sync_str = f.read().strip()
@@ -158,13 +698,38 @@ class Database:
             raise e
 
     def connect(self):
-        """Connect to the local SQLite database."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Borrow this thread's pooled connection to the local SQLite database."""
+        return self.connections.get()
+
+    def checkpoint(self):
+        """Fold the WAL back into clinic.db so the main file is a complete copy."""
+        conn = self.connect()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+
+    def close_connections(self):
+        """Close all pooled connections, e.g. before the database file is replaced.
+
+        The sync thread pool is shut down first so none of its threads is left
+        holding a closed connection; stop any SyncService before calling this.
+        """
+        if self.sync_executor is not None:
+            self.sync_executor.shutdown(wait=True)
+            self.sync_executor = None
+        self.connections.close_all()
+
+    def set_online_status(self, is_online):
+        """Record the latest result from a background connectivity monitor."""
+        self.online_status = is_online
 
     def is_online(self):
-        """Check if internet connection is available."""
+        """Check if internet connection is available.
+
+        Returns the last state published by a connectivity monitor when one is
+        running, and only falls back to a blocking probe otherwise.
+        """
+        if self.online_status is not None:
+            return self.online_status
         try:
             requests.get("https://www.google.com", timeout=2)
             return True
@@ -173,91 +738,295 @@ class Database:
 
     def toggle_sync(self, enabled):
         """Enable or disable cloud sync and save to config."""
-        self.sync_enabled = enabled
         config = self.load_config()
         config["sync_enabled"] = enabled
         self.save_config(config)
-        if enabled and self.is_online():
-            self.sync_data()
+        self.sync_enabled = enabled
+        self.set_sync_capture(enabled)
 
-    def queue_sync_operation(self, table_name, operation, record_id, data):
-        """Add an operation to the sync queue."""
-        if not self.sync_enabled:
-            return
-        conn = self.connect()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO sync_queue (table_name, operation, record_id, data, status)
-            VALUES (?, ?, ?, ?, 'pending')
-        """, (table_name, operation, record_id, json.dumps(data)))
-        conn.commit()
-        conn.close()
+    def add_change_listener(self, callback):
+        """Register callback(tables) to be told which tables a committed write touched.
 
-    def push_changes(self, tables):
-        """Push local changes to Supabase based on sync queue."""
-        conn = self.connect()
-        cursor = conn.cursor()
+        Callbacks may run on a worker thread (e.g. during sync), so they should
+        only record the change and leave any UI work for the GUI thread.
+        """
+        self.change_listeners.append(callback)
 
-        cursor.execute("SELECT * FROM sync_queue WHERE status = 'pending' ORDER BY created_at")
-        pending_operations = cursor.fetchall()
+    def notify_change(self, *tables):
+        """Tell change listeners that rows in the given tables were written."""
+        for callback in list(self.change_listeners):
+            try:
+                callback(tables)
+            except Exception as e:
+                print(f"Error in change listener: {e}")
 
-        table_priority = {
-            "users": 1,
-            "patients": 2,
-            "drugs": 2,
-            "suppliers": 2,
-            "prescriptions": 3,
-            "sales": 3,
-            "sale_items": 4
-        }
-        pending_operations = sorted(pending_operations, key=lambda op: table_priority.get(op['table_name'], 5))
+    def encode_sync_payload(self, data):
+        """Encode a queued change for sync_queue.data (see SYNC_PAYLOAD_VERSION)."""
+        compact = {}
+        for key, value in (data or {}).items():
+            if key in ('is_synced', 'sync_status'):
+                continue
+            if key in SYNC_TIMESTAMP_COLUMNS and value:
+                try:
+                    moment = value if isinstance(value, datetime) else datetime.fromisoformat(value.replace("Z", "+00:00"))
+                    if moment.tzinfo is None:
+                        moment = pytz.UTC.localize(moment)
+                    delta = moment - EPOCH
+                    value = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+                except (ValueError, AttributeError):
+                    pass
+            compact[key] = value
+        if not compact:
+            return None
+        body = json.dumps(compact, separators=(',', ':')).encode("utf-8")
+        if len(body) >= SYNC_PAYLOAD_COMPRESS_MIN:
+            compressed = zlib.compress(body)
+            if len(compressed) < len(body):
+                return bytes((SYNC_PAYLOAD_VERSION, 1)) + compressed
+        return bytes((SYNC_PAYLOAD_VERSION, 0)) + body
+
+    def decode_sync_payload(self, raw):
+        """Decode sync_queue.data written by any payload version into a dict of columns."""
+        if not raw:
+            return {}
+        if isinstance(raw, str):
+            return json.loads(raw)
+        if raw[0] != 1:
+            raise ValueError(f"Unsupported sync payload version {raw[0]}")
+        body = zlib.decompress(raw[2:]) if raw[1] & 1 else raw[2:]
+        data = json.loads(body)
+        for key in SYNC_TIMESTAMP_COLUMNS:
+            if isinstance(data.get(key), int):
+                data[key] = (EPOCH + timedelta(microseconds=data[key])).isoformat()
+        data['is_synced'] = False
+        data['sync_status'] = 'pending'
+        return data
+
+    def coalesce_sync_queue(self):
+        """Merge pending sync_queue rows so each (table_name, record_id) is pushed once.
+
+        Payloads are merged in queue order with the last write winning per
+        column. INSERT followed by UPDATE stays an INSERT, INSERT followed by
+        DELETE cancels out, and DELETE followed by INSERT becomes an UPDATE.
+        The merged operation is kept in the earliest queue row and the rest are
+        removed; payloads left on their own are re-encoded, compressed, when
+        that makes them smaller. Runs just before a push, on the sync thread, so no row being
+        merged can be in flight. Returns the number of queue rows removed.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                SELECT queue_id, table_name, operation, record_id, data FROM sync_queue
+                WHERE status = 'pending' ORDER BY queue_id
+            """)
+            merged, raw = {}, {}
+            for row in cursor.fetchall():
+                data = self.decode_sync_payload(row['data'])
+                entry = merged.get((row['table_name'], row['record_id']))
+                if entry is None:
+                    merged[(row['table_name'], row['record_id'])] = [[row['queue_id']], row['operation'], data]
+                    raw[row['queue_id']] = row['data']
+                    continue
+                queue_ids, previous, previous_data = entry
+                queue_ids.append(row['queue_id'])
+                if row['operation'] == 'DELETE':
+                    # None marks an INSERT that was deleted before it was ever pushed
+                    entry[1] = None if previous == 'INSERT' else 'DELETE'
+                    entry[2] = {}
+                    continue
+                if row['operation'] == 'INSERT':
+                    entry[1] = 'UPDATE' if previous == 'DELETE' else 'INSERT'
+                else:
+                    entry[1] = 'INSERT' if previous == 'INSERT' else 'UPDATE'
+                if previous in ('INSERT', 'UPDATE'):
+                    previous_data.update(data)
+                else:
+                    entry[2] = data
+
+            kept, removed, recoded = [], [], []
+            for queue_ids, operation, data in merged.values():
+                if len(queue_ids) == 1:
+                    # The capture triggers cannot compress, so payloads are compressed here
+                    payload = raw[queue_ids[0]]
+                    if payload and (isinstance(payload, str) or not payload[1] & 1):
+                        encoded = self.encode_sync_payload(data)
+                        if encoded and len(encoded) < len(payload):
+                            recoded.append((encoded, queue_ids[0]))
+                    continue
+                if operation is None:
+                    removed.extend(queue_ids)
+                else:
+                    kept.append((operation, self.encode_sync_payload(data), queue_ids[0]))
+                    removed.extend(queue_ids[1:])
+            cursor.executemany("UPDATE sync_queue SET operation = ?, data = ? WHERE queue_id = ?", kept)
+            cursor.executemany("UPDATE sync_queue SET data = ? WHERE queue_id = ?", recoded)
+            cursor.executemany("DELETE FROM sync_queue WHERE queue_id = ?", [(queue_id,) for queue_id in removed])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if removed:
+            print(f"Coalesced {len(removed)} sync queue rows")
+        return len(removed)
+
+    def check_cancelled(self, cancel_event):
+        """Raise SyncCancelled if a sync's cancel event has been set."""
+        if cancel_event is not None and cancel_event.is_set():
+            raise SyncCancelled()
+
+    def push_changes(self, tables, progress=None, cancel_event=None):
+        """Push local changes to Supabase based on sync queue.
+
+        Tables are pushed stage by stage in SYNC_STAGES order, tables within a
+        stage in parallel. With push_batch_size > 1 (the default) pending
+        operations are sent as chunked bulk upserts and deletes; otherwise one
+        request per queue row. Queue rows are committed as soon as they are
+        pushed, so the write lock is never held across a network call and a
+        cancelled push keeps the rows it already sent. Returns per-table
+        push times in seconds.
+        """
+        self.coalesce_sync_queue()
 
         # Force resync of all users if any dependent table fails due to user_id
         user_ids_to_resync = set()
+        timings = self.run_sync_stages(
+            "push", tables, lambda table: self.push_table(table, user_ids_to_resync, cancel_event), progress)
+
+        conn = self.connect()
+        try:
+            self.resync_users(conn.cursor(), user_ids_to_resync)
+            conn.commit()
+        finally:
+            conn.close()
+        return timings
+
+    def push_table(self, table_name, user_ids_to_resync, cancel_event=None):
+        """Push the pending sync_queue rows of one table that are due for a (re)try."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+            cursor.execute("""
+                SELECT * FROM sync_queue
+                WHERE status = 'pending' AND next_retry_at <= ? AND table_name = ?
+                ORDER BY created_at
+            """, (now, table_name))
+            pending_operations = cursor.fetchall()
+            if self.push_batch_size > 1:
+                self.push_batched(cursor, pending_operations, user_ids_to_resync, cancel_event)
+            else:
+                self.push_one_by_one(cursor, pending_operations, user_ids_to_resync, cancel_event)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_sync_executor(self):
+        """Thread pool shared by every sync; its threads keep their pooled connections."""
+        if self.sync_executor is None:
+            self.sync_executor = ThreadPoolExecutor(max_workers=self.sync_workers, thread_name_prefix="sync")
+        return self.sync_executor
+
+    def run_sync_stages(self, phase, tables, task, progress=None):
+        """Run task(table) for each of tables, one SYNC_STAGES stage at a time.
+
+        Tables within a stage run in parallel on the sync thread pool; a stage
+        starts only after the previous one has finished, so parent rows always
+        reach their destination before the rows that reference them. If any
+        task in a stage raises, later stages are skipped and the error is
+        re-raised (a cancellation takes precedence). Returns {table: seconds}.
+        """
+        def timed(table):
+            started = time.perf_counter()
+            task(table)
+            return time.perf_counter() - started
+
+        executor = self.get_sync_executor()
+        timings = {}
+        for stage in SYNC_STAGES:
+            futures = {executor.submit(timed, table): table for table in stage if table in tables}
+            errors = []
+            for future in as_completed(futures):
+                try:
+                    timings[futures[future]] = future.result()
+                except Exception as e:
+                    errors.append(e)
+                if progress:
+                    progress(phase, len(timings) + len(errors), len(tables))
+            if errors:
+                raise next((e for e in errors if isinstance(e, SyncCancelled)), errors[0])
+        return timings
+
+    def prepare_push_data(self, cursor, queue_ids, table_name, record_id, data):
+        """Validate and convert a queued row for Supabase.
+
+        Returns None (after dead-lettering the queue rows) if the row can never
+        be pushed, e.g. a patient with an out-of-range age.
+        """
+        # Validate data before pushing (e.g., for patients table)
+        if table_name == 'patients' and data:
+            if 'age' in data:
+                try:
+                    age = int(data['age'])
+                    if age <= 0 or age > 150:
+                        print(f"Invalid age ({age}) for patient_id {record_id}. Skipping sync operation.")
+                        self.dead_letter_sync_rows(cursor, queue_ids, f"Invalid age ({age})")
+                        cursor.connection.commit()
+                        return None
+                except (ValueError, TypeError):
+                    print(f"Invalid age value ({data['age']}) for patient_id {record_id}. Skipping sync operation.")
+                    self.dead_letter_sync_rows(cursor, queue_ids, f"Invalid age value ({data['age']})")
+                    cursor.connection.commit()
+                    return None
+
+            if 'contact' in data:
+                contact = str(data['contact']).strip()
+                if not re.match(r'^\+[0-9]{3}[0-9]{9}$', contact):
+                    print(f"Invalid contact ({contact}) for patient_id {record_id}. Setting to default for sync.")
+                    data['contact'] = '+254000000000'
+
+        # Columns derived locally, such as drugs.quantity, are never pushed
+        for column in SYNC_DERIVED_COLUMNS.get(table_name, ()):
+            data.pop(column, None)
+
+        # Convert SQLite INTEGER (0/1) to BOOLEAN for Supabase
+        if 'is_synced' in data:
+            data['is_synced'] = bool(data['is_synced'])
+
+        # Ensure timestamps are in the correct format for Supabase
+        for key in SYNC_TIMESTAMP_COLUMNS:
+            if key in data and data[key]:
+                try:
+                    dt = datetime.fromisoformat(data[key].replace("Z", "+00:00"))
+                    data[key] = dt.isoformat()
+                except ValueError:
+                    dt = datetime.strptime(data[key], "%Y-%m-%d %H:%M:%S")
+                    dt = pytz.UTC.localize(dt)
+                    data[key] = dt.isoformat()
+        return data
+
+    def push_one_by_one(self, cursor, pending_operations, user_ids_to_resync, cancel_event=None):
+        """Push pending operations with one Supabase request per queue row.
+
+        As in send_push_batch, a row Supabase rejects is retried later or
+        dead-lettered while the rest carry on; any other error schedules the
+        row for a retry and propagates.
+        """
         for op in pending_operations:
+            self.check_cancelled(cancel_event)
             queue_id = op['queue_id']
             table_name = op['table_name']
             operation = op['operation']
             record_id = op['record_id']
-            data = json.loads(op['data']) if op['data'] else {}
+            data = self.decode_sync_payload(op['data'])
 
             try:
-                # Validate data before pushing (e.g., for patients table)
-                if table_name == 'patients' and data:
-                    if 'age' in data:
-                        try:
-                            age = int(data['age'])
-                            if age <= 0 or age > 150:
-                                print(f"Invalid age ({age}) for patient_id {record_id}. Skipping sync operation.")
-                                cursor.execute("UPDATE sync_queue SET status = 'failed' WHERE queue_id = ?", (queue_id,))
-                                conn.commit()
-                                continue
-                        except (ValueError, TypeError):
-                            print(f"Invalid age value ({data['age']}) for patient_id {record_id}. Skipping sync operation.")
-                            cursor.execute("UPDATE sync_queue SET status = 'failed' WHERE queue_id = ?", (queue_id,))
-                            conn.commit()
-                            continue
-
-                    if 'contact' in data:
-                        contact = str(data['contact']).strip()
-                        if not re.match(r'^\+[0-9]{3}[0-9]{9}$', contact):
-                            print(f"Invalid contact ({contact}) for patient_id {record_id}. Setting to default for sync.")
-                            data['contact'] = '+254000000000'
-
-                # Convert SQLite INTEGER (0/1) to BOOLEAN for Supabase
-                if 'is_synced' in data:
-                    data['is_synced'] = bool(data['is_synced'])
-
-                # Ensure timestamps are in the correct format for Supabase
-                for key in ['created_at', 'updated_at', 'registration_date', 'prescription_date', 'sale_date']:
-                    if key in data and data[key]:
-                        try:
-                            dt = datetime.fromisoformat(data[key].replace("Z", "+00:00"))
-                            data[key] = dt.isoformat()
-                        except ValueError:
-                            dt = datetime.strptime(data[key], "%Y-%m-%d %H:%M:%S")
-                            dt = pytz.UTC.localize(dt)
-                            data[key] = dt.isoformat()
+                data = self.prepare_push_data(cursor, [queue_id], table_name, record_id, data)
+                if data is None:
+                    continue
 
                 # Push to Supabase based on operation
                 if operation == 'INSERT':
@@ -272,150 +1041,892 @@ class Database:
 
                 cursor.execute(f"UPDATE {table_name} SET is_synced = 1, sync_status = 'synced' WHERE {table_name[:-1]}_id = ?", (record_id,))
                 cursor.execute("UPDATE sync_queue SET status = 'synced' WHERE queue_id = ?", (queue_id,))
+                with self.push_outages_lock:
+                    self.push_outages = 0
 
+            except APIError as e:
+                print(f"Error syncing {operation} for {table_name} record ID {record_id}: {e}")
+                self.record_push_failure(cursor, [queue_id], e)
+                self.note_failed_dependency(cursor, str(e), data, user_ids_to_resync)
             except Exception as e:
-                error_msg = str(e)
                 print(f"Error syncing {operation} for {table_name} record ID {record_id}: {e}")
-                cursor.execute("UPDATE sync_queue SET status = 'failed' WHERE queue_id = ?", (queue_id,))
-                # Collect user_ids to resync if foreign key violation
-                if '23503' in error_msg and 'user_id' in error_msg:
-                    cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (data.get('user_id'),))
-                    user = cursor.fetchone()
-                    if user:
-                        user_ids_to_resync.add(user['user_id'])
-                elif '23503' in error_msg and 'sale_id' in error_msg:
-                    cursor.execute("SELECT sale_id FROM sales WHERE sale_id = ?", (data.get('sale_id'),))
-                    sale = cursor.fetchone()
-                    if sale:
-                        cursor.execute("SELECT user_id FROM sales WHERE sale_id = ?", (sale['sale_id'],))
-                        user = cursor.fetchone()
-                        if user:
-                            user_ids_to_resync.add(user['user_id'])
-
-        # Resync users if any dependencies failed
-        if user_ids_to_resync:
-            cursor.execute("SELECT * FROM users WHERE user_id IN ({})".format(','.join('?' * len(user_ids_to_resync))), list(user_ids_to_resync))
-            users_to_resync = cursor.fetchall()
-            for user in users_to_resync:
-                user_data = {
-                    'user_id': user['user_id'],
-                    'username': user['username'],
-                    'password_hash': user['password_hash'],
-                    'role': user['role'],
-                    'created_at': user['created_at'],
-                    'updated_at': user['updated_at'],
-                    'is_synced': bool(user['is_synced']),
-                    'sync_status': user['sync_status']
-                }
-                try:
-                    response = self.supabase.table('users').upsert(user_data).execute()
-                    print(f"Resynced user with ID {user['user_id']} to Supabase")
-                    cursor.execute("UPDATE users SET is_synced = 1, sync_status = 'synced' WHERE user_id = ?", (user['user_id'],))
-                except Exception as e:
-                    print(f"Error resyncing user ID {user['user_id']}: {e}")
-
-        conn.commit()
-        conn.close()
-
-    def sync_data(self):
-        """Synchronize local database with Supabase."""
-        if not self.supabase or not self.sync_enabled:
+                self.record_push_failure(cursor, [queue_id], e, rejected=False)
+                cursor.connection.commit()
+                raise
+            cursor.connection.commit()
+
+    def push_batched(self, cursor, pending_operations, user_ids_to_resync, cancel_event=None):
+        """Push pending operations as chunked bulk upserts and deletes.
+
+        Consecutive operations on the same table are grouped into runs of
+        upserts (INSERT/UPDATE) and deletes, keeping queue order between runs.
+        Within a run the operations for one record collapse into a single row:
+        the queued payloads are layered over the current local row so every
+        upserted row is complete. Each chunk of push_batch_size records is one
+        request, and its queue rows are marked synced together.
+        """
+        for (table_name, is_delete), run in groupby(pending_operations,
+                                                    key=lambda op: (op['table_name'], op['operation'] == 'DELETE')):
+            records = {}
+            for op in run:
+                queue_ids, data = records.setdefault(op['record_id'], ([], {}))
+                queue_ids.append(op['queue_id'])
+                data.update(self.decode_sync_payload(op['data']))
+            record_ids = list(records)
+
+            for start in range(0, len(record_ids), self.push_batch_size):
+                self.check_cancelled(cancel_event)
+                chunk = record_ids[start:start + self.push_batch_size]
+
+                if is_delete:
+                    batch = [(records[record_id][0], record_id, {}) for record_id in chunk]
+                    self.send_push_batch(cursor, table_name, 'DELETE', batch, user_ids_to_resync)
+                    continue
+
+                cursor.execute(f"SELECT * FROM {table_name} WHERE {table_name[:-1]}_id IN ({','.join('?' * len(chunk))})", chunk)
+                local_rows = {row[f"{table_name[:-1]}_id"]: dict(row) for row in cursor.fetchall()}
+                # Rows sharing one column set, since a bulk upsert sends a single column list
+                batches = {}
+                for record_id in chunk:
+                    queue_ids, payload = records[record_id]
+                    data = local_rows.get(record_id, {})
+                    data.update(payload)
+                    data = self.prepare_push_data(cursor, queue_ids, table_name, record_id, data)
+                    if data is not None:
+                        batches.setdefault(tuple(sorted(data)), []).append((queue_ids, record_id, data))
+                for batch in batches.values():
+                    self.send_push_batch(cursor, table_name, 'UPSERT', batch, user_ids_to_resync)
+
+    def send_push_batch(self, cursor, table_name, operation, batch, user_ids_to_resync):
+        """Send one bulk request for batch, a list of (queue_ids, record_id, data).
+
+        If Supabase rejects the batch it is split in half and each half resent,
+        so a single bad record ends up failed on its own while the rest sync.
+        Network errors schedule the whole batch for a retry, without using up
+        its attempts, and propagate.
+        """
+        id_column = f"{table_name[:-1]}_id"
+        record_ids = [record_id for _, record_id, _ in batch]
+        try:
+            if operation == 'DELETE':
+                self.supabase.table(table_name).delete().in_(id_column, record_ids).execute()
+            else:
+                self.supabase.table(table_name).upsert([data for _, _, data in batch]).execute()
+        except APIError as e:
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                self.send_push_batch(cursor, table_name, operation, batch[:middle], user_ids_to_resync)
+                self.send_push_batch(cursor, table_name, operation, batch[middle:], user_ids_to_resync)
+                return
+            queue_ids, record_id, data = batch[0]
+            print(f"Error syncing {operation} for {table_name} record ID {record_id}: {e}")
+            self.record_push_failure(cursor, queue_ids, e)
+            self.note_failed_dependency(cursor, str(e), data, user_ids_to_resync)
+        except Exception as e:
+            self.record_push_failure(cursor, [queue_id for queue_ids, _, _ in batch for queue_id in queue_ids], e,
+                                     rejected=False)
+            cursor.connection.commit()
+            raise
+        else:
+            with self.push_outages_lock:
+                self.push_outages = 0
+            print(f"Pushed {operation} of {len(batch)} {table_name} records to Supabase")
+            cursor.executemany(f"UPDATE {table_name} SET is_synced = 1, sync_status = 'synced' WHERE {id_column} = ?",
+                               [(record_id,) for record_id in record_ids])
+            cursor.executemany("UPDATE sync_queue SET status = 'synced' WHERE queue_id = ?",
+                               [(queue_id,) for queue_ids, _, _ in batch for queue_id in queue_ids])
+        cursor.connection.commit()
+
+    def record_push_failure(self, cursor, queue_ids, error, rejected=True):
+        """Schedule failed queue rows for a retry, or dead-letter them once out of attempts.
+
+        Each retry waits for a jittered, exponentially growing delay (see
+        SYNC_RETRY_BASE_SECONDS). Only rows Supabase rejected use up an
+        attempt; rejected=False (the request never got an answer) just
+        reschedules them. The caller commits.
+        """
+        now = datetime.utcnow()
+        if not rejected:
+            with self.push_outages_lock:
+                self.push_outages += 1
+                outages = self.push_outages
+            next_retry_at = (now + timedelta(seconds=self.retry_delay(outages))).strftime("%Y-%m-%d %H:%M:%S")
+            cursor.executemany("UPDATE sync_queue SET next_retry_at = ?, last_error = ? WHERE queue_id = ?",
+                               [(next_retry_at, str(error), queue_id) for queue_id in queue_ids])
+            return
+        retries, dead = [], []
+        for queue_id in queue_ids:
+            cursor.execute("SELECT attempts FROM sync_queue WHERE queue_id = ?", (queue_id,))
+            row = cursor.fetchone()
+            attempts = (row['attempts'] if row else 0) + 1
+            if attempts >= SYNC_MAX_ATTEMPTS:
+                dead.append(queue_id)
+                continue
+            retries.append((attempts, (now + timedelta(seconds=self.retry_delay(attempts))).strftime("%Y-%m-%d %H:%M:%S"),
+                            str(error), queue_id))
+        cursor.executemany("UPDATE sync_queue SET attempts = ?, next_retry_at = ?, last_error = ? WHERE queue_id = ?",
+                           retries)
+        cursor.executemany("UPDATE sync_queue SET attempts = attempts + 1 WHERE queue_id = ?",
+                           [(queue_id,) for queue_id in dead])
+        self.dead_letter_sync_rows(cursor, dead, error)
+
+    def retry_delay(self, failures):
+        """Seconds to wait before the retry after the given number of failures."""
+        delay = min(SYNC_RETRY_MAX_SECONDS, SYNC_RETRY_BASE_SECONDS * 2 ** (failures - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def dead_letter_sync_rows(self, cursor, queue_ids, error):
+        """Mark queue rows 'failed' with the error that stopped them; requeue_dead_letters revives them."""
+        cursor.executemany("UPDATE sync_queue SET status = 'failed', last_error = ? WHERE queue_id = ?",
+                           [(str(error), queue_id) for queue_id in queue_ids])
+
+    def requeue_dead_letters(self, table_name=None, queue_ids=None):
+        """Put dead-lettered sync_queue rows back in the queue with a fresh retry budget.
+
+        Limited to one table and/or a list of queue_ids if given; otherwise every
+        failed row is requeued. Returns the number of rows requeued.
+        """
+        query = """
+            UPDATE sync_queue SET status = 'pending', attempts = 0, next_retry_at = CURRENT_TIMESTAMP,
+                last_error = NULL
+            WHERE status = 'failed'
+        """
+        params = []
+        if table_name is not None:
+            query += " AND table_name = ?"
+            params.append(table_name)
+        if queue_ids is not None:
+            queue_ids = list(queue_ids)
+            if not queue_ids:
+                return 0
+            query += f" AND queue_id IN ({', '.join('?' * len(queue_ids))})"
+            params.extend(queue_ids)
+        conn = self.connect()
+        try:
+            count = conn.execute(query, params).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return count
+
+    def note_failed_dependency(self, cursor, error_msg, data, user_ids_to_resync):
+        """Collect user_ids to resync if a push failed on a missing user or sale."""
+        if '23503' in error_msg and 'user_id' in error_msg:
+            cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (data.get('user_id'),))
+            user = cursor.fetchone()
+            if user:
+                user_ids_to_resync.add(user['user_id'])
+        elif '23503' in error_msg and 'sale_id' in error_msg:
+            cursor.execute("SELECT sale_id FROM sales WHERE sale_id = ?", (data.get('sale_id'),))
+            sale = cursor.fetchone()
+            if sale:
+                cursor.execute("SELECT user_id FROM sales WHERE sale_id = ?", (sale['sale_id'],))
+                user = cursor.fetchone()
+                if user:
+                    user_ids_to_resync.add(user['user_id'])
+
+    def resync_users(self, cursor, user_ids_to_resync):
+        """Upsert users that dependent rows failed to reference."""
+        if not user_ids_to_resync:
             return
+        cursor.execute("SELECT * FROM users WHERE user_id IN ({})".format(','.join('?' * len(user_ids_to_resync))), list(user_ids_to_resync))
+        users_to_resync = cursor.fetchall()
+        for user in users_to_resync:
+            user_data = {
+                'user_id': user['user_id'],
+                'username': user['username'],
+                'password_hash': user['password_hash'],
+                'role': user['role'],
+                'created_at': user['created_at'],
+                'updated_at': user['updated_at'],
+                'is_synced': bool(user['is_synced']),
+                'sync_status': user['sync_status']
+            }
+            try:
+                response = self.supabase.table('users').upsert(user_data).execute()
+                print(f"Resynced user with ID {user['user_id']} to Supabase")
+                cursor.execute("UPDATE users SET is_synced = 1, sync_status = 'synced' WHERE user_id = ?", (user['user_id'],))
+            except Exception as e:
+                print(f"Error resyncing user ID {user['user_id']}: {e}")
+
+    def sync_data(self, progress=None, cancel_event=None):
+        """Synchronize local database with Supabase.
+
+        Safe to run on a worker thread. Remote changes are pulled first, so
+        conflicts with unpushed local changes are resolved locally (see
+        resolve_pulled_conflicts) and the merged rows then go out with the
+        push. Finally the table digests are compared with Supabase's and any
+        differing id buckets re-pulled (see reconcile_table). If the pull
+        fails the push still runs, and the pull's error is raised after it.
+
+        progress(phase, done, total) is called as each table finishes pulling
+        and pushing; setting cancel_event stops the sync with SyncCancelled at
+        the next row. Pulled rows are committed a page at a time. Per-table
+        push and pull times are kept in last_sync_timings. Returns True if a
+        sync ran, False if it was skipped.
+        """
+        if not self.supabase or not self.sync_enabled:
+            return False
 
         if not self.is_online():
             print("Offline: Changes will sync when online.")
-            return
+            return False
 
         print("Starting sync...")
 
-        tables = ["users", "patients", "drugs", "suppliers", "prescriptions", "sales", "sale_items"]
+        tables = [table for stage in SYNC_STAGES for table in stage]
 
-        self.push_changes(tables)
+        pulled_tables = []
+        pull_error = None
+        try:
+            pull_timings = self.run_sync_stages(
+                "pull", tables, lambda table: self.pull_table(table, pulled_tables, cancel_event), progress)
+        except SyncCancelled:
+            raise
+        except Exception as e:
+            # Local changes must not wait on a pull that keeps failing
+            print(f"Pull failed, pushing local changes anyway: {e}")
+            pull_error, pull_timings = e, {}
+        finally:
+            if pulled_tables:
+                self.notify_change(*pulled_tables)
+
+        push_timings = self.push_changes(tables, progress, cancel_event)
+        if pull_error is not None:
+            raise pull_error
+
+        reconciled = self.reconcile_tables(tables, cancel_event)
+        if reconciled:
+            self.notify_change(*reconciled)
+
+        self.last_sync_timings = {table: {"push": push_timings.get(table), "pull": pull_timings.get(table)}
+                                  for table in tables}
+        for table, timing in self.last_sync_timings.items():
+            print(f"  {table}: push {timing['push']:.2f}s, pull {timing['pull']:.2f}s")
+
+        self.last_sync_time = datetime.now(pytz.UTC)
+        self.save_last_sync_time()
+        print(f"Sync completed at {self.last_sync_time}")
 
-        conn = sqlite3.connect(self.db_path)
+        try:
+            self.archive_sync_queue()
+        except sqlite3.Error as e:
+            print(f"Error archiving sync queue: {e}")
+        return True
+
+    def pull_table(self, table, pulled_tables, cancel_event=None):
+        """Pull rows of one table changed since its checkpoint, one page at a time.
+
+        Remote rows are read in keyset order on (updated_at, id), pull_page_size
+        rows per request. Each page is applied and the table's checkpoint moved
+        past it in the same commit, so an interrupted pull resumes from the
+        last completed page and only one page is held in memory.
+        """
+        print(f"Pulling changes for {table}...")
+        conn = self.connect()
         cursor = conn.cursor()
+        id_column = f"{table[:-1]}_id"
+        try:
+            last_updated_at, last_id = self.get_sync_checkpoint(cursor, table)
+            while True:
+                self.check_cancelled(cancel_event)
+                try:
+                    response = (self.supabase.table(table).select("*")
+                                .or_(f'updated_at.gt."{last_updated_at}",'
+                                     f'and(updated_at.eq."{last_updated_at}",{id_column}.gt.{last_id})')
+                                .order("updated_at").order(id_column)
+                                .limit(self.pull_page_size).execute())
+                    remote_data = response.data
+                except Exception as e:
+                    print(f"Error fetching {table} from Supabase: {e}")
+                    break
+                if not remote_data:
+                    break
+                if table not in pulled_tables:
+                    pulled_tables.append(table)
+
+                last_updated_at, last_id = remote_data[-1]["updated_at"], remote_data[-1][id_column]
+                self.apply_remote_rows(cursor, table, remote_data)
+
+                cursor.execute("""
+                    INSERT INTO sync_checkpoints (table_name, last_updated_at, last_id) VALUES (?, ?, ?)
+                    ON CONFLICT(table_name) DO UPDATE SET last_updated_at = excluded.last_updated_at, last_id = excluded.last_id
+                """, (table, last_updated_at, last_id))
+                conn.commit()
+                if len(remote_data) < self.pull_page_size:
+                    break
+        finally:
+            # Rolls back a page left half-applied by a cancel or error
+            conn.close()
 
-        for table in tables:
-            print(f"Pulling changes for {table}...")
+    def get_sync_checkpoint(self, cursor, table):
+        """Return (updated_at, id) of the last remote row pulled into table.
+
+        Tables without a checkpoint start from the beginning. The global
+        last_sync_time is not a safe starting point: it is written even when
+        some tables failed to pull.
+        """
+        cursor.execute("SELECT last_updated_at, last_id FROM sync_checkpoints WHERE table_name = ?", (table,))
+        checkpoint = cursor.fetchone()
+        if checkpoint:
+            return checkpoint['last_updated_at'], checkpoint['last_id']
+        return datetime(1970, 1, 1, tzinfo=pytz.UTC).isoformat(), 0
+
+    def apply_remote_rows(self, cursor, table, remote_rows):
+        """Merge one page of pulled rows, setting aside rows that cannot be merged.
+
+        If the page fails as a whole it is rolled back and merged again a row
+        at a time, each row committed on its own. Rows that still fail are
+        recorded in sync_pull_failures and skipped, so one bad row holds up
+        neither the rest of the pull nor the push after it; a row is cleared
+        from sync_pull_failures once it merges. The caller commits. Returns
+        the number of rows set aside.
+        """
+        id_column = f"{table[:-1]}_id"
+        failed = []
+        try:
+            self.merge_remote_rows(cursor, table, remote_rows)
+        except sqlite3.Error as e:
+            cursor.connection.rollback()
+            print(f"Error merging pulled {table} rows, retrying one at a time: {e}")
+            for remote_row in remote_rows:
+                try:
+                    self.merge_remote_rows(cursor, table, [remote_row])
+                    cursor.connection.commit()
+                except sqlite3.Error as e:
+                    cursor.connection.rollback()
+                    failed.append((remote_row, e))
+        failed_ids = {remote_row[id_column] for remote_row, _ in failed}
+        cursor.executemany("DELETE FROM sync_pull_failures WHERE table_name = ? AND record_id = ?",
+                           [(table, remote_row[id_column]) for remote_row in remote_rows
+                            if remote_row[id_column] not in failed_ids])
+        for remote_row, error in failed:
+            print(f"Could not merge pulled {table} record ID {remote_row[id_column]}: {error}")
+            cursor.execute("""
+                INSERT OR REPLACE INTO sync_pull_failures (table_name, record_id, data, error, failed_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, (table, remote_row[id_column], json.dumps(remote_row, default=str), str(error)))
+        return len(failed)
+
+    def merge_remote_rows(self, cursor, table, remote_rows):
+        """Merge one page of pulled Supabase rows into the local table.
+
+        The page is loaded into a temp staging table with executemany. Local
+        rows without unpushed changes are merged by a single INSERT ... ON
+        CONFLICT DO UPDATE, which skips rows whose row_version and origin_id
+        already match; timestamps are converted to SQLite's format by strftime
+        inside the merge. Rows with unpushed local changes go through
+        resolve_pulled_conflicts instead. Against a Supabase schema without
+        row versions, the remote updated_at has to be newer to overwrite.
+        Columns in SYNC_DERIVED_COLUMNS keep their local values. Unsynced
+        local rows holding a unique value that a pulled row also holds are
+        renamed first (see rename_unique_collisions).
+        """
+        id_column = f"{table[:-1]}_id"
+        if table == 'patients':
+            remote_rows = [remote_row for remote_row in remote_rows if self.clean_remote_patient(remote_row)]
+        if not remote_rows:
+            return
 
-            last_sync = self.last_sync_time or datetime(1970, 1, 1, tzinfo=pytz.UTC)
+        # Pulled rows match Supabase, so they are stored as synced (which also
+        # keeps the change-capture triggers from queueing them again)
+        for remote_row in remote_rows:
+            remote_row['is_synced'] = 1
+            remote_row['sync_status'] = 'synced'
+        derived = SYNC_DERIVED_COLUMNS.get(table, ())
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [column['name'] for column in cursor.fetchall()
+                   if column['name'] in remote_rows[0] and column['name'] not in derived]
+        column_list = ", ".join(columns)
+        stage = f"pull_stage_{table}"
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} AS SELECT * FROM {table} WHERE 0")
+        cursor.execute(f"DELETE FROM temp.{stage}")
+        cursor.executemany(f"INSERT INTO temp.{stage} ({column_list}) VALUES ({', '.join('?' * len(columns))})",
+                           [tuple(remote_row.get(column) for column in columns) for remote_row in remote_rows])
+
+        # Convert Supabase timestamps to SQLite format
+        select_list = ", ".join(f"strftime('%Y-%m-%d %H:%M:%S', s.{column}) AS {column}"
+                                if column in SYNC_TIMESTAMP_COLUMNS else f"s.{column}"
+                                for column in columns)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != id_column)
+        versioned = 'row_version' in columns and 'origin_id' in columns
+        if versioned:
+            self.rename_unique_collisions(cursor, table, columns)
+            unchanged = f"""
+                SELECT 1 FROM {table} AS t WHERE t.{id_column} = s.{id_column}
+                AND t.row_version = s.row_version AND t.origin_id IS s.origin_id
+            """
+            newer = "true"
+        else:
+            unchanged = "SELECT 1 WHERE 0"
+            newer = f"excluded.updated_at > COALESCE({table}.updated_at, '')"
+        # rowcount, unlike total_changes, leaves out rows written by triggers
+        # Derived columns are inserted as 0 for the stock triggers to fill in
+        cursor.execute(f"""
+            INSERT INTO {table} ({", ".join(columns + list(derived))})
+            SELECT {", ".join([select_list] + [f"0 AS {column}" for column in derived])}
+            FROM temp.{stage} AS s WHERE NOT EXISTS ({unchanged})
+            ON CONFLICT({id_column}) DO UPDATE SET {updates}
+            WHERE {table}.is_synced = 1 AND {newer}
+        """)
+        merged = cursor.rowcount
+        conflicts = self.resolve_pulled_conflicts(cursor, table, columns, select_list, versioned)
+        print(f"Merged {merged} of {len(remote_rows)} pulled {table} rows"
+              + (f", resolved {conflicts} conflicts" if conflicts else ""))
+
+    def rename_unique_collisions(self, cursor, table, columns):
+        """Rename unsynced local rows whose UNIQUE column value a staged remote row also has.
+
+        Two tills that add the same drug (or username) offline both hold the
+        name, and only one row can keep it. Like an id collision (see
+        resolve_pulled_conflicts) this only applies to a local row that was
+        never synced and came from another node; the remote row keeps the
+        value and the local one becomes "value (2)", "value (3)", ... as a
+        local change, so both rows survive and the duplicate shows up for
+        someone to tidy. Returns the number of rows renamed.
+        """
+        id_column = f"{table[:-1]}_id"
+        timestamp = datetime.now(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
+        renamed = 0
+        for index in cursor.execute(f"PRAGMA index_list({table})").fetchall():
+            if not index['unique'] or index['origin'] == 'pk':
+                continue
+            index_columns = [row['name'] for row in cursor.execute(f"PRAGMA index_info({index['name']})").fetchall()]
+            if len(index_columns) != 1 or index_columns[0] not in columns:
+                continue
+            column = index_columns[0]
+            cursor.execute(f"""
+                SELECT t.{id_column} AS record_id, t.{column} AS value FROM {table} AS t
+                JOIN temp.pull_stage_{table} AS s ON s.{column} = t.{column}
+                WHERE t.is_synced = 0 AND t.origin_id IS NOT NULL AND t.origin_id IS NOT s.origin_id
+                AND NOT EXISTS (SELECT 1 FROM sync_base AS b
+                                WHERE b.table_name = '{table}' AND b.record_id = t.{id_column})
+            """)
+            for row in cursor.fetchall():
+                suffix = 2
+                while cursor.execute(f"""
+                    SELECT 1 FROM {table} WHERE {column} = :value
+                    UNION ALL SELECT 1 FROM temp.pull_stage_{table} WHERE {column} = :value
+                """, {"value": f"{row['value']} ({suffix})"}).fetchone():
+                    suffix += 1
+                new_value = f"{row['value']} ({suffix})"
+                cursor.execute(f"UPDATE {table} SET {column} = ?, updated_at = ? WHERE {id_column} = ?",
+                               (new_value, timestamp, row['record_id']))
+                print(f"Sync duplicate on {table}.{column} {row['value']!r}: local record ID {row['record_id']} "
+                      f"renamed to {new_value!r}")
+                renamed += 1
+        return renamed
+
+    def resolve_pulled_conflicts(self, cursor, table, columns, select_list, versioned):
+        """Reconcile staged remote rows with local rows that still have unpushed changes.
+
+        If Supabase has not changed the row since the local edits began (its
+        version is not past the one kept in sync_base) the local change simply
+        waits for the next push. Otherwise the two are merged column by column
+        against the sync_base state with resolve_conflict. The row is reset to
+        the remote state and the merged values written over it as a new local
+        change, which replaces the row's pending queue entries. Returns the
+        number of conflicts resolved.
+
+        A local row that was never synced (no sync_base entry) and has a
+        different origin_id is not the same row at all: two tills created
+        rows with the same id offline. It keeps its data and is moved to a
+        free id instead (see rekey_local_row), and the remote row takes the id.
+        """
+        id_column = f"{table[:-1]}_id"
+        cursor.execute(f"""
+            SELECT {select_list} FROM temp.pull_stage_{table} AS s
+            JOIN {table} AS t ON t.{id_column} = s.{id_column}
+            WHERE t.is_synced = 0
+        """)
+        remote_rows = [dict(row) for row in cursor.fetchall()]
+        resolved_count = 0
+        for remote in remote_rows:
+            record_id = remote[id_column]
+            cursor.execute(f"SELECT * FROM {table} WHERE {id_column} = ?", (record_id,))
+            local = dict(cursor.fetchone())
+            cursor.execute("SELECT row_version, data FROM sync_base WHERE table_name = ? AND record_id = ?",
+                           (table, record_id))
+            base_row = cursor.fetchone()
+            base = json.loads(base_row['data']) if base_row else None
+            if base is None and versioned and local['origin_id'] and local['origin_id'] != remote['origin_id']:
+                new_id = self.rekey_local_row(cursor, table, record_id)
+                derived = SYNC_DERIVED_COLUMNS.get(table, ())
+                cursor.execute(f"""
+                    INSERT INTO {table} ({", ".join(columns + list(derived))})
+                    SELECT {", ".join([select_list] + [f"0 AS {column}" for column in derived])}
+                    FROM temp.pull_stage_{table} AS s WHERE s.{id_column} = ?
+                """, (record_id,))
+                print(f"Sync id collision on {table} record ID {record_id}: local row moved to ID {new_id}")
+                resolved_count += 1
+                continue
+            if base is not None:
+                if versioned and remote['row_version'] <= base_row['row_version']:
+                    continue
+                if not versioned and (remote['updated_at'] or '') <= (base.get('updated_at') or ''):
+                    continue
+
+            resolved = self.resolve_conflict(table, base, local, remote)
+            changes = {column: value for column, value in resolved.items() if value != remote.get(column)}
+            cursor.execute("DELETE FROM sync_queue WHERE table_name = ? AND record_id = ? AND status = 'pending'",
+                           (table, record_id))
+            assignments = ", ".join(f"{column} = ?" for column in columns if column != id_column)
+            cursor.execute(f"UPDATE {table} SET {assignments} WHERE {id_column} = ?",
+                           [remote[column] for column in columns if column != id_column] + [record_id])
+            print(f"Resolved sync conflict on {table} record ID {record_id}: kept local {sorted(changes) or 'nothing'}")
+            if changes:
+                changes['updated_at'] = datetime.now(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
+                assignments = ", ".join(f"{column} = ?" for column in changes)
+                cursor.execute(f"""
+                    UPDATE {table} SET {assignments}, is_synced = 0, sync_status = 'pending'
+                    WHERE {id_column} = ?
+                """, list(changes.values()) + [record_id])
+            resolved_count += 1
+        return resolved_count
+
+    def rekey_local_row(self, cursor, table, record_id):
+        """Move an unsynced local row, and the local rows referencing it, to a free id.
+
+        The new id is past every id held locally or staged by the current
+        pull; a stock movement gets the next id in this node's range. The row's pending sync_queue entries are rewritten to the new
+        id, and referencing rows are queued with their new foreign key, so
+        the next push creates the row in Supabase instead of overwriting the
+        one that had the id. Returns the new id.
+        """
+        id_column = f"{table[:-1]}_id"
+        if table == 'stock_movements':
+            # Another till shares this node's id prefix; take the next id in the range
+            first_id, last_id = self.stock_movement_ids()
+            cursor.execute(f"""
+                SELECT MAX((SELECT COALESCE(MAX(stock_movement_id) + 1, ?) FROM stock_movements
+                            WHERE stock_movement_id BETWEEN ? AND ?),
+                           (SELECT COALESCE(MAX(stock_movement_id) + 1, 0) FROM temp.pull_stage_{table}
+                            WHERE stock_movement_id BETWEEN ? AND ?))
+            """, (first_id, first_id, last_id, first_id, last_id))
+        else:
+            cursor.execute(f"""
+                SELECT MAX((SELECT MAX({id_column}) FROM {table}),
+                           (SELECT COALESCE(MAX({id_column}), 0) FROM temp.pull_stage_{table})) + 1
+            """)
+        new_id = cursor.fetchone()[0]
+        # Referencing rows first, so the stock triggers move drug quantities
+        # off the old id before it is vacated
+        synced_tables = {synced for stage in SYNC_STAGES for synced in stage}
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        for child in [row['name'] for row in cursor.fetchall()]:
+            for foreign_key in cursor.execute(f"PRAGMA foreign_key_list({child})").fetchall():
+                if foreign_key['table'] == table:
+                    queued = ", is_synced = 0, sync_status = 'pending'" if child in synced_tables else ""
+                    cursor.execute(f"UPDATE {child} SET {foreign_key['from']} = ?{queued} WHERE {foreign_key['from']} = ?",
+                                   (new_id, record_id))
+        cursor.execute(f"UPDATE {table} SET {id_column} = ? WHERE {id_column} = ?", (new_id, record_id))
+        if table == 'drugs':
+            cursor.execute("""
+                UPDATE drugs SET quantity = MAX(0, opening_quantity
+                    + COALESCE((SELECT SUM(quantity) FROM stock_movements WHERE drug_id = drugs.drug_id), 0))
+                WHERE drug_id = ?
+            """, (new_id,))
+        cursor.execute("""
+            SELECT queue_id, data FROM sync_queue
+            WHERE table_name = ? AND record_id = ? AND status = 'pending'
+        """, (table, record_id))
+        for row in cursor.fetchall():
+            data = self.decode_sync_payload(row['data'])
+            if id_column in data:
+                data[id_column] = new_id
+            cursor.execute("UPDATE sync_queue SET record_id = ?, data = ? WHERE queue_id = ?",
+                           (new_id, self.encode_sync_payload(data) if data else row['data'], row['queue_id']))
+        return new_id
+
+    def resolve_conflict(self, table, base, local, remote):
+        """Merge a local and a remote version of one row, column by column.
+
+        A column changed on one side only takes that side's value. A column
+        changed on both sides (or any differing column when base is None) is
+        settled by the table's policy in conflict_policies. Bookkeeping
+        columns (the key, sync flags, row_version, origin_id, updated_at) are
+        left to the caller. Returns {column: merged value}.
+        """
+        policy = self.conflict_policies.get(table, {})
+        skip = {f"{table[:-1]}_id", 'is_synced', 'sync_status', 'row_version', 'origin_id', 'updated_at'}
+        resolved = {}
+        for column, remote_value in remote.items():
+            if column in skip or column not in local:
+                continue
+            local_value = local[column]
+            base_value = base.get(column) if base is not None else None
+            if local_value == remote_value or (base is not None and local_value == base_value):
+                resolved[column] = remote_value
+            elif base is not None and remote_value == base_value:
+                resolved[column] = local_value
+            else:
+                resolver = policy.get(column, policy.get("*", "remote_wins"))
+                if not callable(resolver):
+                    resolver = CONFLICT_RESOLVERS[resolver]
+                resolved[column] = resolver(base_value, local_value, remote_value)
+        return resolved
+
+    def set_conflict_policy(self, table, column, resolver):
+        """Choose how conflicting changes to table.column are merged.
+
+        resolver is a CONFLICT_RESOLVERS name or a callable(base, local, remote);
+        column "*" sets the table's default.
+        """
+        if not callable(resolver) and resolver not in CONFLICT_RESOLVERS:
+            raise ValueError(f"Unknown conflict resolver: {resolver}")
+        self.conflict_policies.setdefault(table, {})[column] = resolver
+
+    def clean_remote_patient(self, remote_row):
+        """Clamp or default invalid patient fields; returns False to skip the row."""
+        remote_id = remote_row['patient_id']
+        if 'age' in remote_row:
+            try:
+                age = int(remote_row['age'])
+                if age <= 0:
+                    print(f"Warning: Invalid age ({age}) for patient_id {remote_id}. Clamping to 1.")
+                    remote_row['age'] = 1
+                elif age > 150:
+                    print(f"Warning: Invalid age ({age}) for patient_id {remote_id}. Clamping to 150.")
+                    remote_row['age'] = 150
+            except (ValueError, TypeError):
+                print(f"Warning: Invalid age value ({remote_row['age']}) for patient_id {remote_id}. Skipping record.")
+                return False
 
+        if 'contact' in remote_row:
+            contact = str(remote_row['contact']).strip()
+            if not re.match(r'^\+[0-9]{3}[0-9]{9}$', contact):
+                print(f"Warning: Invalid contact ({contact}) for patient_id {remote_id}. Setting to default.")
+                remote_row['contact'] = '+254000000000'
+        return True
+
+    def get_local_digests(self, cursor, table, bucket_size, from_id=0, to_id=None):
+        """Digests of table's ids in [from_id, to_id) at bucket_size, as {bucket: (digest, row_count)}."""
+        group = bucket_size // SYNC_DIGEST_BUCKET_SIZE
+        query = f"""
+            SELECT bucket / {group} AS level_bucket, SUM(digest) % {SYNC_DIGEST_MODULUS} AS digest,
+                   SUM(row_count) AS row_count
+            FROM sync_digests WHERE table_name = ? AND bucket >= ?
+        """
+        params = [table, from_id // SYNC_DIGEST_BUCKET_SIZE]
+        if to_id is not None:
+            query += " AND bucket < ?"
+            params.append(to_id // SYNC_DIGEST_BUCKET_SIZE)
+        cursor.execute(query + " GROUP BY level_bucket", params)
+        return {row['level_bucket']: (row['digest'], row['row_count']) for row in cursor.fetchall()}
+
+    def get_remote_digests(self, table, bucket_size, from_id=0, to_id=None):
+        """The same digests computed by Supabase's sync_bucket_digests function."""
+        response = self.supabase.rpc("sync_bucket_digests", {
+            "table_name": table, "id_column": f"{table[:-1]}_id", "bucket_size": bucket_size,
+            "from_id": from_id, "to_id": to_id,
+        }).execute()
+        return {row['bucket']: (row['digest'], row['row_count']) for row in response.data}
+
+    def find_divergent_buckets(self, cursor, table):
+        """Walk the digest tree of table from the root; returns the id ranges that differ from Supabase.
+
+        One request per tree level compares the children of every differing
+        bucket found on the level above, so an unchanged table costs a single
+        request and a few changed rows cost a few kilobytes.
+        """
+        cursor.execute("SELECT MAX(bucket) FROM sync_digests WHERE table_name = ?", (table,))
+        top_bucket = cursor.fetchone()[0]
+        bucket_size = SYNC_DIGEST_BUCKET_SIZE
+        while top_bucket is not None and bucket_size < (top_bucket + 1) * SYNC_DIGEST_BUCKET_SIZE:
+            bucket_size *= SYNC_DIGEST_FANOUT
+
+        ranges = [(0, None)]
+        while ranges:
+            from_id = min(start for start, _ in ranges)
+            to_id = None if any(end is None for _, end in ranges) else max(end for _, end in ranges)
+            remote = self.get_remote_digests(table, bucket_size, from_id, to_id)
+            local = self.get_local_digests(cursor, table, bucket_size, from_id, to_id)
+            differing = sorted(bucket for bucket in set(remote) | set(local)
+                               if tuple(remote.get(bucket, ())) != tuple(local.get(bucket, ()))
+                               and any(start <= bucket * bucket_size and (end is None or bucket * bucket_size < end)
+                                       for start, end in ranges))
+            ranges = [(bucket * bucket_size, (bucket + 1) * bucket_size) for bucket in differing]
+            if bucket_size == SYNC_DIGEST_BUCKET_SIZE:
+                return ranges
+            bucket_size //= SYNC_DIGEST_FANOUT
+        return []
+
+    def reconcile_table(self, table, cancel_event=None):
+        """Re-pull the id buckets of table whose digests differ from Supabase.
+
+        Catches what checkpointed pulls cannot see, such as remote rows
+        written with an old updated_at. The rows of each differing bucket go
+        through merge_remote_rows, so unpushed local changes are resolved as
+        on a normal pull. Synced local rows that Supabase no longer has are
+        only reported. Returns the number of buckets re-pulled.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        id_column = f"{table[:-1]}_id"
+        try:
+            ranges = self.find_divergent_buckets(cursor, table)
+            missing = 0
+            for from_id, to_id in ranges:
+                remote_ids = set()
+                last_id = from_id - 1
+                while True:
+                    self.check_cancelled(cancel_event)
+                    remote_data = (self.supabase.table(table).select("*")
+                                   .gt(id_column, last_id).lt(id_column, to_id)
+                                   .order(id_column).limit(self.pull_page_size).execute()).data
+                    if not remote_data:
+                        break
+                    remote_ids.update(row[id_column] for row in remote_data)
+                    last_id = remote_data[-1][id_column]
+                    self.apply_remote_rows(cursor, table, remote_data)
+                    conn.commit()
+                    if len(remote_data) < self.pull_page_size:
+                        break
+                cursor.execute(f"SELECT {id_column} FROM {table} WHERE {id_column} >= ? AND {id_column} < ? AND is_synced = 1",
+                               (from_id, to_id))
+                missing += sum(1 for row in cursor.fetchall() if row[0] not in remote_ids)
+            if ranges:
+                print(f"Reconciled {len(ranges)} differing {table} buckets"
+                      + (f"; {missing} synced rows are missing from Supabase" if missing else ""))
+            return len(ranges)
+        finally:
+            conn.close()
+
+    def reconcile_tables(self, tables, cancel_event=None):
+        """Run reconcile_table over tables in sync order; returns the tables that changed."""
+        reconciled = []
+        for table in tables:
             try:
-                response = self.supabase.table(table).select("*").gt("updated_at", last_sync.isoformat()).execute()
-                remote_data = response.data
+                if self.reconcile_table(table, cancel_event):
+                    reconciled.append(table)
+            except SyncCancelled:
+                raise
             except Exception as e:
-                print(f"Error fetching {table} from Supabase: {e}")
-                continue
+                # Usually a Supabase project without sync_bucket_digests; skip the rest
+                print(f"Error comparing {table} digests with Supabase: {e}")
+                break
+        return reconciled
+
+    def archive_sync_queue(self, older_than_days=None, batch_size=1000, vacuum_pages=256):
+        """Move synced sync_queue rows older than the retention age into sync_queue_archive.
+
+        Rows are archived in queue order, batch_size at a time, as one
+        zlib-compressed JSON blob per batch; each batch commits on its own so
+        sales are never blocked for long. Afterwards up to vacuum_pages free
+        pages per batch (at least vacuum_pages) are returned to the filesystem
+        with incremental_vacuum. A database created before auto_vacuum was
+        enabled keeps its free pages until compact_database converts it.
+        Returns the number of rows archived.
+        """
+        if older_than_days is None:
+            older_than_days = self.sync_retention_days
+        cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+        conn = self.connect()
+        cursor = conn.cursor()
+        archived = batches = 0
+        try:
+            while True:
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("""
+                    SELECT * FROM sync_queue WHERE status = 'synced' AND created_at < ?
+                    ORDER BY queue_id LIMIT ?
+                """, (cutoff, batch_size))
+                rows = [dict(row) for row in cursor.fetchall()]
+                for row in rows:
+                    row['data'] = self.decode_sync_payload(row['data'])
+                if not rows:
+                    conn.rollback()
+                    break
+                created = [row['created_at'] for row in rows]
+                cursor.execute("""
+                    INSERT INTO sync_queue_archive
+                        (first_queue_id, last_queue_id, row_count, oldest_created_at, newest_created_at, rows)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (rows[0]['queue_id'], rows[-1]['queue_id'], len(rows), min(created), max(created),
+                      zlib.compress(json.dumps(rows).encode("utf-8"))))
+                cursor.executemany("DELETE FROM sync_queue WHERE queue_id = ?", [(row['queue_id'],) for row in rows])
+                conn.commit()
+                archived += len(rows)
+                batches += 1
+
+            if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                # Pages left over from earlier runs are picked up here too
+                cursor.execute(f"PRAGMA incremental_vacuum({vacuum_pages * max(1, batches)})").fetchall()
+            if archived:
+                print(f"Archived {archived} synced sync queue rows")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return archived
 
-            for remote_row in remote_data:
-                remote_id = remote_row[f"{table[:-1]}_id"]
-                remote_updated_at = datetime.fromisoformat(remote_row["updated_at"].replace("Z", "+00:00"))
-
-                if table == 'patients':
-                    if 'age' in remote_row:
-                        try:
-                            age = int(remote_row['age'])
-                            if age <= 0:
-                                print(f"Warning: Invalid age ({age}) for patient_id {remote_id}. Clamping to 1.")
-                                remote_row['age'] = 1
-                            elif age > 150:
-                                print(f"Warning: Invalid age ({age}) for patient_id {remote_id}. Clamping to 150.")
-                                remote_row['age'] = 150
-                        except (ValueError, TypeError):
-                            print(f"Warning: Invalid age value ({remote_row['age']}) for patient_id {remote_id}. Skipping record.")
-                            continue
-
-                    if 'contact' in remote_row:
-                        contact = str(remote_row['contact']).strip()
-                        if not re.match(r'^\+[0-9]{3}[0-9]{9}$', contact):
-                            print(f"Warning: Invalid contact ({contact}) for patient_id {remote_id}. Setting to default.")
-                            remote_row['contact'] = '+254000000000'
-
-                # Convert Supabase BOOLEAN to SQLite INTEGER
-                if 'is_synced' in remote_row:
-                    remote_row['is_synced'] = 1 if remote_row['is_synced'] else 0
-
-                # Convert Supabase timestamps to SQLite format
-                for key in ['created_at', 'updated_at', 'registration_date', 'prescription_date', 'sale_date']:
-                    if key in remote_row and remote_row[key]:
-                        dt = datetime.fromisoformat(remote_row[key].replace("Z", "+00:00"))
-                        remote_row[key] = dt.strftime("%Y-%m-%d %H:%M:%S")
-
-                cursor.execute(f"SELECT updated_at, is_synced FROM {table} WHERE {table[:-1]}_id = ?", (remote_id,))
-                local_row = cursor.fetchone()
-
-                if local_row:
-                    local_updated_at_str = local_row[0] if local_row[0] else "1970-01-01 00:00:00"
-                    try:
-                        # Try parsing as ISO format first
-                        local_updated_at = datetime.fromisoformat(local_updated_at_str.replace("Z", "+00:00"))
-                    except ValueError:
-                        # Fall back to expected format
-                        local_updated_at = datetime.strptime(local_updated_at_str, "%Y-%m-%d %H:%M:%S")
-                    local_updated_at = pytz.UTC.localize(local_updated_at) if local_updated_at.tzinfo is None else local_updated_at
-                    is_synced = bool(local_row[1])
-
-                    if remote_updated_at > local_updated_at:
-                        updates = ", ".join([f"{key} = ?" for key in remote_row.keys() if key != f"{table[:-1]}_id"])
-                        values = [remote_row[key] for key in remote_row.keys() if key != f"{table[:-1]}_id"] + [remote_id]
-                        cursor.execute(f"UPDATE {table} SET {updates} WHERE {table[:-1]}_id = ?", values)
-                        print(f"Updated {table[:-1]} with ID {remote_id}")
-                else:
-                    columns = ", ".join(remote_row.keys())
-                    placeholders = ", ".join(["?" for _ in remote_row])
-                    values = [remote_row[key] for key in remote_row.keys()]
-                    cursor.execute(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", values)
-                    print(f"Inserted new {table[:-1]} with ID {remote_id}")
+    def load_sync_archive(self, archive_id):
+        """Decompress one sync_queue_archive batch back into its queue rows (as dicts)."""
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT rows FROM sync_queue_archive WHERE archive_id = ?", (archive_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(zlib.decompress(row['rows'])) if row else []
 
-        conn.commit()
-        conn.close()
+    def get_sync_queue_metrics(self):
+        """Queue depth and backlog age of the sync outbox.
 
-        self.last_sync_time = datetime.now(pytz.UTC)
-        self.save_last_sync_time()
-        print(f"Sync completed at {self.last_sync_time}")
+        Returns counts of pending, due (pending and ready to push), failed
+        (dead-lettered), synced and archived rows, plus the created_at of the
+        oldest pending row and its age in seconds (0 with an empty backlog).
+        """
+        now = datetime.utcnow()
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT status, COUNT(*) FROM sync_queue GROUP BY status")
+            counts = dict(cursor.fetchall())
+            cursor.execute("SELECT COUNT(*) FROM sync_queue WHERE status = 'pending' AND next_retry_at <= ?",
+                           (now.strftime("%Y-%m-%d %H:%M:%S"),))
+            due = cursor.fetchone()[0]
+            cursor.execute("SELECT MIN(created_at) FROM sync_queue WHERE status = 'pending'")
+            oldest_pending = cursor.fetchone()[0]
+            cursor.execute("SELECT COALESCE(SUM(row_count), 0) FROM sync_queue_archive")
+            archived = cursor.fetchone()[0]
+        finally:
+            conn.close()
+        backlog_age = 0
+        if oldest_pending:
+            backlog_age = max(0, int((now - datetime.strptime(oldest_pending, "%Y-%m-%d %H:%M:%S")).total_seconds()))
+        return {
+            'pending': counts.get('pending', 0),
+            'due': due,
+            'failed': counts.get('failed', 0),
+            'synced': counts.get('synced', 0),
+            'archived': archived,
+            'oldest_pending_at': oldest_pending,
+            'backlog_age_seconds': backlog_age,
+        }
+
+    def compact_database(self):
+        """Return every free page of clinic.db to the filesystem.
+
+        A database created before auto_vacuum was enabled is converted to
+        incremental auto_vacuum here, with a full VACUUM that locks the whole
+        file while it rewrites it, so this is only run when an admin asks for
+        it. Returns the number of bytes freed.
+        """
+        conn = self.connect()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        else:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        freed = (pages - conn.execute("PRAGMA page_count").fetchone()[0]) * page_size
+        conn.close()
+        return freed
 
     def get_sync_history(self, limit=100):
-        """Retrieve sync history from sync_queue with enriched details."""
+        """Retrieve sync history from sync_queue with enriched details, after any failed pulls."""
         conn = self.connect()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM sync_queue ORDER BY created_at DESC LIMIT ?", (limit,))
@@ -425,7 +1936,7 @@ class Database:
         for item in queue_items:
             details = ""
             table_name = item['table_name']
-            data = json.loads(item['data']) if item['data'] else {}
+            data = self.decode_sync_payload(item['data'])
             if table_name == 'patients' and 'first_name' in data and 'last_name' in data:
                 details = f"Patient: {data['first_name']} {data['last_name']}"
             elif table_name == 'drugs' and 'name' in data:
@@ -438,6 +1949,10 @@ class Database:
                 details = f"Quantity: {data['quantity']}"
             elif table_name == 'suppliers' and 'name' in data:
                 details = f"Supplier: {data['name']}"
+            if item.get('last_error'):
+                attempts = item.get('attempts') or 0
+                error = f"Attempt {attempts}: {item['last_error']}" if item['status'] == 'pending' else item['last_error']
+                details = f"{details} ({error})" if details else error
             history.append({
                 'table_name': table_name,
                 'operation': item['operation'],
@@ -446,10 +1961,62 @@ class Database:
                 'timestamp': item['created_at'],
                 'details': details
             })
+        # Pulled rows that could not be merged (see apply_remote_rows)
+        cursor.execute("SELECT * FROM sync_pull_failures ORDER BY failed_at DESC LIMIT ?", (limit,))
+        history[:0] = [{
+            'table_name': row['table_name'],
+            'operation': 'PULL',
+            'record_id': row['record_id'],
+            'status': 'failed',
+            'timestamp': row['failed_at'],
+            'details': row['error']
+        } for row in cursor.fetchall()]
         
         conn.close()
         return history
 
+    def fetch_page(self, source, columns, key, sort=None, descending=False, where=None,
+                   search=None, search_columns=(), after=None, limit=200):
+        """Fetch one keyset-paged window of rows for a table view.
+
+        source is the FROM clause (table plus any joins), columns the SQL
+        expressions to select and key a unique column used as the tie-breaker.
+        Each returned row carries two extra trailing values, the sort value and
+        the key, which the caller passes back as `after` to get the next page.
+        limit=-1 returns every remaining row.
+        """
+        sort_expr = key if sort is None or sort == key else f"COALESCE({sort}, '')"
+        select_list = ", ".join(list(columns) + [f"{sort_expr} AS _sort_value", f"{key} AS _key_value"])
+        conditions, params = [], []
+        if where:
+            conditions.append(f"({where})")
+        if search and search_columns:
+            conditions.append("(" + " OR ".join(f"{column} LIKE ?" for column in search_columns) + ")")
+            params.extend([f"%{search}%"] * len(search_columns))
+        if after is not None:
+            op = "<" if descending else ">"
+            if sort_expr == key:
+                conditions.append(f"{key} {op} ?")
+                params.append(after[1])
+            else:
+                conditions.append(f"({sort_expr}, {key}) {op} (?, ?)")
+                params.extend(after)
+        direction = "DESC" if descending else "ASC"
+        query = f"SELECT {select_list} FROM {source}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if sort_expr == key:
+            query += f" ORDER BY {key} {direction} LIMIT ?"
+        else:
+            query += f" ORDER BY {sort_expr} {direction}, {key} {direction} LIMIT ?"
+        params.append(limit)
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = [tuple(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
     def authenticate_user(self, username, password):
         """Authenticate a user."""
         conn = self.connect()
@@ -498,12 +2065,7 @@ class Database:
         patient_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        self.queue_sync_operation('patients', 'INSERT', patient_id, {
-            'patient_id': patient_id, 'first_name': first_name, 'last_name': last_name, 'age': age,
-            'gender': gender, 'contact': contact, 'medical_history': medical_history,
-            'registration_date': current_time.isoformat(), 'updated_at': current_time.isoformat(),
-            'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('patients')
         return patient_id
 
     def get_patient(self, patient_id):
@@ -525,11 +2087,7 @@ class Database:
         """, (first_name, last_name, age, gender, contact, medical_history, updated_at.strftime("%Y-%m-%d %H:%M:%S"), patient_id))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('patients', 'UPDATE', patient_id, {
-            'patient_id': patient_id, 'first_name': first_name, 'last_name': last_name, 'age': age,
-            'gender': gender, 'contact': contact, 'medical_history': medical_history,
-            'updated_at': updated_at.isoformat(), 'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('patients')
         
     def delete_patient(self, patient_id):
         conn = self.connect()
@@ -537,7 +2095,7 @@ class Database:
         cursor.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('patients', 'DELETE', patient_id, {})
+        self.notify_change('patients')
 
     def get_all_drugs(self):
         """Retrieve all drugs."""
@@ -566,22 +2124,26 @@ class Database:
         return drugs
 
     def add_drug(self, name, quantity, batch_number, expiry_date, price):
-        """Add a new drug."""
+        """Add a new drug; its starting quantity is recorded as a stock receipt."""
         conn = self.connect()
         cursor = conn.cursor()
         current_time = datetime.now(pytz.UTC)
-        cursor.execute("""
-            INSERT INTO drugs (name, quantity, batch_number, expiry_date, price, created_at, updated_at, is_synced, sync_status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, 0, 'pending')
-        """, (name, quantity, batch_number, expiry_date, price, current_time.strftime("%Y-%m-%d %H:%M:%S"), current_time.strftime("%Y-%m-%d %H:%M:%S")))
-        drug_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        self.queue_sync_operation('drugs', 'INSERT', drug_id, {
-            'drug_id': drug_id, 'name': name, 'quantity': quantity, 'batch_number': batch_number,
-            'expiry_date': expiry_date, 'price': price, 'created_at': current_time.isoformat(),
-            'updated_at': current_time.isoformat(), 'is_synced': False, 'sync_status': 'pending'
-        })
+        timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            cursor.execute("""
+                INSERT INTO drugs (name, quantity, batch_number, expiry_date, price, created_at, updated_at, is_synced, sync_status)
+                VALUES (?, 0, ?, ?, ?, ?, ?, 0, 'pending')
+            """, (name, batch_number, expiry_date, price, timestamp, timestamp))
+            drug_id = cursor.lastrowid
+            if quantity:
+                self.insert_stock_movement(cursor, drug_id, 'receipt', quantity, timestamp, note="Initial stock")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.notify_change('drugs', 'stock_movements')
         return drug_id
 
     def get_drug(self, drug_id):
@@ -593,51 +2155,242 @@ class Database:
         conn.close()
         return dict(drug) if drug else None
 
-    def update_drug(self, drug_id, name, quantity, batch_number, expiry_date, price):
-        """Update a drug's details, including name."""
+    def update_drug(self, drug_id, name, quantity, batch_number, expiry_date, price, previous_quantity=None):
+        """Update a drug's details, including name.
+
+        A changed quantity is recorded as an adjustment in the stock ledger.
+        If previous_quantity (the quantity the user was shown) is given, only
+        the difference from it is applied, so sales made meanwhile on another
+        till are kept; otherwise quantity is taken as a stock count.
+        """
         conn = self.connect()
         cursor = conn.cursor()
-        updated_at = datetime.now(pytz.UTC)
-        cursor.execute("""
-            UPDATE drugs SET name = ?, quantity = ?, batch_number = ?, expiry_date = ?, price = ?, updated_at = ?, is_synced = 0, sync_status = 'pending'
-            WHERE drug_id = ?
-        """, (name, quantity, batch_number, expiry_date, price, updated_at.strftime("%Y-%m-%d %H:%M:%S"), drug_id))
-        conn.commit()
-        conn.close()
-        self.queue_sync_operation('drugs', 'UPDATE', drug_id, {
-            'drug_id': drug_id, 'name': name, 'quantity': quantity, 'batch_number': batch_number,
-            'expiry_date': expiry_date, 'price': price, 'updated_at': updated_at.isoformat(),
-            'is_synced': False, 'sync_status': 'pending'
-        })
+        timestamp = datetime.now(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                UPDATE drugs SET name = ?, batch_number = ?, expiry_date = ?, price = ?, updated_at = ?, is_synced = 0, sync_status = 'pending'
+                WHERE drug_id = ?
+            """, (name, batch_number, expiry_date, price, timestamp, drug_id))
+            if previous_quantity is None:
+                self.count_stock(cursor, drug_id, quantity, timestamp)
+            elif quantity != previous_quantity:
+                self.insert_stock_movement(cursor, drug_id, 'adjustment', quantity - previous_quantity, timestamp)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.notify_change('drugs', 'stock_movements')
 
     def reduce_drug_stock(self, drug_id, quantity):
         """Reduce the stock of a drug by the specified quantity."""
-        conn = self.connect()
-        cursor = conn.cursor()
-        cursor.execute("SELECT quantity FROM drugs WHERE drug_id = ?", (drug_id,))
+        new_quantity = self.record_stock_movement(drug_id, 'sale', quantity)
+        if new_quantity < 10:
+            return f"Warning: Stock for drug ID {drug_id} is low ({new_quantity} units remaining)."
+        return None
+
+    def insert_stock_movement(self, cursor, drug_id, movement_type, quantity, timestamp,
+                              sale_id=None, user_id=None, note=None, check_stock=True, cart_id=None):
+        """Append one row to the stock ledger and return the drug's new quantity.
+
+        quantity is unsigned except for adjustments. The stock check is part
+        of the INSERT itself (... FROM drugs WHERE quantity >= the amount
+        taken), so two tills selling the last packs cannot both succeed
+        whatever their transactions look like. Raises ValueError, leaving
+        the caller to roll back, if the drug is missing or short on stock;
+        check_stock=False skips the check for counts, which are never refused.
+        A sale cannot take stock held for other carts than cart_id (see
+        reserve_stock).
+        The row id is the next one in this node's range (see stock_movement_ids).
+        """
+        sign = STOCK_MOVEMENT_SIGNS[movement_type]
+        if sign is not None:
+            quantity = sign * abs(quantity)
+        first_id, last_id = self.stock_movement_ids()
+        if movement_type == 'sale':
+            available = """quantity - (SELECT COALESCE(SUM(r.quantity), 0) FROM stock_reservations AS r
+                                       WHERE r.drug_id = drugs.drug_id AND r.cart_id IS NOT ? AND r.expires_at > ?)"""
+            held = (cart_id, timestamp)
+        else:
+            available, held = "quantity", ()
+        cursor.execute(f"""
+            INSERT INTO stock_movements (stock_movement_id, drug_id, movement_type, quantity, sale_id, user_id, note,
+                                         created_at, updated_at, is_synced, sync_status)
+            SELECT (SELECT COALESCE(MAX(stock_movement_id) + 1, ?) FROM stock_movements
+                    WHERE stock_movement_id BETWEEN ? AND ?),
+                   drug_id, ?, ?, ?, ?, ?, ?, ?, 0, 'pending'
+            FROM drugs WHERE drug_id = ? AND (? OR {available} >= ?)
+        """, (first_id, first_id, last_id, movement_type, quantity,
+              sale_id, user_id, note, timestamp, timestamp, drug_id, not check_stock, *held, -quantity))
+        inserted = cursor.rowcount
+        cursor.execute(f"SELECT name, quantity, {available} AS available FROM drugs WHERE drug_id = ?",
+                       (*held, drug_id))
         drug = cursor.fetchone()
         if not drug:
+            raise ValueError("Drug not found.")
+        if not inserted:
+            raise ValueError(f"Insufficient stock for {drug['name']}. Available: {drug['available']}")
+        return drug['quantity']
+
+    def stock_movement_ids(self):
+        """The first and last stock_movement_id this node hands out."""
+        prefix = int(self.node_id, 16) >> (len(self.node_id) * 4 - STOCK_MOVEMENT_NODE_BITS)
+        return prefix << STOCK_MOVEMENT_ID_BITS, ((prefix + 1) << STOCK_MOVEMENT_ID_BITS) - 1
+
+    def record_stock_movement(self, drug_id, movement_type, quantity, user_id=None, sale_id=None, note=None):
+        """Record a receipt, sale, return, adjustment or write_off of stock.
+
+        quantity is the number of units moved; only adjustments are signed.
+        Returns the drug's new on-hand quantity. Raises ValueError, writing
+        nothing, if the drug is missing or the movement would take more stock
+        than there is.
+        """
+        return self.record_stock_movements({drug_id: quantity}, movement_type, user_id, sale_id, note)[drug_id]
+
+    def record_stock_movements(self, quantities, movement_type='sale', user_id=None, sale_id=None, note=None):
+        """Record one movement per drug in quantities ({drug_id: quantity}), all or nothing.
+
+        Used to take a whole cart out of stock at once. Returns {drug_id: new
+        quantity}; raises ValueError, writing nothing, if any drug is missing
+        or short on stock.
+        """
+        if movement_type not in STOCK_MOVEMENT_SIGNS:
+            raise ValueError(f"Unknown stock movement type: {movement_type}")
+        if not quantities or not all(quantities.values()):
+            raise ValueError("Quantity must not be zero.")
+        conn = self.connect()
+        cursor = conn.cursor()
+        timestamp = datetime.now(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            stock_levels = {drug_id: self.insert_stock_movement(cursor, drug_id, movement_type, quantity, timestamp,
+                                                                sale_id, user_id, note)
+                            for drug_id, quantity in quantities.items()}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
             conn.close()
+        self.notify_change('drugs', 'stock_movements')
+        return stock_levels
+
+    def count_stock(self, cursor, drug_id, counted, timestamp, user_id=None, note=None):
+        """Record the adjustment that brings the ledger to a counted quantity."""
+        cursor.execute("""
+            SELECT d.opening_quantity + COALESCE(SUM(m.quantity), 0) AS ledger_quantity
+            FROM drugs AS d LEFT JOIN stock_movements AS m ON m.drug_id = d.drug_id
+            WHERE d.drug_id = ? GROUP BY d.drug_id
+        """, (drug_id,))
+        row = cursor.fetchone()
+        if not row:
             raise ValueError("Drug not found.")
-        current_quantity = drug['quantity']
-        if current_quantity < quantity:
+        if counted != row['ledger_quantity']:
+            self.insert_stock_movement(cursor, drug_id, 'adjustment', counted - row['ledger_quantity'],
+                                       timestamp, user_id=user_id, note=note, check_stock=False)
+        # Also repairs a cache held at zero after an oversell
+        cursor.execute("UPDATE drugs SET quantity = ? WHERE drug_id = ?", (counted, drug_id))
+
+    def adjust_stock(self, drug_id, counted, user_id=None, note=None):
+        """Set a drug's on-hand quantity from a physical stock count."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        timestamp = datetime.now(pytz.UTC).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            self.count_stock(cursor, drug_id, counted, timestamp, user_id, note)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
             conn.close()
-            raise ValueError("Insufficient stock for this drug.")
-        new_quantity = current_quantity - quantity
-        updated_at = datetime.now(pytz.UTC)
+        self.notify_change('drugs', 'stock_movements')
+
+    def get_stock_movements(self, drug_id, limit=100):
+        """Retrieve a drug's most recent stock movements, newest first."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT * FROM stock_movements WHERE drug_id = ?
+            ORDER BY created_at DESC, stock_movement_id DESC LIMIT ?
+        """, (drug_id, limit))
+        movements = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return movements
+
+    def get_stock_discrepancies(self):
+        """Drugs whose cached quantity differs from opening_quantity plus their ledger.
+
+        Normally empty; a drug oversold across tills shows up here with its
+        negative ledger_quantity until a stock count is recorded.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
         cursor.execute("""
-            UPDATE drugs SET quantity = ?, updated_at = ?, is_synced = 0, sync_status = 'pending'
-            WHERE drug_id = ?
-        """, (new_quantity, updated_at.strftime("%Y-%m-%d %H:%M:%S"), drug_id))
+            SELECT d.drug_id, d.name, d.quantity, d.opening_quantity + COALESCE(SUM(m.quantity), 0) AS ledger_quantity
+            FROM drugs AS d LEFT JOIN stock_movements AS m ON m.drug_id = d.drug_id
+            GROUP BY d.drug_id HAVING d.quantity != ledger_quantity
+        """)
+        discrepancies = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return discrepancies
+
+    def reserve_stock(self, cart_id, drug_id, quantity):
+        """Hold quantity units of a drug (the cart's total for it) for an open cart.
+
+        Nothing in drugs or the ledger is written and nothing is queued for
+        sync until checkout(..., cart_id=cart_id) turns the holds into sales;
+        a cart that is cleared (release_stock) or abandoned costs no sync
+        traffic. Every hold of the cart lapses STOCK_RESERVATION_SECONDS after
+        the last call. Returns the units left for other carts and raises
+        ValueError if the drug is missing or the stock is held elsewhere.
+        """
+        if quantity <= 0:
+            raise ValueError("Quantity must be greater than 0.")
+        conn = self.connect()
+        cursor = conn.cursor()
+        current_time = datetime.now(pytz.UTC)
+        timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+        expires_at = (current_time + timedelta(seconds=STOCK_RESERVATION_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            cursor.execute("DELETE FROM stock_reservations WHERE expires_at <= ?", (timestamp,))
+            # Like a sale, the check is part of the write
+            cursor.execute("""
+                INSERT INTO stock_reservations (cart_id, drug_id, quantity, expires_at)
+                SELECT ?, drug_id, ?, ? FROM drugs
+                WHERE drug_id = ? AND quantity - (SELECT COALESCE(SUM(r.quantity), 0) FROM stock_reservations AS r
+                                                  WHERE r.drug_id = drugs.drug_id AND r.cart_id != ?) >= ?
+                ON CONFLICT (cart_id, drug_id) DO UPDATE SET quantity = excluded.quantity, expires_at = excluded.expires_at
+            """, (cart_id, quantity, expires_at, drug_id, cart_id, quantity))
+            reserved = cursor.rowcount
+            cursor.execute("UPDATE stock_reservations SET expires_at = ? WHERE cart_id = ?", (expires_at, cart_id))
+            cursor.execute("""
+                SELECT name, quantity - (SELECT COALESCE(SUM(r.quantity), 0) FROM stock_reservations AS r
+                                         WHERE r.drug_id = drugs.drug_id AND r.cart_id != ?) AS available
+                FROM drugs WHERE drug_id = ?
+            """, (cart_id, drug_id))
+            drug = cursor.fetchone()
+            if not drug:
+                raise ValueError("Drug not found.")
+            if not reserved:
+                raise ValueError(f"Insufficient stock for {drug['name']}. Available: {drug['available']}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return drug['available'] - quantity
+
+    def release_stock(self, cart_id):
+        """Drop every hold of a cart that will not be checked out."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM stock_reservations WHERE cart_id = ?", (cart_id,))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('drugs', 'UPDATE', drug_id, {
-            'drug_id': drug_id, 'quantity': new_quantity, 'updated_at': updated_at.isoformat(),
-            'is_synced': False, 'sync_status': 'pending'
-        })
-        if new_quantity < 10:
-            return f"Warning: Stock for drug ID {drug_id} is low ({new_quantity} units remaining)."
-        return None
 
     def delete_drug(self, drug_id):
         """Delete a drug."""
@@ -646,7 +2399,7 @@ class Database:
         cursor.execute("DELETE FROM drugs WHERE drug_id = ?", (drug_id,))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('drugs', 'DELETE', drug_id, {})
+        self.notify_change('drugs')
 
     def get_all_prescriptions(self):
         """Retrieve all prescriptions."""
@@ -671,7 +2424,7 @@ class Database:
         cursor.execute("DELETE FROM prescriptions WHERE prescription_id = ?", (prescription_id,))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('prescriptions', 'DELETE', prescription_id, {})
+        self.notify_change('prescriptions')
     
     def update_prescription(self, prescription_id, patient_id, user_id, diagnosis, notes, drug_id, dosage, frequency, duration, quantity_prescribed):
         conn = self.connect()
@@ -683,12 +2436,7 @@ class Database:
         """, (patient_id, user_id, diagnosis, notes, drug_id, dosage, frequency, duration, quantity_prescribed, current_time.strftime("%Y-%m-%d %H:%M:%S"), prescription_id))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('prescriptions', 'UPDATE', prescription_id, {
-            'prescription_id': prescription_id, 'patient_id': patient_id, 'user_id': user_id, 'diagnosis': diagnosis,
-            'notes': notes, 'drug_id': drug_id, 'dosage': dosage, 'frequency': frequency, 'duration': duration,
-            'quantity_prescribed': quantity_prescribed, 'updated_at': current_time.isoformat(),
-            'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('prescriptions')
         
 
     def add_prescription(self, patient_id, user_id, diagnosis, notes, drug_id, dosage, frequency, duration, quantity_prescribed):
@@ -702,12 +2450,7 @@ class Database:
         prescription_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        self.queue_sync_operation('prescriptions', 'INSERT', prescription_id, {
-            'prescription_id': prescription_id, 'patient_id': patient_id, 'user_id': user_id, 'diagnosis': diagnosis,
-            'notes': notes, 'drug_id': drug_id, 'dosage': dosage, 'frequency': frequency, 'duration': duration,
-            'quantity_prescribed': quantity_prescribed, 'prescription_date': current_time.isoformat(),
-            'updated_at': current_time.isoformat(), 'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('prescriptions')
         return prescription_id
 
     def get_all_sales(self):
@@ -731,11 +2474,7 @@ class Database:
         sale_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        self.queue_sync_operation('sales', 'INSERT', sale_id, {
-            'sale_id': sale_id, 'patient_id': patient_id, 'user_id': user_id,
-            'total_price': total_price, 'mode_of_payment': mode_of_payment, 'sale_date': current_time.isoformat(),
-            'updated_at': current_time.isoformat(), 'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('sales')
         return sale_id
 
     def add_sale_item(self, sale_id, drug_id, quantity, price):
@@ -747,14 +2486,54 @@ class Database:
             INSERT INTO sale_items (sale_id, drug_id, quantity, price, updated_at, is_synced, sync_status)
             VALUES (?, ?, ?, ?, ?, 0, 'pending')
         """, (sale_id, drug_id, quantity, price, current_time.strftime("%Y-%m-%d %H:%M:%S")))
-        sale_item_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        self.queue_sync_operation('sale_items', 'INSERT', sale_item_id, {
-            'sale_item_id': sale_item_id, 'sale_id': sale_id, 'drug_id': drug_id,
-            'quantity': quantity, 'price': price, 'updated_at': current_time.isoformat(),
-            'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('sale_items')
+
+    def checkout(self, patient_id, user_id, mode_of_payment, items, cart_id=None):
+        """Record a sale, its items and their stock movements in one transaction.
+
+        items is a list of dicts with drug_id, quantity and price (line total in KSh).
+        The stock held for cart_id (see reserve_stock) is sold and its holds dropped.
+        Returns (sale_id, stock_levels) where stock_levels maps drug_id to the
+        post-sale quantity. Raises ValueError, writing nothing, if a drug is
+        missing or short on stock.
+        """
+        if not items:
+            raise ValueError("No items added to sale.")
+        quantities = {}
+        for item in items:
+            quantities[item['drug_id']] = quantities.get(item['drug_id'], 0) + item['quantity']
+        total_price = sum(item['price'] for item in items)
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        current_time = datetime.now(pytz.UTC)
+        timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            cursor.execute("""
+                INSERT INTO sales (patient_id, user_id, total_price, mode_of_payment, sale_date, updated_at, is_synced, sync_status)
+                VALUES (?, ?, ?, ?, ?, ?, 0, 'pending')
+            """, (patient_id, user_id, total_price, mode_of_payment, timestamp, timestamp))
+            sale_id = cursor.lastrowid
+            cursor.executemany("""
+                INSERT INTO sale_items (sale_id, drug_id, quantity, price, updated_at, is_synced, sync_status)
+                VALUES (?, ?, ?, ?, ?, 0, 'pending')
+            """, [(sale_id, item['drug_id'], item['quantity'], item['price'], timestamp) for item in items])
+            # Each decrement checks the stock itself, so nothing is read up front
+            stock_levels = {drug_id: self.insert_stock_movement(cursor, drug_id, 'sale', quantity, timestamp,
+                                                                sale_id=sale_id, user_id=user_id, cart_id=cart_id)
+                            for drug_id, quantity in quantities.items()}
+            if cart_id is not None:
+                cursor.execute("DELETE FROM stock_reservations WHERE cart_id = ?", (cart_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.notify_change('sales', 'sale_items', 'stock_movements', 'drugs')
+        return sale_id, stock_levels
 
     def get_sale_items(self, sale_id):
         """Retrieve sale items for a sale with drug names."""
@@ -803,13 +2582,7 @@ class Database:
         supplier_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        self.queue_sync_operation('suppliers', 'INSERT', supplier_id, {
-            'supplier_id': supplier_id, 'name': name, 'phone': phone, 'email': email,
-            'address': address, 'products_supplied': products_supplied,
-            'last_delivery_date': last_delivery_date, 'responsible_person': responsible_person,
-            'notes': notes, 'created_at': current_time.isoformat(),
-            'updated_at': current_time.isoformat(), 'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('suppliers')
         return supplier_id
 
     def get_supplier(self, supplier_id):
@@ -834,13 +2607,7 @@ class Database:
         """, (name, phone, email, address, products_supplied, last_delivery_date, responsible_person, notes, current_time.strftime("%Y-%m-%d %H:%M:%S"), supplier_id))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('suppliers', 'UPDATE', supplier_id, {
-            'supplier_id': supplier_id, 'name': name, 'phone': phone, 'email': email,
-            'address': address, 'products_supplied': products_supplied,
-            'last_delivery_date': last_delivery_date, 'responsible_person': responsible_person,
-            'notes': notes, 'updated_at': current_time.isoformat(),
-            'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('suppliers')
 
     def get_low_stock_drugs(self):
         """Retrieve drugs with low stock."""
@@ -863,11 +2630,7 @@ class Database:
         user_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        self.queue_sync_operation('users', 'INSERT', user_id, {
-            'user_id': user_id, 'username': username, 'password_hash': password_hash, 'role': role,
-            'created_at': current_time.isoformat(), 'updated_at': current_time.isoformat(),
-            'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('users')
         return user_id
 
     def get_all_users(self):
@@ -890,10 +2653,7 @@ class Database:
         """, (username, password_hash, role, current_time.strftime("%Y-%m-%d %H:%M:%S"), user_id))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('users', 'UPDATE', user_id, {
-            'user_id': user_id, 'username': username, 'password_hash': password_hash, 'role': role,
-            'updated_at': current_time.isoformat(), 'is_synced': False, 'sync_status': 'pending'
-        })
+        self.notify_change('users')
 
     def delete_user(self, user_id):
         """Delete a user."""
@@ -902,7 +2662,7 @@ class Database:
         cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
         conn.commit()
         conn.close()
-        self.queue_sync_operation('users', 'DELETE', user_id, {})
+        self.notify_change('users')
 
     def get_current_date(self):
         """Get the current date as a string in EAT (East Africa Time)."""
@@ -1,5 +1,6 @@
 -- Drop existing tables to ensure a clean schema
 DROP TABLE IF EXISTS sync_queue;
+DROP TABLE IF EXISTS stock_movements;
 DROP TABLE IF EXISTS sale_items;
 DROP TABLE IF EXISTS sales;
 DROP TABLE IF EXISTS prescriptions;
@@ -20,6 +21,8 @@ CREATE TABLE users (
     last_login TIMESTAMP WITH TIME ZONE,
     is_synced BOOLEAN DEFAULT FALSE,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     CONSTRAINT username_not_empty CHECK (TRIM(username) != '')
 );
 
@@ -36,6 +39,8 @@ CREATE TABLE patients (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     is_synced BOOLEAN DEFAULT FALSE,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     CONSTRAINT first_name_not_empty CHECK (TRIM(first_name) != ''),
     CONSTRAINT last_name_not_empty CHECK (TRIM(last_name) != ''),
     CONSTRAINT contact_not_empty CHECK (TRIM(contact) != ''),
@@ -46,7 +51,8 @@ CREATE TABLE patients (
 CREATE TABLE drugs (
     drug_id SERIAL PRIMARY KEY,
     name TEXT NOT NULL UNIQUE,
-    quantity INTEGER NOT NULL CHECK (quantity >= 0),
+    quantity INTEGER NOT NULL DEFAULT 0,
+    opening_quantity INTEGER NOT NULL DEFAULT 0,
     batch_number TEXT NOT NULL,
     expiry_date TEXT NOT NULL,
     price REAL NOT NULL CHECK (price >= 0),
@@ -54,6 +60,8 @@ CREATE TABLE drugs (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     is_synced BOOLEAN DEFAULT FALSE,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     CONSTRAINT name_not_empty CHECK (TRIM(name) != ''),
     CONSTRAINT batch_number_not_empty CHECK (TRIM(batch_number) != ''),
     CONSTRAINT expiry_date_not_empty CHECK (TRIM(expiry_date) != '')
@@ -74,6 +82,8 @@ CREATE TABLE suppliers (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     is_synced BOOLEAN DEFAULT FALSE,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     CONSTRAINT name_not_empty CHECK (TRIM(name) != '')
 );
 
@@ -93,6 +103,8 @@ CREATE TABLE prescriptions (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     is_synced BOOLEAN DEFAULT FALSE,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL,
     FOREIGN KEY (drug_id) REFERENCES drugs(drug_id) ON DELETE CASCADE,
@@ -113,6 +125,8 @@ CREATE TABLE sales (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     is_synced BOOLEAN DEFAULT FALSE,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL,
     CONSTRAINT mode_of_payment_not_empty CHECK (TRIM(mode_of_payment) != '')
@@ -128,10 +142,66 @@ CREATE TABLE sale_items (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     is_synced BOOLEAN DEFAULT FALSE,
     sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
     FOREIGN KEY (sale_id) REFERENCES sales(sale_id) ON DELETE CASCADE,
     FOREIGN KEY (drug_id) REFERENCES drugs(drug_id) ON DELETE CASCADE
 );
 
+-- Stock Movements table: Append-only stock ledger pushed by every clinic.
+-- Ids are assigned by the clinics from per-node ranges, so they never clash.
+-- drugs.quantity is kept at opening_quantity plus the sum of movements by the
+-- triggers below; it has no CHECK because clinics selling offline can
+-- together oversell, and the ledger has to record that.
+CREATE TABLE stock_movements (
+    stock_movement_id BIGINT PRIMARY KEY,
+    drug_id INTEGER NOT NULL,
+    movement_type TEXT NOT NULL CHECK (movement_type IN ('receipt', 'sale', 'return', 'adjustment', 'write_off')),
+    quantity INTEGER NOT NULL CHECK (quantity != 0),
+    sale_id INTEGER,
+    user_id INTEGER,
+    note TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    is_synced BOOLEAN DEFAULT FALSE,
+    sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'failed')),
+    row_version INTEGER NOT NULL DEFAULT 0,
+    origin_id TEXT,
+    FOREIGN KEY (drug_id) REFERENCES drugs(drug_id) ON DELETE CASCADE,
+    FOREIGN KEY (sale_id) REFERENCES sales(sale_id) ON DELETE SET NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL
+);
+
+CREATE OR REPLACE FUNCTION set_drug_quantity() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        NEW.quantity := NEW.opening_quantity
+            + COALESCE((SELECT SUM(quantity) FROM stock_movements WHERE drug_id = NEW.drug_id), 0);
+    ELSE
+        NEW.quantity := OLD.quantity + NEW.opening_quantity - OLD.opening_quantity;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER drugs_quantity BEFORE INSERT OR UPDATE OF opening_quantity ON drugs
+FOR EACH ROW EXECUTE FUNCTION set_drug_quantity();
+
+CREATE OR REPLACE FUNCTION apply_stock_movement() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE drugs SET quantity = quantity - OLD.quantity WHERE drug_id = OLD.drug_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE drugs SET quantity = quantity + NEW.quantity WHERE drug_id = NEW.drug_id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER stock_movements_balance AFTER INSERT OR UPDATE OF drug_id, quantity OR DELETE ON stock_movements
+FOR EACH ROW EXECUTE FUNCTION apply_stock_movement();
+
 -- Sync Queue table: Tracks pending sync operations
 CREATE TABLE sync_queue (
     queue_id SERIAL PRIMARY KEY,
@@ -170,6 +240,30 @@ CREATE INDEX idx_sales_sale_date ON sales(sale_date);
 CREATE INDEX idx_sales_updated_at ON sales(updated_at);
 CREATE INDEX idx_sale_items_sale_id ON sale_items(sale_id);
 CREATE INDEX idx_sale_items_updated_at ON sale_items(updated_at);
+CREATE INDEX idx_stock_movements_drug_id ON stock_movements(drug_id, quantity);
+CREATE INDEX idx_stock_movements_updated_at ON stock_movements(updated_at);
 CREATE INDEX idx_sync_queue_status ON sync_queue(status);
 CREATE INDEX idx_sync_queue_created_at ON sync_queue(created_at);
 CREATE INDEX idx_config_key ON config(key);
+
+-- Bucket digests for sync reconciliation: for rows with from_id <= id < to_id
+-- (to_id NULL = no upper bound), the sum modulo 2147483647 of a hash of each
+-- row's (id, row_version, updated_at), grouped by id / bucket_size. Must match
+-- sync_row_hash_sql in db/database.py.
+CREATE OR REPLACE FUNCTION sync_bucket_digests(table_name TEXT, id_column TEXT, bucket_size BIGINT,
+                                               from_id BIGINT DEFAULT 0, to_id BIGINT DEFAULT NULL)
+RETURNS TABLE (bucket BIGINT, digest BIGINT, row_count BIGINT)
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    RETURN QUERY EXECUTE format(
+        'SELECT (id / $1)::BIGINT, (SUM((x * x + x + 1) %% 2147483647) %% 2147483647)::BIGINT, COUNT(*)::BIGINT
+         FROM (SELECT %1$I::BIGINT AS id,
+                      ((%1$I::BIGINT %% 2147483647) * 48271 + (row_version::BIGINT %% 2147483647) * 69621
+                       + (COALESCE(FLOOR(EXTRACT(EPOCH FROM updated_at))::BIGINT, 0) %% 2147483647) * 16807)
+                      %% 2147483647 AS x
+               FROM %2$I WHERE %1$I >= $2 AND ($3 IS NULL OR %1$I < $3)) AS hashed
+         GROUP BY 1 ORDER BY 1',
+        id_column, table_name)
+    USING bucket_size, from_id, to_id;
+END;
+$$;
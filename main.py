@@ -1,7 +1,6 @@
 import subprocess
-import socket
-from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QGridLayout
-from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QGridLayout, QStackedWidget
+from PyQt6.QtCore import Qt
 from ui.login import LoginWidget
 from ui.patient_management import PatientManagementWidget
 from ui.inventory_management import InventoryManagementWidget
@@ -11,6 +10,8 @@ from ui.supplier_management import SupplierManagementWidget
 from ui.user_management import UserManagementWidget
 from ui.settings import SettingsWidget
 from ui.reporting_dashboard import ReportingDashboardWidget
+from ui.network_monitor import NetworkMonitor
+from ui.sync_service import SyncService
 from db.database import Database
 
 
@@ -19,10 +20,16 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.setWindowTitle("MicroClinic Plus Pharmacy Manager")
         self.setGeometry(100, 100, 800, 600)
+        # One Database for the whole process; every screen borrows it as main_window.db
         self.db = Database()
         self.config = self.db.load_config()
         self.current_user = None
         self.is_high_contrast = False
+        # Management screens are built once per login and kept in the stack;
+        # a screen is refreshed on its next visit only if a table it watches changed.
+        self.screens = {}
+        self.stale_screens = set()
+        self.db.add_change_listener(self.on_data_changed)
         self.init_ui()
 
     def init_ui(self):
@@ -44,37 +51,44 @@ class MainWindow(QMainWindow):
         self.content_widget = QWidget()
         self.content_layout = QVBoxLayout(self.content_widget)
         self.layout.addWidget(self.content_widget)
+        self.stack = QStackedWidget()
+        self.content_layout.addWidget(self.stack)
 
-        # Timer for network status
-        self.status_timer = QTimer(self)
-        self.status_timer.timeout.connect(self.update_status_dot)
-        self.status_timer.start(5000)
+        # Network status is probed on a background thread and pushed here
+        self.network_monitor = NetworkMonitor(parent=self)
+        self.network_monitor.status_changed.connect(self.on_network_status)
+        self.network_monitor.start()
+
+        # Cloud sync runs off the GUI thread so sales can continue meanwhile
+        self.sync_service = SyncService(self.db, interval=self.config.get("auto_sync_interval", 300), parent=self)
+        self.sync_service.start()
 
         self.show_login()
 
-    def is_connected(self):
-        """Cross-platform, fast, safe check for internet connection."""
-        try:
-            socket.create_connection(("1.1.1.1", 53), timeout=2)
-            return True
-        except OSError:
-            return False
+    def on_network_status(self, is_online):
+        self.db.set_online_status(is_online)
+        self.update_status_dot()
+        if is_online and self.db.sync_enabled:
+            self.sync_service.request_sync()
 
     def update_status_dot(self):
-        try:
-            is_online = self.is_connected()
-        except Exception:
-            is_online = False
+        is_online = self.network_monitor.is_online
+        if is_online is None:
+            return  # First probe still running; keep "Checking..."
 
         color = "#00FF00" if is_online else "#FF0000"
         status_text = "Online" if is_online else "Offline"
         self.status_label.setText(f"● {status_text}")
         self.status_label.setStyleSheet(f"font-size: 20px; color: {color}; margin: 10px;")
 
+    def closeEvent(self, event):
+        self.sync_service.stop()
+        self.network_monitor.stop()
+        super().closeEvent(event)
+
     def show_login(self):
-        self.clear_content()
-        login_widget = LoginWidget(self)
-        self.content_layout.addWidget(login_widget)
+        self.clear_screens()
+        self.show_page(LoginWidget(self))
         self.set_title("Login")
         self.update_status_dot()
 
@@ -83,7 +97,6 @@ class MainWindow(QMainWindow):
             self.show_login()
             return
 
-        self.clear_content()
         menu_widget = QWidget()
         menu_layout = QVBoxLayout(menu_widget)
         self.set_title("Menu")
@@ -191,70 +204,79 @@ class MainWindow(QMainWindow):
 
         menu_layout.addLayout(bottom_buttons_layout)
         menu_layout.addStretch()
-        self.content_layout.addWidget(menu_widget)
+        self.show_page(menu_widget)
         self.update_status_dot()
 
     def clear_content(self):
-        while self.content_layout.count():
-            child = self.content_layout.takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()
+        """Remove transient pages (login, menu, settings); cached screens stay in the stack."""
+        cached = list(self.screens.values())
+        for index in reversed(range(self.stack.count())):
+            widget = self.stack.widget(index)
+            if widget not in cached:
+                self.stack.removeWidget(widget)
+                widget.deleteLater()
+
+    def clear_screens(self):
+        """Drop every cached screen, e.g. on logout."""
+        self.clear_content()
+        for screen in self.screens.values():
+            self.stack.removeWidget(screen)
+            screen.deleteLater()
+        self.screens = {}
+        self.stale_screens = set()
+
+    def show_page(self, widget):
+        """Show a widget that is rebuilt on every visit."""
+        self.clear_content()
+        self.stack.addWidget(widget)
+        self.stack.setCurrentWidget(widget)
 
-    def show_patient_management(self):
+    def show_screen(self, widget_class, title):
+        """Show a cached management screen, building it on first visit."""
         self.clear_content()
-        widget = PatientManagementWidget(self)
-        self.content_layout.addWidget(widget)
-        self.set_title("Patient Management")
+        screen = self.screens.get(widget_class)
+        if screen is None:
+            screen = widget_class(self)
+            self.screens[widget_class] = screen
+            self.stack.addWidget(screen)
+        elif widget_class in self.stale_screens:
+            screen.refresh()
+        self.stale_screens.discard(widget_class)
+        self.stack.setCurrentWidget(screen)
+        self.set_title(title)
         self.update_status_dot()
 
+    def on_data_changed(self, tables):
+        # May be called from a worker thread, so only mark screens stale here
+        for widget_class in list(self.screens):
+            if set(tables) & set(widget_class.watched_tables):
+                self.stale_screens.add(widget_class)
+
+    def show_patient_management(self):
+        self.show_screen(PatientManagementWidget, "Patient Management")
+
     def show_inventory_management(self):
-        self.clear_content()
-        widget = InventoryManagementWidget(self)
-        self.content_layout.addWidget(widget)
-        self.set_title("Inventory Management")
-        self.update_status_dot()
+        self.show_screen(InventoryManagementWidget, "Inventory Management")
 
     def show_prescription_logging(self):
-        self.clear_content()
-        widget = PrescriptionLoggingWidget(self)
-        self.content_layout.addWidget(widget)
-        self.set_title("Prescription Logging")
-        self.update_status_dot()
+        self.show_screen(PrescriptionLoggingWidget, "Prescription Logging")
 
     def show_sales_management(self):
-        self.clear_content()
-        widget = SalesManagementWidget(self)
-        self.content_layout.addWidget(widget)
-        self.set_title("Sales Management")
-        self.update_status_dot()
+        self.show_screen(SalesManagementWidget, "Sales Management")
 
     def show_supplier_management(self):
-        self.clear_content()
-        widget = SupplierManagementWidget(self)
-        self.content_layout.addWidget(widget)
-        self.set_title("Supplier Management")
-        self.update_status_dot()
+        self.show_screen(SupplierManagementWidget, "Supplier Management")
 
     def show_user_management(self):
-        self.clear_content()
-        widget = UserManagementWidget(self)
-        self.content_layout.addWidget(widget)
-        self.set_title("User Management")
-        self.update_status_dot()
+        self.show_screen(UserManagementWidget, "User Management")
 
     def show_settings(self):
-        self.clear_content()
-        widget = SettingsWidget(self)
-        self.content_layout.addWidget(widget)
+        self.show_page(SettingsWidget(self))
         self.set_title("Settings")
         self.update_status_dot()
 
     def show_dashboard(self):
-        self.clear_content()
-        widget = ReportingDashboardWidget(self)
-        self.content_layout.addWidget(widget)
-        self.set_title("Reporting Dashboard")
-        self.update_status_dot()
+        self.show_screen(ReportingDashboardWidget, "Reporting Dashboard")
 
     def toggle_contrast(self):
         self.is_high_contrast = not self.is_high_contrast
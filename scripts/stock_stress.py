@@ -0,0 +1,154 @@
+"""Stress the stock decrements with many tills selling from one database file.
+
+Starts --sellers processes, each with its own Database on a shared clinic.db
+in a temporary directory, as separate terminals on one shop's machine would
+be. They all sell random carts of a few drugs until everything is sold out,
+either through checkout (the default) or record_stock_movements (--mode
+movements). Afterwards it checks that no drug was oversold:
+
+    * every drug ends at 0 and never went below it,
+    * the units each seller was told it sold add up to the starting stock,
+    * the stock_movements ledger agrees with the cached drugs.quantity.
+
+    python scripts/stock_stress.py --sellers 8 --drugs 5 --stock 300
+
+Exits with status 1 if any check fails.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from db.database import Database  # noqa: E402
+
+
+def open_shop(workspace, args):
+    """A Database in workspace with args.drugs drugs of args.stock units each."""
+    os.makedirs(os.path.join(workspace, "database"), exist_ok=True)
+    shutil.copy(os.path.join(REPO_ROOT, "database", "schema.sql"), os.path.join(workspace, "database"))
+    with open(os.path.join(workspace, "database", "config.json"), "w") as f:
+        json.dump({"sync_enabled": False, "storage_profile": args.storage_profile}, f)
+    os.chdir(workspace)
+    db = Database()
+    user_id = db.add_user("stress", "x", "staff")
+    patient_id = db.add_patient("Stress", "Test", 30, "Other", "+254700000000", "")
+    drug_ids = [db.add_drug(f"Stress Drug {n}", args.stock, f"S{n:03d}", "2030-12-31", 10.0)
+                for n in range(1, args.drugs + 1)]
+    return db, user_id, patient_id, drug_ids
+
+
+def sell(seller, workspace, args, user_id, patient_id, drug_ids, barrier, results):
+    """One till: sell random carts until every drug is out of stock."""
+    os.chdir(workspace)
+    db = Database()
+    rng = random.Random(args.seed * 1000 + seller)
+    sold, sales, rejected, errors = Counter(), 0, 0, 0
+    barrier.wait()
+    started = time.perf_counter()
+    while True:
+        in_stock = [drug_id for drug_id in drug_ids if db.get_drug(drug_id)['quantity'] > 0]
+        if not in_stock:
+            break
+        cart = {drug_id: rng.randint(1, args.max_quantity)
+                for drug_id in rng.sample(in_stock, min(len(in_stock), rng.randint(1, args.cart_size)))}
+        try:
+            if args.mode == "checkout":
+                db.checkout(patient_id, user_id, "Cash",
+                            [{"drug_id": drug_id, "quantity": quantity, "price": 10.0 * quantity}
+                             for drug_id, quantity in cart.items()])
+            else:
+                db.record_stock_movements(cart, "sale", user_id=user_id)
+        except ValueError:
+            rejected += 1
+            continue
+        except Exception as e:
+            errors += 1
+            print(f"Seller {seller}: {e}")
+            continue
+        sold.update(cart)
+        sales += 1
+    results.put({"seller": seller, "sold": dict(sold), "sales": sales, "rejected": rejected,
+                 "errors": errors, "seconds": time.perf_counter() - started})
+
+
+def check(db, args, drug_ids, results):
+    """The checks the run failed, as printable messages."""
+    failures = []
+    sold = Counter()
+    for result in results:
+        sold.update(result["sold"])
+    for drug_id in drug_ids:
+        quantity = db.get_drug(drug_id)["quantity"]
+        if quantity != 0:
+            failures.append(f"drug {drug_id} ended at {quantity}, expected 0")
+        if sold[drug_id] != args.stock - quantity:
+            failures.append(f"drug {drug_id}: sellers sold {sold[drug_id]} of {args.stock - quantity} units taken")
+    for discrepancy in db.get_stock_discrepancies():
+        failures.append(f"drug {discrepancy['drug_id']}: cached quantity {discrepancy['quantity']}, "
+                        f"ledger {discrepancy['ledger_quantity']}")
+    if any(result["errors"] for result in results):
+        failures.append(f"{sum(result['errors'] for result in results)} sales failed with database errors")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sell one clinic's stock from many concurrent processes.")
+    parser.add_argument("--sellers", type=int, default=8)
+    parser.add_argument("--drugs", type=int, default=5)
+    parser.add_argument("--stock", type=int, default=300, help="starting units of each drug")
+    parser.add_argument("--cart-size", type=int, default=3, help="most drugs in one cart")
+    parser.add_argument("--max-quantity", type=int, default=3, help="most units of a drug in one cart")
+    parser.add_argument("--mode", choices=["checkout", "movements"], default="checkout")
+    parser.add_argument("--storage-profile", choices=["safe", "fast"], default="fast")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp(prefix="stock-stress-")
+    cwd = os.getcwd()
+    try:
+        db, user_id, patient_id, drug_ids = open_shop(workspace, args)
+        barrier = multiprocessing.Barrier(args.sellers + 1)
+        queue = multiprocessing.Queue()
+        sellers = [multiprocessing.Process(target=sell, args=(seller, workspace, args, user_id, patient_id,
+                                                              drug_ids, barrier, queue))
+                   for seller in range(args.sellers)]
+        for process in sellers:
+            process.start()
+        barrier.wait()
+        started = time.perf_counter()
+        results = [queue.get() for _ in sellers]
+        elapsed = time.perf_counter() - started
+        for process in sellers:
+            process.join()
+
+        print(f"\n{'seller':<8}{'sales':>8}{'units':>8}{'rejected':>10}{'errors':>8}")
+        for result in sorted(results, key=lambda result: result["seller"]):
+            print(f"{result['seller']:<8}{result['sales']:>8}{sum(result['sold'].values()):>8}"
+                  f"{result['rejected']:>10}{result['errors']:>8}")
+        sales = sum(result["sales"] for result in results)
+        print(f"\n{sales} sales by {args.sellers} sellers in {elapsed:.2f}s ({sales / elapsed:.1f} sales/s)")
+
+        failures = check(db, args, drug_ids, results)
+        db.close_connections()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL {failure}")
+        sys.exit(1)
+    print("No drug was oversold; ledger and cached stock agree.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,522 @@
+"""Local stand-in for the Supabase REST API, backed by SQLite.
+
+Implements the part of PostgREST that the sync code in db/database.py uses:
+select with eq/neq/gt/gte/lt/lte/like/ilike/is/in filters, or=(...)/and(...)
+groups, order, limit and offset, plus insert, upsert (merge or ignore
+duplicates), update, delete and the sync_bucket_digests RPC from
+db/supabase_schema.sql. Tables are created from database/schema.sql
+with the SQLite CHECK constraints dropped, timestamps stored as UTC ISO
+strings and is_synced returned as a boolean, as Postgres would. Constraint
+errors come back with Postgres error codes (23502, 23503, 23505), so
+push_changes sees the same failures it would get from Supabase.
+
+Latency, random API errors (HTTP 500) and dropped connections can be
+injected to exercise retries and to benchmark sync deterministically.
+
+Usage:
+    python scripts/supabase_standin.py --port 54321 --latency 0.05 --failure-rate 0.01
+
+then set SUPABASE_URL=http://127.0.0.1:54321 (any SUPABASE_KEY works) in .env.
+From Python:
+    with StandinServer(latency=0.02) as server:
+        db.supabase = server.client()
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database", "schema.sql")
+TABLES = ["users", "patients", "drugs", "suppliers", "prescriptions", "sales", "sale_items", "stock_movements"]
+BOOLEAN_COLUMNS = {"is_synced"}
+OPERATORS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE", "ilike": "LIKE"}
+
+
+class StandinError(Exception):
+    """A PostgREST-style error response."""
+
+    def __init__(self, status, code, message, details=None, hint=None):
+        super().__init__(message)
+        self.status = status
+        self.body = {"code": code, "message": message, "details": details, "hint": hint}
+
+
+def split_top_level(text):
+    """Split a PostgREST logic-tree body on commas outside parentheses and quotes."""
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return value
+
+
+class StandinBackend:
+    """SQLite tables shaped like the Supabase schema, plus the query translation."""
+
+    def __init__(self, db_path=":memory:"):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.lock = threading.Lock()
+        self.columns = {}
+        self.timestamp_columns = {}
+        self.primary_keys = {}
+        self.foreign_keys = {}
+        self.create_tables()
+
+    def create_tables(self):
+        """Create each synced table from schema.sql without its CHECK constraints."""
+        schema = sqlite3.connect(":memory:")
+        with open(SCHEMA_PATH, "r") as f:
+            schema.executescript(f.read())
+        for table in TABLES:
+            info = schema.execute(f"PRAGMA table_info({table})").fetchall()
+            foreign_keys = schema.execute(f"PRAGMA foreign_key_list({table})").fetchall()
+            self.columns[table] = [column[1] for column in info]
+            self.timestamp_columns[table] = {column[1] for column in info if column[2].upper() == "TIMESTAMP"}
+            self.primary_keys[table] = next(column[1] for column in info if column[5])
+            self.foreign_keys[table] = [(fk[3], fk[2], fk[4]) for fk in foreign_keys]
+
+            definitions = []
+            for _, name, declared, not_null, default, primary_key in info:
+                if primary_key:
+                    definitions.append(f"{name} INTEGER PRIMARY KEY")
+                    continue
+                definition = f"{name} {'TEXT' if declared.upper() == 'TIMESTAMP' else declared}"
+                if not_null:
+                    definition += " NOT NULL"
+                if default == "CURRENT_TIMESTAMP":
+                    definition += " DEFAULT (strftime('%Y-%m-%dT%H:%M:%S.000000+00:00', 'now'))"
+                elif default is not None:
+                    definition += f" DEFAULT {default}"
+                definitions.append(definition)
+            for column, parent, parent_column, on_delete in ((fk[3], fk[2], fk[4], fk[6]) for fk in foreign_keys):
+                definitions.append(f"FOREIGN KEY ({column}) REFERENCES {parent}({parent_column}) ON DELETE {on_delete}")
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(definitions)})")
+        schema.close()
+        # drugs.quantity follows the stock ledger, as the Postgres triggers in db/supabase_schema.sql do
+        self.conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS drugs_quantity_insert AFTER INSERT ON drugs BEGIN
+                UPDATE drugs SET quantity = NEW.opening_quantity
+                    + COALESCE((SELECT SUM(quantity) FROM stock_movements WHERE drug_id = NEW.drug_id), 0)
+                WHERE drug_id = NEW.drug_id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS drugs_quantity_opening AFTER UPDATE OF opening_quantity ON drugs BEGIN
+                UPDATE drugs SET quantity = quantity + NEW.opening_quantity - OLD.opening_quantity
+                WHERE drug_id = NEW.drug_id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS stock_movements_insert AFTER INSERT ON stock_movements BEGIN
+                UPDATE drugs SET quantity = quantity + NEW.quantity WHERE drug_id = NEW.drug_id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS stock_movements_update AFTER UPDATE OF drug_id, quantity ON stock_movements BEGIN
+                UPDATE drugs SET quantity = quantity - OLD.quantity WHERE drug_id = OLD.drug_id;
+                UPDATE drugs SET quantity = quantity + NEW.quantity WHERE drug_id = NEW.drug_id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS stock_movements_delete AFTER DELETE ON stock_movements BEGIN
+                UPDATE drugs SET quantity = quantity - OLD.quantity WHERE drug_id = OLD.drug_id;
+            END;
+        """)
+
+    def check_table(self, table):
+        if table not in self.columns:
+            raise StandinError(404, "42P01", f'relation "public.{table}" does not exist')
+
+    def check_column(self, table, column):
+        if column not in self.columns[table]:
+            raise StandinError(400, "42703", f"column {table}.{column} does not exist")
+        return column
+
+    def to_db(self, table, column, value):
+        """Convert a JSON value to what is stored: UTC ISO timestamps, 0/1 booleans."""
+        if value is None:
+            return None
+        if column in self.timestamp_columns[table]:
+            try:
+                moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+            except ValueError:
+                raise StandinError(400, "22007", f'invalid input syntax for type timestamp with time zone: "{value}"')
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+        if column in BOOLEAN_COLUMNS and isinstance(value, str):
+            return 1 if value.lower() == "true" else 0
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return value
+
+    def to_json(self, table, row):
+        row = dict(row)
+        for column in BOOLEAN_COLUMNS & set(row):
+            if row[column] is not None:
+                row[column] = bool(row[column])
+        return row
+
+    def condition(self, table, column, expression, params):
+        """SQL for one `column=op.value` filter, appending its parameters."""
+        negate = expression.startswith("not.")
+        if negate:
+            expression = expression[4:]
+        operator, _, value = expression.partition(".")
+        self.check_column(table, column)
+        if operator in OPERATORS:
+            params.append(self.to_db(table, column, unquote(value).replace("*", "%")
+                                     if operator in ("like", "ilike") else unquote(value)))
+            sql = f"{column} {OPERATORS[operator]} ?"
+            if operator == "ilike":
+                sql = f"LOWER({column}) LIKE LOWER(?)"
+        elif operator == "is":
+            sql = {"null": f"{column} IS NULL", "true": f"{column} = 1", "false": f"{column} = 0"}.get(value.lower())
+            if sql is None:
+                raise StandinError(400, "PGRST100", f'failed to parse filter (is.{value})')
+        elif operator == "in":
+            values = [unquote(item) for item in split_top_level(value.strip("()"))]
+            params.extend(self.to_db(table, column, item) for item in values)
+            sql = f"{column} IN ({', '.join('?' * len(values))})"
+        else:
+            raise StandinError(400, "PGRST100", f'failed to parse filter ({operator}.{value})')
+        return f"NOT ({sql})" if negate else sql
+
+    def logic_tree(self, table, operator, body, params):
+        """SQL for an or=(...) / and=(...) group; terms may nest further groups."""
+        terms = []
+        for term in split_top_level(body.strip()[1:-1]):
+            negate = term.startswith("not.")
+            if negate:
+                term = term[4:]
+            if term.startswith(("and(", "or(")):
+                nested_operator, _, nested_body = term.partition("(")
+                sql = self.logic_tree(table, nested_operator, "(" + nested_body, params)
+            else:
+                column, _, expression = term.partition(".")
+                sql = self.condition(table, column, expression, params)
+            terms.append(f"NOT ({sql})" if negate else sql)
+        return "(" + f" {operator.upper()} ".join(terms) + ")"
+
+    def where(self, table, query):
+        params, conditions = [], []
+        for key, value in query:
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if key in ("or", "and", "not.or", "not.and"):
+                sql = self.logic_tree(table, key.split(".")[-1], value, params)
+                conditions.append(f"NOT {sql}" if key.startswith("not.") else sql)
+            else:
+                conditions.append(self.condition(table, key, value, params))
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def select_list(self, table, query):
+        select = dict(query).get("select", "*")
+        if select == "*":
+            return "*"
+        return ", ".join(self.check_column(table, column.strip()) for column in select.split(","))
+
+    def order_by(self, table, query):
+        clauses = []
+        for key, value in query:
+            if key != "order":
+                continue
+            for item in value.split(","):
+                column, *modifiers = item.split(".")
+                clause = f"{self.check_column(table, column)} {'DESC' if 'desc' in modifiers else 'ASC'}"
+                if "nullsfirst" in modifiers:
+                    clause += " NULLS FIRST"
+                elif "nullslast" in modifiers:
+                    clause += " NULLS LAST"
+                clauses.append(clause)
+        return " ORDER BY " + ", ".join(clauses) if clauses else ""
+
+    def select(self, table, query):
+        where, params = self.where(table, query)
+        options = dict(query)
+        sql = f"SELECT {self.select_list(table, query)} FROM {table}{where}{self.order_by(table, query)}"
+        sql += f" LIMIT {int(options.get('limit', -1))} OFFSET {int(options.get('offset', 0))}"
+        rows = [self.to_json(table, row) for row in self.conn.execute(sql, params)]
+        total = self.conn.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+        return rows, total
+
+    def insert(self, table, query, payload, prefer):
+        """Insert (or upsert) one object or a list of objects atomically."""
+        rows = payload if isinstance(payload, list) else [payload]
+        columns_param = dict(query).get("columns")
+        fill_missing = columns_param is not None and "missing=default" not in prefer
+        all_columns = [unquote(column) for column in columns_param.split(",")] if columns_param else None
+        conflict_column = self.check_column(table, dict(query).get("on_conflict") or self.primary_keys[table])
+
+        inserted = []
+        self.conn.execute("BEGIN")
+        try:
+            for row in rows:
+                columns = all_columns if fill_missing else list(row)
+                for column in columns:
+                    self.check_column(table, column)
+                values = [self.to_db(table, column, row.get(column)) for column in columns]
+                sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+                if "resolution=merge-duplicates" in prefer:
+                    updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != conflict_column)
+                    sql += f" ON CONFLICT({conflict_column}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")
+                elif "resolution=ignore-duplicates" in prefer:
+                    sql += f" ON CONFLICT({conflict_column}) DO NOTHING"
+                try:
+                    inserted.extend(self.conn.execute(sql + " RETURNING *", values).fetchall())
+                except sqlite3.IntegrityError as e:
+                    raise self.integrity_error(table, dict(zip(columns, values)), e)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [self.to_json(table, row) for row in inserted]
+
+    def update(self, table, query, payload):
+        where, params = self.where(table, query)
+        columns = [self.check_column(table, column) for column in payload]
+        values = [self.to_db(table, column, payload[column]) for column in columns]
+        sql = f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)}{where} RETURNING *"
+        try:
+            return [self.to_json(table, row) for row in self.conn.execute(sql, values + params).fetchall()]
+        except sqlite3.IntegrityError as e:
+            raise self.integrity_error(table, payload, e)
+
+    def delete(self, table, query):
+        where, params = self.where(table, query)
+        try:
+            return [self.to_json(table, row) for row in self.conn.execute(f"DELETE FROM {table}{where} RETURNING *", params).fetchall()]
+        except sqlite3.IntegrityError as e:
+            raise self.integrity_error(table, {}, e)
+
+    def rpc(self, function, params):
+        """Run a database function called through /rest/v1/rpc/<function>."""
+        if function != "sync_bucket_digests":
+            raise StandinError(404, "PGRST202", f"Could not find the function public.{function} in the schema cache")
+        table, id_column = params["table_name"], params["id_column"]
+        self.check_table(table)
+        self.check_column(table, id_column)
+        m = 2147483647
+        x = (f"((({id_column} % {m}) * 48271 + (row_version % {m}) * 69621"
+             f" + (COALESCE(CAST(strftime('%s', updated_at) AS INTEGER), 0) % {m}) * 16807) % {m})")
+        rows = self.conn.execute(f"""
+            SELECT {id_column} / :size AS bucket, SUM(({x} * {x} + {x} + 1) % {m}) % {m} AS digest, COUNT(*) AS row_count
+            FROM {table} WHERE {id_column} >= :from_id AND (:to_id IS NULL OR {id_column} < :to_id)
+            GROUP BY 1 ORDER BY 1
+        """, {"size": params["bucket_size"], "from_id": params.get("from_id", 0), "to_id": params.get("to_id")})
+        return [dict(row) for row in rows]
+
+    def integrity_error(self, table, row, error):
+        """Translate a SQLite constraint failure into the Postgres error Supabase returns."""
+        message = str(error)
+        if message.startswith("NOT NULL constraint failed"):
+            column = message.rsplit(".", 1)[-1]
+            return StandinError(400, "23502", f'null value in column "{column}" of relation "{table}" violates not-null constraint')
+        if message.startswith("UNIQUE constraint failed"):
+            column = message.rsplit(".", 1)[-1]
+            return StandinError(409, "23505", f'duplicate key value violates unique constraint "{table}_{column}_key"',
+                                f"Key ({column})=({row.get(column)}) already exists.")
+        if message.startswith("FOREIGN KEY constraint failed"):
+            for column, parent, parent_column in self.foreign_keys[table]:
+                value = row.get(column)
+                if value is not None and self.conn.execute(
+                        f"SELECT 1 FROM {parent} WHERE {parent_column} = ?", (value,)).fetchone() is None:
+                    return StandinError(409, "23503",
+                                        f'insert or update on table "{table}" violates foreign key constraint "{table}_{column}_fkey"',
+                                        f'Key ({column})=({value}) is not present in table "{parent}".')
+            return StandinError(409, "23503", f'update or delete on table "{table}" violates a foreign key constraint')
+        return StandinError(400, "23514", message)
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_rest("GET")
+
+    def do_POST(self):
+        self.handle_rest("POST")
+
+    def do_PATCH(self):
+        self.handle_rest("PATCH")
+
+    def do_DELETE(self):
+        self.handle_rest("DELETE")
+
+    def handle_rest(self, method):
+        standin = self.server.standin
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if standin.inject_faults(self, method):
+            return
+
+        url = urlsplit(self.path)
+        prefer = self.headers.get("Prefer", "")
+        backend = standin.backend
+        try:
+            if not url.path.startswith("/rest/v1/"):
+                raise StandinError(404, "PGRST125", f"Invalid path specified in request URL: {url.path}")
+            table = url.path[len("/rest/v1/"):].strip("/")
+            query = parse_qsl(url.query, keep_blank_values=True)
+            payload = json.loads(body) if body else {}
+            with backend.lock:
+                total = None
+                is_rpc = table.startswith("rpc/")
+                if not is_rpc:
+                    backend.check_table(table)
+                if is_rpc:
+                    rows, status, prefer = backend.rpc(table[len("rpc/"):], payload), 200, ""
+                elif method == "GET":
+                    rows, total = backend.select(table, query)
+                    status = 200
+                elif method == "POST":
+                    rows, status = backend.insert(table, query, payload, prefer), 201
+                elif method == "PATCH":
+                    rows, status = backend.update(table, query, payload), 200
+                else:
+                    rows, status = backend.delete(table, query), 200
+        except StandinError as e:
+            self.send_json(e.status, e.body)
+            return
+        except (ValueError, sqlite3.Error) as e:
+            self.send_json(400, {"code": "PGRST100", "message": str(e), "details": None, "hint": None})
+            return
+
+        headers = {}
+        if "count=" in prefer:
+            count = total if total is not None else len(rows)
+            headers["Content-Range"] = f"0-{max(len(rows) - 1, 0)}/{count}"
+        if "return=minimal" in prefer and method != "GET":
+            self.send_json(204 if method != "POST" else 201, None, headers)
+        else:
+            self.send_json(status, rows, headers)
+
+    def send_json(self, status, body, headers=None):
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StandinServer:
+    """In-process HTTP server speaking the PostgREST subset used by sync.
+
+    latency (+ up to `jitter`) seconds are added to every request. A share of
+    requests given by failure_rate answer HTTP 500 (the client raises
+    APIError); drop_rate closes the connection without answering (the client
+    sees a network error). seed makes the injected faults repeatable.
+    """
+
+    key = "standin.local.key"
+
+    def __init__(self, host="127.0.0.1", port=0, db_path=":memory:", latency=0.0, jitter=0.0,
+                 failure_rate=0.0, drop_rate=0.0, seed=None):
+        self.backend = StandinBackend(db_path)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self._stats_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), StandinRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.standin = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def inject_faults(self, handler, method):
+        """Apply latency and injected failures; returns True if the request was consumed."""
+        with self._stats_lock:
+            self.requests[method] += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            roll = self.random.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.drop_rate:
+            handler.close_connection = True
+            return True
+        if roll < self.drop_rate + self.failure_rate:
+            handler.send_json(500, {"code": "XX000", "message": "Injected failure", "details": None, "hint": None})
+            return True
+        return False
+
+    def client(self):
+        """A supabase-py client pointed at this server."""
+        from supabase import create_client
+        return create_client(self.url, self.key)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="supabase-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local Supabase REST stand-in backed by SQLite.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--db", default=":memory:", help="SQLite file for the remote tables (default: in memory)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra random seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of connections closed without a response")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = StandinServer(args.host, args.port, args.db, args.latency, args.jitter,
+                           args.failure_rate, args.drop_rate, args.seed)
+    print(f"Supabase stand-in listening on {server.url}")
+    print(f"Set SUPABASE_URL={server.url} and SUPABASE_KEY={server.key} in .env to sync against it.")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
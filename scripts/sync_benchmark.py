@@ -0,0 +1,255 @@
+"""Benchmark cloud sync against the local Supabase stand-in.
+
+Generates a synthetic clinic (patients, drugs, and K sales a day for D days
+with their sale items and prescriptions), which the sync triggers queue just
+as they queue the app's own writes, and times three scenarios against
+scripts/supabase_standin.py:
+
+    push        push_changes of the whole queue into an empty backend
+    pull        sync_data of a fresh install against the populated backend
+    round-trip  sync_data (pull then push) of a fresh clinic
+
+For each scenario it reports rows per second, the number of HTTP requests,
+p50/p99 request latency and peak Python memory (tracemalloc, which also adds
+some overhead to the timings). Results can be saved and later compared, so a
+release can be checked against the previous one:
+
+    python scripts/sync_benchmark.py --days 30 --latency 0.02 --save baseline.json
+    python scripts/sync_benchmark.py --days 30 --latency 0.02 --compare baseline.json
+
+--compare exits with status 1 if throughput drops, or p99 latency grows, by
+more than --tolerance (20% by default).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "scripts"))
+
+from db.database import Database, SYNC_STAGES  # noqa: E402
+from supabase_standin import StandinServer  # noqa: E402
+
+FIRST_NAMES = ["Amina", "Brian", "Cynthia", "David", "Esther", "Felix", "Grace", "Hassan", "Irene", "James"]
+LAST_NAMES = ["Achieng", "Barasa", "Chebet", "Kamau", "Mwangi", "Njeri", "Otieno", "Wafula", "Wanjiru"]
+DIAGNOSES = ["Malaria", "Typhoid", "Flu", "Hypertension", "Diabetes", "UTI", "Allergy"]
+PAYMENT_MODES = ["Cash", "Card", "Mobile"]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def open_clinic(workspace):
+    """A Database living in its own temporary directory, with sync enabled."""
+    os.makedirs(os.path.join(workspace, "database"), exist_ok=True)
+    shutil.copy(os.path.join(REPO_ROOT, "database", "schema.sql"), os.path.join(workspace, "database"))
+    with open(os.path.join(workspace, "database", "config.json"), "w") as f:
+        json.dump({"sync_enabled": True, "storage_profile": "fast"}, f)
+    os.chdir(workspace)
+    db = Database()
+    db.sync_enabled = True
+    db.set_online_status(True)
+    return db
+
+
+def generate_clinic(db, args):
+    """Fill db with a synthetic clinic; the sync triggers queue every row. Returns the row count."""
+    rng = random.Random(args.seed)
+    start = datetime(2025, 1, 1, 8, 0, 0)
+    stamp = start.strftime("%Y-%m-%d %H:%M:%S")
+    conn = db.connect()
+    cursor = conn.cursor()
+    inserted = 0
+
+    def add(table, rows):
+        nonlocal inserted
+        columns = list(rows[0])
+        cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                           [tuple(row.values()) for row in rows])
+        inserted += len(rows)
+
+    add("users", [{"user_id": user_id, "username": f"bench{user_id}", "password_hash": "x",
+                   "role": "admin" if user_id == 1 else "staff", "created_at": stamp, "updated_at": stamp}
+                  for user_id in range(1, args.users + 1)])
+    add("patients", [{"patient_id": patient_id, "first_name": rng.choice(FIRST_NAMES),
+                      "last_name": rng.choice(LAST_NAMES), "age": rng.randint(1, 90),
+                      "gender": rng.choice(["Male", "Female"]), "contact": f"+254{rng.randint(700000000, 799999999)}",
+                      "registration_date": stamp, "updated_at": stamp}
+                     for patient_id in range(1, args.patients + 1)])
+    add("drugs", [{"drug_id": drug_id, "name": f"Drug {drug_id}", "opening_quantity": rng.randint(100, 5000),
+                   "batch_number": f"B{drug_id:05d}", "expiry_date": "2027-12-31",
+                   "price": round(rng.uniform(10, 2000), 2), "created_at": stamp, "updated_at": stamp}
+                  for drug_id in range(1, args.drugs + 1)])
+    add("suppliers", [{"supplier_id": supplier_id, "name": f"Supplier {supplier_id}", "phone": "+254700000000",
+                       "created_at": stamp, "updated_at": stamp}
+                      for supplier_id in range(1, max(1, args.drugs // 20) + 1)])
+
+    sales, items, prescriptions = [], [], []
+    for day in range(args.days):
+        for _ in range(args.sales_per_day):
+            moment = (start + timedelta(days=day, seconds=rng.randint(0, 10 * 3600))).strftime("%Y-%m-%d %H:%M:%S")
+            sale_id = len(sales) + 1
+            patient_id = rng.randint(1, args.patients)
+            user_id = rng.randint(1, args.users)
+            total = 0.0
+            for _ in range(rng.randint(1, 2 * args.items_per_sale - 1)):
+                price = round(rng.uniform(10, 2000), 2)
+                total += price
+                items.append({"sale_item_id": len(items) + 1, "sale_id": sale_id, "drug_id": rng.randint(1, args.drugs),
+                              "quantity": rng.randint(1, 5), "price": price, "updated_at": moment})
+            sales.append({"sale_id": sale_id, "patient_id": patient_id, "user_id": user_id, "total_price": round(total, 2),
+                          "sale_date": moment, "mode_of_payment": rng.choice(PAYMENT_MODES), "updated_at": moment})
+            if rng.random() < 0.5:
+                prescriptions.append({"prescription_id": len(prescriptions) + 1, "patient_id": patient_id,
+                                      "user_id": user_id, "diagnosis": rng.choice(DIAGNOSES), "drug_id": rng.randint(1, args.drugs),
+                                      "dosage": "1 tab", "frequency": "3x daily", "duration": "5 days",
+                                      "quantity_prescribed": 15, "prescription_date": moment, "updated_at": moment})
+    for table, rows in (("sales", sales), ("sale_items", items), ("prescriptions", prescriptions)):
+        if rows:
+            add(table, rows)
+
+    conn.commit()
+    conn.close()
+    return inserted
+
+
+def run_scenario(name, server, db, action, rows):
+    """Time action() with request latencies and peak memory recorded."""
+    client = server.client()
+    latencies = []
+
+    def on_request(request):
+        request.extensions["benchmark_started"] = time.perf_counter()
+
+    def on_response(response):
+        latencies.append(time.perf_counter() - response.request.extensions["benchmark_started"])
+
+    client.postgrest.session.event_hooks = {"request": [on_request], "response": [on_response]}
+    db.supabase = client
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    action()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "scenario": name,
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else 0.0,
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "peak_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def tune(db, args):
+    if args.batch_size is not None:
+        db.push_batch_size = args.batch_size
+    if args.page_size is not None:
+        db.pull_page_size = args.page_size
+    if args.workers is not None:
+        db.sync_workers = args.workers
+
+
+def run_benchmarks(args):
+    tables = [table for stage in SYNC_STAGES for table in stage]
+    workspace = tempfile.mkdtemp(prefix="sync-benchmark-")
+    cwd = os.getcwd()
+    results = []
+    try:
+        with StandinServer(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                           seed=args.seed) as server:
+            source = open_clinic(os.path.join(workspace, "source"))
+            tune(source, args)
+            rows = generate_clinic(source, args)
+            print(f"Generated clinic: {rows} rows queued for sync")
+            results.append(run_scenario("push", server, source, lambda: source.push_changes(tables), rows))
+
+            fresh = open_clinic(os.path.join(workspace, "fresh"))
+            tune(fresh, args)
+            results.append(run_scenario("pull", server, fresh, fresh.sync_data, rows))
+
+        with StandinServer(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                           seed=args.seed) as server:
+            clinic = open_clinic(os.path.join(workspace, "round-trip"))
+            tune(clinic, args)
+            rows = generate_clinic(clinic, args)
+            results.append(run_scenario("round-trip", server, clinic, clinic.sync_data, rows))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print regressions against a saved baseline; returns True if there were any."""
+    previous = {result["scenario"]: result for result in baseline["results"]}
+    regressed = False
+    for result in results:
+        before = previous.get(result["scenario"])
+        if not before:
+            continue
+        if result["rows_per_second"] < before["rows_per_second"] * (1 - tolerance):
+            print(f"REGRESSION {result['scenario']}: {result['rows_per_second']} rows/s "
+                  f"(baseline {before['rows_per_second']})")
+            regressed = True
+        if before["p99_ms"] and result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            print(f"REGRESSION {result['scenario']}: p99 {result['p99_ms']} ms (baseline {before['p99_ms']})")
+            regressed = True
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark push/pull sync against a local Supabase stand-in.")
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--drugs", type=int, default=200)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--sales-per-day", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--items-per-sale", type=int, default=2, help="average sale items per sale")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of simulated network latency per request")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=None, help="override push_batch_size")
+    parser.add_argument("--page-size", type=int, default=None, help="override pull_page_size")
+    parser.add_argument("--workers", type=int, default=None, help="override sync_workers")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+
+    print(f"\n{'scenario':<12}{'rows':>8}{'seconds':>10}{'rows/s':>10}{'requests':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for result in results:
+        print(f"{result['scenario']:<12}{result['rows']:>8}{result['seconds']:>10}{result['rows_per_second']:>10}"
+              f"{result['requests']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}{result['peak_mb']:>10}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=4)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Check that two tills creating rows with the same ids offline both keep them.
+
+Two clinics share one Supabase stand-in (scripts/supabase_standin.py). After
+an initial sync both go offline and each registers a patient and sells to
+them, so both tills hand out the same patient_id and sale_id. Both also add
+a drug called Amoxil, whose name is UNIQUE. Then A syncs, B syncs and A syncs
+again. B's pull meets A's rows under ids, and a drug name, that B already
+used for rows of its own that were never synced; B must move its rows to new
+ids and rename its drug rather than merge them into A's or stop syncing.
+
+Afterwards both tills and Supabase must hold both patients, both sales, each
+with its own item and stock movement, and both drugs, with the same stock
+levels and nothing left waiting to sync:
+
+    python scripts/sync_collision_check.py
+
+Exits with status 1 if any check fails.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "scripts"))
+
+from supabase_standin import StandinServer  # noqa: E402
+from sync_benchmark import open_clinic  # noqa: E402
+
+
+def sales_of(rows_by_table):
+    """{(patient first name, total, units, movement quantity)} from one copy of the tables."""
+    patients = {row['patient_id']: row['first_name'] for row in rows_by_table['patients']}
+    items = {row['sale_id']: row['quantity'] for row in rows_by_table['sale_items']}
+    movements = {row['sale_id']: row['quantity'] for row in rows_by_table['stock_movements'] if row['sale_id']}
+    return Counter((patients.get(sale['patient_id']), float(sale['total_price']), items.get(sale['sale_id']),
+                    movements.get(sale['sale_id'])) for sale in rows_by_table['sales'])
+
+
+def local_rows(db, workspace):
+    os.chdir(workspace)
+    conn = db.connect()
+    rows = {table: [dict(row) for row in conn.execute(f"SELECT * FROM {table}")]
+            for table in ("patients", "sales", "sale_items", "stock_movements")}
+    conn.close()
+    return rows
+
+
+def main():
+    base = tempfile.mkdtemp(prefix="sync-collision-")
+    cwd = os.getcwd()
+    failures = []
+    try:
+        with StandinServer() as server:
+            till_a, till_b = os.path.join(base, "a"), os.path.join(base, "b")
+            a = open_clinic(till_a)
+            a.supabase = server.client()
+            user_id = a.add_user("nurse", "x", "staff")
+            drug_id = a.add_drug("Paracetamol", 100, "B1", "2030-12-31", 10.0)
+            a.sync_data()
+            b = open_clinic(till_b)
+            b.supabase = server.client()
+            b.sync_data()
+
+            # Offline on both tills: the same patient_id and sale_id on each
+            os.chdir(till_a)
+            patient_a = a.add_patient("Wanjiru", "Mwangi", 30, "Female", "+254712345678", "")
+            a.checkout(patient_a, user_id, "Cash", [{"drug_id": drug_id, "quantity": 5, "price": 50.0}])
+            os.chdir(till_b)
+            patient_b = b.add_patient("Kamau", "Otieno", 41, "Male", "+254722345678", "")
+            b.checkout(patient_b, user_id, "Cash", [{"drug_id": drug_id, "quantity": 7, "price": 70.0}])
+            os.chdir(till_a)
+            a.add_drug("Amoxil", 20, "A1", "2030-12-31", 15.0)
+            os.chdir(till_b)
+            b.add_drug("Amoxil", 30, "A2", "2030-12-31", 15.0)
+            print(f"Both tills created patient {patient_a}/{patient_b}, their first sale and Amoxil offline")
+
+            for workspace, db in ((till_a, a), (till_b, b), (till_a, a)):
+                os.chdir(workspace)
+                db.sync_data()
+
+            expected = Counter({("Wanjiru", 50.0, 5, -5): 1, ("Kamau", 70.0, 7, -7): 1})
+            client = server.client()
+            remote = {table: client.table(table).select("*").execute().data
+                      for table in ("patients", "sales", "sale_items", "stock_movements")}
+            copies = {"supabase": remote, "till A": local_rows(a, till_a), "till B": local_rows(b, till_b)}
+            for name, rows in copies.items():
+                sales = sales_of(rows)
+                print(f"{name}: {sorted(sales.elements())}")
+                if sales != expected:
+                    failures.append(f"{name} holds sales {dict(sales)}, expected {dict(expected)}")
+            expected_drugs = {"Paracetamol": 88, "Amoxil": 20, "Amoxil (2)": 30}
+            remote_drugs = {row['name']: row['quantity'] for row in client.table("drugs").select("*").execute().data}
+            print(f"supabase drugs: {remote_drugs}")
+            if remote_drugs != expected_drugs:
+                failures.append(f"supabase holds drugs {remote_drugs}, expected {expected_drugs}")
+            for workspace, name, db in ((till_a, "till A", a), (till_b, "till B", b)):
+                os.chdir(workspace)
+                drugs = {drug['name']: drug['quantity'] for drug in db.get_all_drugs()}
+                if drugs != expected_drugs:
+                    failures.append(f"{name} holds drugs {drugs}, expected {expected_drugs}")
+                quantity = db.get_drug(drug_id)['quantity']
+                if quantity != 88:
+                    failures.append(f"{name} shows {quantity} units in stock, expected 88")
+                if db.get_sync_queue_metrics()['pending']:
+                    failures.append(f"{name} still has changes waiting to sync")
+            os.chdir(till_a)
+            a.close_connections()
+            os.chdir(till_b)
+            b.close_connections()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(base, ignore_errors=True)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL {failure}")
+        sys.exit(1)
+    print("Both tills kept their offline rows.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,16 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-                             QPushButton, QTableWidget, QTableWidgetItem, QHeaderView,
+                             QPushButton, QTableView, QHeaderView,
                              QMessageBox)
 from PyQt6.QtCore import Qt
-from db.database import Database
+from ui.sql_table_model import SqlTableModel
 
 class InventoryManagementWidget(QWidget):
+    watched_tables = ("drugs",)
+
     def __init__(self, main_window):
         super().__init__()
         self.main_window = main_window
-        self.db = Database()
+        self.db = self.main_window.db
         self.init_ui()
 
     def init_ui(self):
@@ -190,19 +192,26 @@ class InventoryManagementWidget(QWidget):
         button_layout.addWidget(back_button)
         main_layout.addLayout(button_layout)
 
-        # Drug table
-        self.drug_table = QTableWidget()
-        self.drug_table.setColumnCount(6)
-        self.drug_table.setHorizontalHeaderLabels(["ID", "Name", "Quantity", "Batch Number", "Expiry Date", "Price"])
+        # Drug table (rows are paged in from SQLite as the view scrolls)
+        self.drug_model = SqlTableModel(self.db, "drugs", [
+            ("ID", "drug_id"), ("Name", "name"), ("Quantity", "quantity"),
+            ("Batch Number", "batch_number"), ("Expiry Date", "expiry_date"), ("Price", "price")
+        ], key="drug_id", default_sort=1, search_columns=("name", "batch_number"),
+            formatters={5: lambda value: f"{value:.2f}"})
+        self.drug_table = QTableView()
+        self.drug_table.setModel(self.drug_model)
+        self.drug_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.drug_table.horizontalHeader().setSortIndicator(1, Qt.SortOrder.AscendingOrder)
+        self.drug_table.setSortingEnabled(True)
         self.drug_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.drug_table.setToolTip("List of drugs in inventory")
         self.drug_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 font-size: 14px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
             }
         """)
@@ -213,25 +222,21 @@ class InventoryManagementWidget(QWidget):
 
         self.load_drugs()
 
+    def refresh(self):
+        """Reload data after the cached screen went stale."""
+        self.load_drugs()
+
     def load_drugs(self):
-        drugs = self.db.get_all_drugs()
-        self.drug_table.setRowCount(len(drugs))
-        for row, drug in enumerate(drugs):
-            self.drug_table.setItem(row, 0, QTableWidgetItem(str(drug['drug_id'])))
-            self.drug_table.setItem(row, 1, QTableWidgetItem(drug['name']))
-            self.drug_table.setItem(row, 2, QTableWidgetItem(str(drug['quantity'])))
-            self.drug_table.setItem(row, 3, QTableWidgetItem(drug['batch_number']))
-            self.drug_table.setItem(row, 4, QTableWidgetItem(drug['expiry_date']))
-            self.drug_table.setItem(row, 5, QTableWidgetItem(f"{drug['price']:.2f}"))
+        self.drug_model.refresh()
 
     def load_drug_to_form(self):
-        row = self.drug_table.currentRow()
+        row = self.drug_table.currentIndex().row()
         if row >= 0:
-            self.name_input.setText(self.drug_table.item(row, 1).text())
-            self.quantity_input.setText(self.drug_table.item(row, 2).text())
-            self.batch_number_input.setText(self.drug_table.item(row, 3).text())
-            self.expiry_date_input.setText(self.drug_table.item(row, 4).text())
-            self.price_input.setText(self.drug_table.item(row, 5).text())
+            self.name_input.setText(self.drug_model.text(row, 1))
+            self.quantity_input.setText(self.drug_model.text(row, 2))
+            self.batch_number_input.setText(self.drug_model.text(row, 3))
+            self.expiry_date_input.setText(self.drug_model.text(row, 4))
+            self.price_input.setText(self.drug_model.text(row, 5))
 
     def add_drug(self):
         if not self.main_window.db.is_system_activated() and not self.main_window.db.is_demo_period_active():
@@ -286,12 +291,12 @@ class InventoryManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        row = self.drug_table.currentRow()
+        row = self.drug_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a drug to update.")
             return
 
-        drug_id = int(self.drug_table.item(row, 0).text())
+        drug_id = int(self.drug_model.text(row, 0))
         name = self.name_input.text().strip()
         quantity = self.quantity_input.text().strip()
         batch_number = self.batch_number_input.text().strip()
@@ -330,7 +335,13 @@ class InventoryManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "Price must be a number.")
             return
 
-        self.db.update_drug(drug_id, name, quantity_val, batch_number, expiry_date, price_val)
+        # Apply the change to the quantity shown, keeping sales made since on other tills
+        previous_quantity = int(self.drug_model.text(row, 2))
+        try:
+            self.db.update_drug(drug_id, name, quantity_val, batch_number, expiry_date, price_val, previous_quantity)
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
         QMessageBox.information(self, "Success", "Drug updated successfully at 12:03 PM EAT on Wednesday, May 14, 2025.")
         self.load_drugs()
         self.clear_form()
@@ -340,12 +351,12 @@ class InventoryManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        row = self.drug_table.currentRow()
+        row = self.drug_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a drug to delete.")
             return
 
-        drug_id = int(self.drug_table.item(row, 0).text())
+        drug_id = int(self.drug_model.text(row, 0))
         reply = QMessageBox.question(self, "Confirm Delete", "Are you sure you want to delete this drug?",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
@@ -0,0 +1,53 @@
+import socket
+import threading
+from PyQt6.QtCore import QThread, pyqtSignal
+
+
+class NetworkMonitor(QThread):
+    """Probes internet connectivity off the GUI thread.
+
+    Emits status_changed(bool) whenever the online state flips (and once for
+    the first probe). While online it probes every `interval` seconds; while
+    offline the delay doubles after each failed probe up to `max_interval`.
+    """
+
+    status_changed = pyqtSignal(bool)
+
+    def __init__(self, host="1.1.1.1", port=53, timeout=2, interval=5, max_interval=60, parent=None):
+        super().__init__(parent)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+        self.is_online = None
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def probe(self):
+        """Single blocking connectivity check; only call from the worker thread."""
+        try:
+            socket.create_connection((self.host, self.port), timeout=self.timeout).close()
+            return True
+        except OSError:
+            return False
+
+    def run(self):
+        delay = self.interval
+        while not self._stopping:
+            online = self.probe()
+            if online != self.is_online:
+                self.is_online = online
+                self.status_changed.emit(online)
+            delay = self.interval if online else min(delay * 2, self.max_interval)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def check_now(self):
+        """Wake the worker for an immediate probe (e.g. before a manual sync)."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        self.wait()
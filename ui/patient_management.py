@@ -1,8 +1,8 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-                             QComboBox, QTextEdit, QPushButton, QTableWidget,
-                             QTableWidgetItem, QHeaderView, QMessageBox, QFileDialog)
+                             QComboBox, QTextEdit, QPushButton, QTableView,
+                             QHeaderView, QMessageBox, QFileDialog)
 from PyQt6.QtCore import Qt
-from db.database import Database
+from ui.sql_table_model import SqlTableModel
 from utils.validation import is_valid_name, is_valid_phone
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -14,10 +14,12 @@ from reportlab.graphics.shapes import Image
 import os
 
 class PatientManagementWidget(QWidget):
+    watched_tables = ("patients",)
+
     def __init__(self, main_window):
         super().__init__()
         self.main_window = main_window
-        self.db = Database()
+        self.db = self.main_window.db
         self.init_ui()
 
     def init_ui(self):
@@ -255,19 +257,26 @@ class PatientManagementWidget(QWidget):
         button_layout.addWidget(back_button)
         main_layout.addLayout(button_layout)
 
-        # Patient table
-        self.patient_table = QTableWidget()
-        self.patient_table.setColumnCount(7)
-        self.patient_table.setHorizontalHeaderLabels(["ID", "First Name", "Last Name", "Age", "Gender", "Contact", "Medical History"])
+        # Patient table (rows are paged in from SQLite as the view scrolls)
+        self.patient_model = SqlTableModel(self.db, "patients", [
+            ("ID", "patient_id"), ("First Name", "first_name"), ("Last Name", "last_name"),
+            ("Age", "age"), ("Gender", "gender"), ("Contact", "contact"), ("Medical History", "medical_history")
+        ], key="patient_id", default_sort=1, search_columns=("first_name || ' ' || last_name", "contact"),
+            formatters={6: lambda value: value if value else "N/A"})
+        self.patient_table = QTableView()
+        self.patient_table.setModel(self.patient_model)
+        self.patient_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.patient_table.horizontalHeader().setSortIndicator(1, Qt.SortOrder.AscendingOrder)
+        self.patient_table.setSortingEnabled(True)
         self.patient_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.patient_table.setToolTip("List of registered patients")
         self.patient_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 font-size: 14px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
             }
         """)
@@ -278,27 +287,22 @@ class PatientManagementWidget(QWidget):
 
         self.load_patients()
 
+    def refresh(self):
+        """Reload data after the cached screen went stale."""
+        self.load_patients()
+
     def load_patients(self):
-        patients = self.db.get_all_patients()
-        self.patient_table.setRowCount(len(patients))
-        for row, patient in enumerate(patients):
-            self.patient_table.setItem(row, 0, QTableWidgetItem(str(patient['patient_id'])))
-            self.patient_table.setItem(row, 1, QTableWidgetItem(patient['first_name']))
-            self.patient_table.setItem(row, 2, QTableWidgetItem(patient['last_name']))
-            self.patient_table.setItem(row, 3, QTableWidgetItem(str(patient['age'])))
-            self.patient_table.setItem(row, 4, QTableWidgetItem(patient['gender']))
-            self.patient_table.setItem(row, 5, QTableWidgetItem(patient['contact']))
-            self.patient_table.setItem(row, 6, QTableWidgetItem(patient['medical_history'] if patient['medical_history'] else "N/A"))
+        self.patient_model.refresh()
 
     def load_patient_to_form(self):
-        row = self.patient_table.currentRow()
+        row = self.patient_table.currentIndex().row()
         if row >= 0:
-            self.first_name_input.setText(self.patient_table.item(row, 1).text())
-            self.last_name_input.setText(self.patient_table.item(row, 2).text())
-            self.age_input.setText(self.patient_table.item(row, 3).text())
-            self.gender_combo.setCurrentText(self.patient_table.item(row, 4).text())
-            self.contact_input.setText(self.patient_table.item(row, 5).text())
-            self.medical_history_input.setText(self.patient_table.item(row, 6).text() if self.patient_table.item(row, 6).text() != "N/A" else "")
+            self.first_name_input.setText(self.patient_model.text(row, 1))
+            self.last_name_input.setText(self.patient_model.text(row, 2))
+            self.age_input.setText(self.patient_model.text(row, 3))
+            self.gender_combo.setCurrentText(self.patient_model.text(row, 4))
+            self.contact_input.setText(self.patient_model.text(row, 5))
+            self.medical_history_input.setText(self.patient_model.text(row, 6) if self.patient_model.text(row, 6) != "N/A" else "")
 
     def add_patient(self):
         if not self.main_window.db.is_system_activated() and not self.main_window.db.is_demo_period_active():
@@ -442,12 +446,12 @@ class PatientManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        row = self.patient_table.currentRow()
+        row = self.patient_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a patient to update.")
             return
 
-        patient_id = int(self.patient_table.item(row, 0).text())
+        patient_id = int(self.patient_model.text(row, 0))
         first_name = self.first_name_input.text().strip()
         last_name = self.last_name_input.text().strip()
         age = self.age_input.text().strip()
@@ -585,12 +589,12 @@ class PatientManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        row = self.patient_table.currentRow()
+        row = self.patient_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a patient to delete.")
             return
 
-        patient_id = int(self.patient_table.item(row, 0).text())
+        patient_id = int(self.patient_model.text(row, 0))
         reply = QMessageBox.question(self, "Confirm Delete", "Are you sure you want to delete this patient?",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
@@ -600,12 +604,12 @@ class PatientManagementWidget(QWidget):
             self.clear_form()
 
     def print_patient_data(self):
-        row = self.patient_table.currentRow()
+        row = self.patient_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a patient to print data for.")
             return
 
-        patient_id = int(self.patient_table.item(row, 0).text())
+        patient_id = int(self.patient_model.text(row, 0))
         patient = self.db.get_patient(patient_id)
 
         file_path, _ = QFileDialog.getSaveFileName(
@@ -1,8 +1,9 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox,
-                             QLineEdit, QTextEdit, QPushButton, QTableWidget,
-                             QTableWidgetItem, QHeaderView, QMessageBox, QCompleter)
+                             QLineEdit, QTextEdit, QPushButton, QTableView,
+                             QHeaderView, QMessageBox, QCompleter)
 from PyQt6.QtCore import Qt
-from db.database import Database
+from ui.sql_table_model import SqlTableModel
+from db.database import PATIENT_NAME_SQL, PRESCRIPTIONS_WITH_DETAILS_SQL
 
 class SearchableComboBox(QComboBox):
     def __init__(self, parent=None):
@@ -24,10 +25,12 @@ class SearchableComboBox(QComboBox):
         """)
 
 class PrescriptionLoggingWidget(QWidget):
+    watched_tables = ("prescriptions", "patients", "drugs")
+
     def __init__(self, main_window):
         super().__init__()
         self.main_window = main_window
-        self.db = Database()
+        self.db = self.main_window.db
         self.init_ui()
 
     def init_ui(self):
@@ -255,19 +258,26 @@ class PrescriptionLoggingWidget(QWidget):
         button_layout.addWidget(back_button)
         main_layout.addLayout(button_layout)
 
-        # Prescription table
-        self.prescription_table = QTableWidget()
-        self.prescription_table.setColumnCount(6)
-        self.prescription_table.setHorizontalHeaderLabels(["ID", "Patient", "Drug", "Dosage", "Date", "Quantity"])
+        # Prescription table (rows are paged in from SQLite as the view scrolls)
+        self.prescription_model = SqlTableModel(self.db, PRESCRIPTIONS_WITH_DETAILS_SQL, [
+            ("ID", "pr.prescription_id"), ("Patient", PATIENT_NAME_SQL),
+            ("Drug", "COALESCE(d.name, 'Unknown')"),
+            ("Dosage", "pr.dosage"), ("Date", "pr.prescription_date"), ("Quantity", "pr.quantity_prescribed")
+        ], key="pr.prescription_id", search_columns=("p.first_name || ' ' || p.last_name", "d.name", "pr.diagnosis"))
+        self.prescription_table = QTableView()
+        self.prescription_table.setModel(self.prescription_model)
+        self.prescription_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.prescription_table.horizontalHeader().setSortIndicator(0, Qt.SortOrder.AscendingOrder)
+        self.prescription_table.setSortingEnabled(True)
         self.prescription_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.prescription_table.setToolTip("List of prescriptions")
         self.prescription_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 font-size: 14px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
             }
         """)
@@ -278,6 +288,10 @@ class PrescriptionLoggingWidget(QWidget):
 
         self.load_data()
 
+    def refresh(self):
+        """Reload data after the cached screen went stale."""
+        self.load_data()
+
     def load_data(self):
         # Load patients
         patients = self.db.get_all_patients()
@@ -294,22 +308,12 @@ class PrescriptionLoggingWidget(QWidget):
             self.drug_search_combo.addItem(drug['name'], drug['drug_id'])
 
         # Load prescriptions
-        prescriptions = self.db.get_all_prescriptions()
-        self.prescription_table.setRowCount(len(prescriptions))
-        for row, prescription in enumerate(prescriptions):
-            patient = self.db.get_patient(prescription['patient_id'])
-            drug = self.db.get_drug(prescription['drug_id'])
-            self.prescription_table.setItem(row, 0, QTableWidgetItem(str(prescription['prescription_id'])))
-            self.prescription_table.setItem(row, 1, QTableWidgetItem(f"{patient['first_name']} {patient['last_name']}"))
-            self.prescription_table.setItem(row, 2, QTableWidgetItem(drug['name']))
-            self.prescription_table.setItem(row, 3, QTableWidgetItem(prescription['dosage']))
-            self.prescription_table.setItem(row, 4, QTableWidgetItem(prescription['prescription_date']))
-            self.prescription_table.setItem(row, 5, QTableWidgetItem(str(prescription['quantity_prescribed'])))
+        self.prescription_model.refresh()
 
     def load_prescription_to_form(self):
-        row = self.prescription_table.currentRow()
+        row = self.prescription_table.currentIndex().row()
         if row >= 0:
-            prescription_id = int(self.prescription_table.item(row, 0).text())
+            prescription_id = int(self.prescription_model.text(row, 0))
             prescription = self.db.get_prescription(prescription_id)  # Assuming this method exists
             patient = self.db.get_patient(prescription['patient_id'])
             drug = self.db.get_drug(prescription['drug_id'])
@@ -389,12 +393,12 @@ class PrescriptionLoggingWidget(QWidget):
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        row = self.prescription_table.currentRow()
+        row = self.prescription_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a prescription to update.")
             return
 
-        prescription_id = int(self.prescription_table.item(row, 0).text())
+        prescription_id = int(self.prescription_model.text(row, 0))
         patient_id = self.patient_search_combo.currentData()
         drug_id = self.drug_search_combo.currentData()
         diagnosis = self.diagnosis_input.toPlainText().strip()
@@ -458,12 +462,12 @@ class PrescriptionLoggingWidget(QWidget):
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        row = self.prescription_table.currentRow()
+        row = self.prescription_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a prescription to delete.")
             return
 
-        prescription_id = int(self.prescription_table.item(row, 0).text())
+        prescription_id = int(self.prescription_model.text(row, 0))
         reply = QMessageBox.question(self, "Confirm Delete", "Are you sure you want to delete this prescription?",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
@@ -1,8 +1,9 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox,
-                             QPushButton, QTableWidget, QTableWidgetItem, QHeaderView,
+                             QPushButton, QTableView, QHeaderView,
                              QFileDialog, QMessageBox)
 from PyQt6.QtCore import Qt
-from db.database import Database
+from ui.sql_table_model import SqlTableModel
+from db.database import PATIENT_NAME_SQL, PRESCRIPTIONS_WITH_DETAILS_SQL, SALES_WITH_PATIENTS_SQL
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.platypus.flowables import HRFlowable
@@ -13,10 +14,12 @@ from reportlab.graphics.shapes import Image
 import os
 
 class ReportingDashboardWidget(QWidget):
+    watched_tables = ("patients", "drugs", "prescriptions", "sales")
+
     def __init__(self, main_window):
         super().__init__()
         self.main_window = main_window
-        self.db = Database()
+        self.db = self.main_window.db
         self.init_ui()
 
     def init_ui(self):
@@ -72,18 +75,18 @@ class ReportingDashboardWidget(QWidget):
         main_layout.addLayout(report_layout)
 
         # Report table
-        self.report_table = QTableWidget()
-        self.report_table.setColumnCount(0)
-        self.report_table.setHorizontalHeaderLabels([])
+        self.report_model = None
+        self.report_table = QTableView()
+        self.report_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
         self.report_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.report_table.setToolTip("Generated report data")
         self.report_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 font-size: 14px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
             }
         """)
@@ -135,6 +138,11 @@ class ReportingDashboardWidget(QWidget):
 
         main_layout.addStretch()
 
+    def refresh(self):
+        """Reload the current report after the cached screen went stale."""
+        if self.report_model is not None:
+            self.report_model.refresh()
+
     def generate_report(self):
         if not self.main_window.db.is_system_activated() and not self.main_window.db.is_demo_period_active():
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
@@ -156,75 +164,50 @@ class ReportingDashboardWidget(QWidget):
         elif report_type == "Low Stock Alert":
             self.generate_low_stock_alert()
 
+    def show_report(self, model):
+        """Attach a paged report model to the table; rows load from SQLite as the user scrolls."""
+        self.report_model = model
+        self.report_table.setSortingEnabled(False)
+        self.report_table.setModel(model)
+        self.report_table.horizontalHeader().setSortIndicator(model.sort_column, Qt.SortOrder.AscendingOrder)
+        self.report_table.setSortingEnabled(True)
+
     def generate_patient_summary(self):
-        patients = self.db.get_all_patients()
-        self.report_table.setColumnCount(6)
-        self.report_table.setHorizontalHeaderLabels(["ID", "First Name", "Last Name", "Age", "Gender", "Contact"])
-        self.report_table.setRowCount(len(patients))
-        for row, patient in enumerate(patients):
-            self.report_table.setItem(row, 0, QTableWidgetItem(str(patient['patient_id'])))
-            self.report_table.setItem(row, 1, QTableWidgetItem(patient['first_name']))
-            self.report_table.setItem(row, 2, QTableWidgetItem(patient['last_name']))
-            self.report_table.setItem(row, 3, QTableWidgetItem(str(patient['age'])))
-            self.report_table.setItem(row, 4, QTableWidgetItem(patient['gender']))
-            self.report_table.setItem(row, 5, QTableWidgetItem(patient['contact']))
+        self.show_report(SqlTableModel(self.db, "patients", [
+            ("ID", "patient_id"), ("First Name", "first_name"), ("Last Name", "last_name"),
+            ("Age", "age"), ("Gender", "gender"), ("Contact", "contact")
+        ], key="patient_id", default_sort=1))
 
     def generate_prescription_history(self):
-        prescriptions = self.db.get_all_prescriptions()
-        self.report_table.setColumnCount(6)
-        self.report_table.setHorizontalHeaderLabels(["ID", "Patient", "Drug", "Dosage", "Date", "Quantity"])
-        self.report_table.setRowCount(len(prescriptions))
-        for row, prescription in enumerate(prescriptions):
-            patient = self.db.get_patient(prescription['patient_id'])
-            drug = self.db.get_drug(prescription['drug_id'])
-            self.report_table.setItem(row, 0, QTableWidgetItem(str(prescription['prescription_id'])))
-            self.report_table.setItem(row, 1, QTableWidgetItem(f"{patient['first_name']} {patient['last_name']}"))
-            self.report_table.setItem(row, 2, QTableWidgetItem(drug['name']))
-            self.report_table.setItem(row, 3, QTableWidgetItem(prescription['dosage']))
-            self.report_table.setItem(row, 4, QTableWidgetItem(prescription['prescription_date']))
-            self.report_table.setItem(row, 5, QTableWidgetItem(str(prescription['quantity_prescribed'])))
+        self.show_report(SqlTableModel(self.db, PRESCRIPTIONS_WITH_DETAILS_SQL, [
+            ("ID", "pr.prescription_id"), ("Patient", PATIENT_NAME_SQL),
+            ("Drug", "COALESCE(d.name, 'Unknown')"),
+            ("Dosage", "pr.dosage"), ("Date", "pr.prescription_date"), ("Quantity", "pr.quantity_prescribed")
+        ], key="pr.prescription_id"))
 
     def generate_inventory_status(self):
-        drugs = self.db.get_all_drugs()
-        self.report_table.setColumnCount(6)
-        self.report_table.setHorizontalHeaderLabels(["ID", "Name", "Quantity", "Batch Number", "Expiry Date", "Price"])
-        self.report_table.setRowCount(len(drugs))
-        for row, drug in enumerate(drugs):
-            self.report_table.setItem(row, 0, QTableWidgetItem(str(drug['drug_id'])))
-            self.report_table.setItem(row, 1, QTableWidgetItem(drug['name']))
-            self.report_table.setItem(row, 2, QTableWidgetItem(str(drug['quantity'])))
-            self.report_table.setItem(row, 3, QTableWidgetItem(drug['batch_number']))
-            self.report_table.setItem(row, 4, QTableWidgetItem(drug['expiry_date']))
-            self.report_table.setItem(row, 5, QTableWidgetItem(f"{drug['price']:.2f}"))
+        self.show_report(SqlTableModel(self.db, "drugs", [
+            ("ID", "drug_id"), ("Name", "name"), ("Quantity", "quantity"),
+            ("Batch Number", "batch_number"), ("Expiry Date", "expiry_date"), ("Price", "price")
+        ], key="drug_id", default_sort=1, formatters={5: lambda value: f"{value:.2f}"}))
 
     def generate_sales_report(self):
-        sales = self.db.get_all_sales()
-        self.report_table.setColumnCount(4)
-        self.report_table.setHorizontalHeaderLabels(["Sale ID", "Patient", "Total Price", "Date"])
-        self.report_table.setRowCount(len(sales))
-        for row, sale in enumerate(sales):
-            patient = self.db.get_patient(sale['patient_id'])
-            self.report_table.setItem(row, 0, QTableWidgetItem(str(sale['sale_id'])))
-            self.report_table.setItem(row, 1, QTableWidgetItem(f"{patient['first_name']} {patient['last_name']}"))
-            self.report_table.setItem(row, 2, QTableWidgetItem(f"{sale['total_price']:.2f}"))
-            self.report_table.setItem(row, 3, QTableWidgetItem(sale['sale_date']))
+        self.show_report(SqlTableModel(self.db, SALES_WITH_PATIENTS_SQL, [
+            ("Sale ID", "s.sale_id"), ("Patient", PATIENT_NAME_SQL),
+            ("Total Price", "s.total_price"), ("Date", "s.sale_date")
+        ], key="s.sale_id", formatters={2: lambda value: f"{value:.2f}"}))
 
     def generate_low_stock_alert(self):
-        drugs = self.db.get_low_stock_drugs()
-        self.report_table.setColumnCount(3)
-        self.report_table.setHorizontalHeaderLabels(["ID", "Name", "Quantity"])
-        self.report_table.setRowCount(len(drugs))
-        for row, drug in enumerate(drugs):
-            self.report_table.setItem(row, 0, QTableWidgetItem(str(drug['drug_id'])))
-            self.report_table.setItem(row, 1, QTableWidgetItem(drug['name']))
-            self.report_table.setItem(row, 2, QTableWidgetItem(str(drug['quantity'])))
+        self.show_report(SqlTableModel(self.db, "drugs", [
+            ("ID", "drug_id"), ("Name", "name"), ("Quantity", "quantity")
+        ], key="drug_id", where="quantity < 10"))
 
     def export_to_pdf(self):
         if not self.main_window.db.is_system_activated() and not self.main_window.db.is_demo_period_active():
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        if self.report_table.rowCount() == 0:
+        if self.report_model is None or self.report_model.rowCount() == 0:
             QMessageBox.warning(self, "Error", "No report data to export.")
             return
 
@@ -278,11 +261,8 @@ class ReportingDashboardWidget(QWidget):
         elements.append(Spacer(1, 12))
 
         # Table Data
-        headers = [self.report_table.horizontalHeaderItem(i).text() for i in range(self.report_table.columnCount())]
-        data = [headers]
-        for row in range(self.report_table.rowCount()):
-            row_data = [self.report_table.item(row, col).text() for col in range(self.report_table.columnCount())]
-            data.append(row_data)
+        headers = list(self.report_model.headers)
+        data = [headers] + self.report_model.all_rows()
 
         # Calculate column widths dynamically based on content
         col_widths = [pdf.width / len(headers)] * len(headers)  # Evenly distribute initially
@@ -1,8 +1,9 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox,
-                             QLineEdit, QPushButton, QTableWidget, QTableWidgetItem,
+                             QLineEdit, QPushButton, QTableWidget, QTableWidgetItem, QTableView,
                              QHeaderView, QFileDialog, QMessageBox, QCompleter)
 from PyQt6.QtCore import Qt, QTimer
-from db.database import Database
+from ui.sql_table_model import SqlTableModel
+from db.database import PATIENT_NAME_SQL, SALES_WITH_PATIENTS_SQL
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.platypus.flowables import HRFlowable
@@ -11,6 +12,7 @@ from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib.units import mm
 from reportlab.graphics.shapes import Rect, Image
 import os
+import uuid
 from datetime import datetime, timedelta
 
 class SearchableComboBox(QComboBox):
@@ -33,11 +35,14 @@ class SearchableComboBox(QComboBox):
         """)
 
 class SalesManagementWidget(QWidget):
+    watched_tables = ("sales", "patients", "drugs")
+
     def __init__(self, main_window):
         super().__init__()
         self.main_window = main_window
-        self.db = Database()
+        self.db = self.main_window.db
         self.sale_items = []
+        self.cart_id = uuid.uuid4().hex  # Stock for sale_items is held under this id until checkout
         self.low_stock_threshold = 10  # Define low stock threshold
         # Exchange rates (KSh as base currency)
         self.exchange_rates = {
@@ -254,19 +259,44 @@ class SalesManagementWidget(QWidget):
         sale_button_layout.addWidget(back_button)
         main_layout.addLayout(sale_button_layout)
 
-        # Sales table
-        self.sales_table = QTableWidget()
-        self.sales_table.setColumnCount(4)
-        self.sales_table.setHorizontalHeaderLabels(["Sale ID", "Patient", "Total Price", "Date"])
+        # Sales search (filters in SQL, so it stays fast on a long history)
+        self.sales_search_input = QLineEdit()
+        self.sales_search_input.setPlaceholderText("Search sales by patient or date")
+        self.sales_search_input.setToolTip("Filter the sales list")
+        self.sales_search_input.setStyleSheet("""
+            QLineEdit {
+                padding: 8px;
+                border: 1px solid #ccc;
+                border-radius: 4px;
+                font-size: 14px;
+            }
+            QLineEdit:focus {
+                border: 1px solid #4CAF50;
+            }
+        """)
+        self.sales_search_input.textChanged.connect(lambda text: self.sales_model.set_search(text))
+        main_layout.addWidget(self.sales_search_input)
+
+        # Sales table (rows are paged in from SQLite as the view scrolls, newest first)
+        self.sales_model = SqlTableModel(self.db, SALES_WITH_PATIENTS_SQL, [
+            ("Sale ID", "s.sale_id"), ("Patient", PATIENT_NAME_SQL),
+            ("Total Price", "s.total_price"), ("Date", "s.sale_date")
+        ], key="s.sale_id", descending=True, search_columns=("p.first_name || ' ' || p.last_name", "s.sale_date"),
+            formatters={2: lambda value: f"{value:.2f}"})
+        self.sales_table = QTableView()
+        self.sales_table.setModel(self.sales_model)
+        self.sales_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.sales_table.horizontalHeader().setSortIndicator(0, Qt.SortOrder.DescendingOrder)
+        self.sales_table.setSortingEnabled(True)
         self.sales_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.sales_table.setToolTip("List of completed sales")
         self.sales_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 font-size: 14px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
             }
         """)
@@ -280,6 +310,10 @@ class SalesManagementWidget(QWidget):
         selected_currency = self.currency_combo.currentText()
         self.main_window.config["sales_currency"] = selected_currency
 
+    def refresh(self):
+        """Reload data after the cached screen went stale."""
+        self.load_data()
+
     def load_data(self):
         # Load patients
         patients = self.db.get_all_patients()
@@ -296,14 +330,7 @@ class SalesManagementWidget(QWidget):
             self.drug_search_combo.addItem(drug['name'], drug['drug_id'])
 
         # Load sales
-        sales = self.db.get_all_sales()
-        self.sales_table.setRowCount(len(sales))
-        for row, sale in enumerate(sales):
-            patient = self.db.get_patient(sale['patient_id'])
-            self.sales_table.setItem(row, 0, QTableWidgetItem(str(sale['sale_id'])))
-            self.sales_table.setItem(row, 1, QTableWidgetItem(f"{patient['first_name']} {patient['last_name']}"))
-            self.sales_table.setItem(row, 2, QTableWidgetItem(f"{sale['total_price']:.2f}"))
-            self.sales_table.setItem(row, 3, QTableWidgetItem(sale['sale_date']))
+        self.sales_model.refresh()
 
     def add_sale_item(self):
         if not self.main_window.db.is_system_activated() and not self.main_window.db.is_demo_period_active():
@@ -331,28 +358,20 @@ class SalesManagementWidget(QWidget):
             return
 
         drug = self.db.get_drug(drug_id)
-        # Allow sale even if stock reaches zero, but show warning
-        if drug['quantity'] < quantity_val:
-            QMessageBox.warning(self, "Error", f"Insufficient stock for {drug['name']}. Available: {drug['quantity']}")
+        if not drug:
+            QMessageBox.warning(self, "Error", "Drug not found.")
             return
-
-        # Reduce stock immediately when adding the item
+        # Hold the cart's new total for this drug; stock is only decremented at checkout
+        in_cart = sum(item['quantity'] for item in self.sale_items if item['drug_id'] == drug_id)
         try:
-            warning = self.db.reduce_drug_stock(drug_id, quantity_val)
-            if warning or drug['quantity'] - quantity_val <= 0:
-                remaining = max(0, drug['quantity'] - quantity_val)  # Ensure remaining is not negative
-                message = f"Stock for {drug['name']} is low. Remaining: {remaining} units."
-                # Use a non-blocking QMessageBox with a timer
-                msg_box = QMessageBox(self)
-                msg_box.setWindowTitle("Low Stock Warning")
-                msg_box.setText(message)
-                msg_box.setStandardButtons(QMessageBox.StandardButton.NoButton)
-                msg_box.show()
-                QTimer.singleShot(2000, lambda: msg_box.done(0))  # Auto-close after 2 seconds
+            remaining = self.db.reserve_stock(self.cart_id, drug_id, in_cart + quantity_val)
         except ValueError as e:
             QMessageBox.warning(self, "Error", str(e))
             return
 
+        if remaining < self.low_stock_threshold:
+            self.show_low_stock_warning(f"Stock for {drug['name']} is low. Remaining: {remaining} units.")
+
         price_in_ksh = drug['price'] * quantity_val
         converted_price = price_in_ksh * rate
 
@@ -372,21 +391,23 @@ class SalesManagementWidget(QWidget):
 
         self.quantity_input.clear()
 
+    def show_low_stock_warning(self, message):
+        # Use a non-blocking QMessageBox with a timer
+        msg_box = QMessageBox(self)
+        msg_box.setWindowTitle("Low Stock Warning")
+        msg_box.setText(message)
+        msg_box.setStandardButtons(QMessageBox.StandardButton.NoButton)
+        msg_box.show()
+        QTimer.singleShot(2000, lambda: msg_box.done(0))  # Auto-close after 2 seconds
+
     def clear_sale_items(self):
         if not self.main_window.db.is_system_activated() and not self.main_window.db.is_demo_period_active():
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        # Restore stock for each item in the sale_items list
-        for item in self.sale_items:
-            drug_id = item['drug_id']
-            quantity = item['quantity']
-            # Increase stock by the quantity that was deducted
-            drug = self.db.get_drug(drug_id)
-            if drug:
-                new_quantity = drug['quantity'] + quantity
-                self.db.update_drug(drug_id, new_quantity, drug['batch_number'], drug['expiry_date'], drug['price'])
-
+        # Only the cart's holds were written, so an abandoned cart leaves nothing to sync
+        self.db.release_stock(self.cart_id)
+        self.cart_id = uuid.uuid4().hex
         self.sale_items = []
         self.sale_items_table.setRowCount(0)
         self.quantity_input.clear()
@@ -404,38 +425,41 @@ class SalesManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "No items added to sale.")
             return
 
-        total_price = sum(item['price'] for item in self.sale_items)  # Total in KSh
         mode_of_payment = self.payment_mode_combo.currentText()  # Get selected payment mode
 
-        # Record the sale
-        sale_id = self.db.add_sale(
-            patient_id=patient_id,
-            user_id=self.main_window.current_user['user_id'],
-            total_price=total_price,
-            mode_of_payment=mode_of_payment
-        )
-        for item in self.sale_items:
-            # Simply record the sale item without reducing stock again
-            self.db.add_sale_item(
-                sale_id=sale_id,
-                drug_id=item['drug_id'],
-                quantity=item['quantity'],
-                price=item['price']  # Store in KSh
+        # Record the sale, its items and the stock decrements in one transaction
+        try:
+            sale_id, stock_levels = self.db.checkout(
+                patient_id=patient_id,
+                user_id=self.main_window.current_user['user_id'],
+                mode_of_payment=mode_of_payment,
+                items=self.sale_items,
+                cart_id=self.cart_id
             )
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+
+        names = {item['drug_id']: item['name'] for item in self.sale_items}
+        low_stock = [f"{names[drug_id]}: {quantity} units" for drug_id, quantity in stock_levels.items()
+                     if quantity < self.low_stock_threshold]
+        if low_stock:
+            self.show_low_stock_warning("Low stock after sale:\n" + "\n".join(low_stock))
 
         QMessageBox.information(self, "Success", f"Sale completed successfully. Sale ID: {sale_id} at 12:27 PM EAT on Wednesday, May 14, 2025.")
         self.load_data()  # Update the sales table
-        self.sale_items = []  # Clear sale_items without restoring stock
+        self.sale_items = []  # Stock was decremented by checkout
+        self.cart_id = uuid.uuid4().hex
         self.sale_items_table.setRowCount(0)
 
     def generate_receipt(self):
         """Generate a slick PDF receipt with clean styling and selected currency."""
-        row = self.sales_table.currentRow()
+        row = self.sales_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Select a sale to generate receipt.")
             return
 
-        sale_id = int(self.sales_table.item(row, 0).text())
+        sale_id = int(self.sales_model.text(row, 0))
         sale = self.db.get_sale(sale_id)
         patient = self.db.get_patient(sale['patient_id'])
         sale_items = sale['items']
@@ -200,6 +200,11 @@ class SettingsWidget(QWidget):
         self.status_label.setStyleSheet("font-size: 12px; color: #FFFFFF; padding: 5px;")
         scroll_layout.addWidget(self.status_label)
 
+        # Sync queue depth and backlog age
+        self.queue_label = QLabel()
+        self.queue_label.setStyleSheet("font-size: 12px; color: #FFFFFF; padding: 5px;")
+        scroll_layout.addWidget(self.queue_label)
+
         # Sync message
         sync_message = QLabel("Syncing is automatic when enabled, but you can sync manually using the button below.")
         sync_message.setStyleSheet("font-size: 12px; color: #FFFFFF; font-style: italic; padding: 5px;")
@@ -209,9 +214,9 @@ class SettingsWidget(QWidget):
         action_buttons_layout = QHBoxLayout()
         
         # Sync Now button
-        sync_now_button = QPushButton("Sync Now")
-        sync_now_button.setToolTip("Manually sync data to the cloud")
-        sync_now_button.setStyleSheet("""
+        self.sync_now_button = QPushButton("Sync Now")
+        self.sync_now_button.setToolTip("Manually sync data to the cloud")
+        self.sync_now_button.setStyleSheet("""
             QPushButton {
                 background-color: #2196F3;
                 color: #FFFFFF;
@@ -228,8 +233,58 @@ class SettingsWidget(QWidget):
                 background-color: #1565C0;
             }
         """)
-        sync_now_button.clicked.connect(self.manual_sync)
-        action_buttons_layout.addWidget(sync_now_button)
+        self.sync_now_button.clicked.connect(self.manual_sync)
+        action_buttons_layout.addWidget(self.sync_now_button)
+
+        # Cancel Sync button (enabled while a sync is running)
+        self.cancel_sync_button = QPushButton("Cancel Sync")
+        self.cancel_sync_button.setToolTip("Stop the sync that is currently running")
+        self.cancel_sync_button.setStyleSheet("""
+            QPushButton {
+                background-color: #F44336;
+                color: #FFFFFF;
+                padding: 10px;
+                border: none;
+                border-radius: 5px;
+                font-size: 14px;
+                min-width: 100px;
+            }
+            QPushButton:hover {
+                background-color: #E53935;
+            }
+            QPushButton:pressed {
+                background-color: #D32F2F;
+            }
+            QPushButton:disabled {
+                background-color: #555555;
+                color: #AAAAAA;
+            }
+        """)
+        self.cancel_sync_button.clicked.connect(self.main_window.sync_service.cancel)
+        action_buttons_layout.addWidget(self.cancel_sync_button)
+
+        # Retry Failed button (requeues changes that ran out of sync attempts)
+        retry_failed_button = QPushButton("Retry Failed")
+        retry_failed_button.setToolTip("Queue changes that failed to sync for another attempt")
+        retry_failed_button.setStyleSheet("""
+            QPushButton {
+                background-color: #2196F3;
+                color: #FFFFFF;
+                padding: 10px;
+                border: none;
+                border-radius: 5px;
+                font-size: 14px;
+                min-width: 100px;
+            }
+            QPushButton:hover {
+                background-color: #1976D2;
+            }
+            QPushButton:pressed {
+                background-color: #1565C0;
+            }
+        """)
+        retry_failed_button.clicked.connect(self.retry_failed_sync)
+        action_buttons_layout.addWidget(retry_failed_button)
 
         # Import Data (admin only)
         if is_admin:
@@ -279,6 +334,30 @@ class SettingsWidget(QWidget):
             export_button.clicked.connect(self.export_data)
             action_buttons_layout.addWidget(export_button)
 
+        # Compact Database (admin only)
+        if is_admin:
+            compact_button = QPushButton("Compact Database")
+            compact_button.setToolTip("Give space freed by archived sync records back to the disk")
+            compact_button.setStyleSheet("""
+                QPushButton {
+                    background-color: #FF9800;
+                    color: #FFFFFF;
+                    padding: 10px;
+                    border: none;
+                    border-radius: 5px;
+                    font-size: 14px;
+                    min-width: 100px;
+                }
+                QPushButton:hover {
+                    background-color: #F57C00;
+                }
+                QPushButton:pressed {
+                    background-color: #EF6C00;
+                }
+            """)
+            compact_button.clicked.connect(self.compact_database)
+            action_buttons_layout.addWidget(compact_button)
+
         # Save button
         save_button = QPushButton("Save")
         save_button.setToolTip("Save settings")
@@ -379,6 +458,16 @@ class SettingsWidget(QWidget):
             self.contact_input.setText(config.get("contact_details", ""))
         self.sync_toggle.setChecked(config["sync_enabled"])
 
+        # Sync runs on the background sync service; follow it through its signals
+        self.manual_sync_requested = False
+        sync_service = self.main_window.sync_service
+        sync_service.sync_started.connect(self.on_sync_started)
+        sync_service.progress.connect(self.on_sync_progress)
+        sync_service.sync_finished.connect(self.on_sync_finished)
+        sync_service.sync_cancelled.connect(self.on_sync_cancelled)
+        sync_service.error.connect(self.on_sync_error)
+        self.set_sync_running(sync_service.is_syncing)
+
     def set_title(self, title):
         self.main_window.set_title(title)
 
@@ -407,28 +496,70 @@ class SettingsWidget(QWidget):
         return "Sync enabled, no sync performed yet."
 
     def manual_sync(self):
-        """Manually trigger a sync."""
+        """Manually trigger a sync on the background sync service."""
         if not self.db.is_online():
             QMessageBox.warning(self, "Sync", "No internet connection. Changes will sync when online.")
             return
         if not self.db.supabase:
             QMessageBox.warning(self, "Sync", "Supabase not configured. Check credentials.")
             return
-        try:
-            self.db.sync_data()
-            self.status_label.setText(self.get_sync_status())
-            self.update_sync_table()
-            QMessageBox.information(self, "Sync", "Manual sync completed successfully at 12:57 PM EAT on Wednesday, May 14, 2025.")
-        except sqlite3.IntegrityError as e:
-            self.status_label.setText(f"Sync failed: {str(e)}")
-            self.update_sync_table()
+        self.manual_sync_requested = True
+        if self.main_window.sync_service.request_sync():
+            self.status_label.setText("Sync queued...")
+
+    def retry_failed_sync(self):
+        """Requeue every failed sync operation and start a sync."""
+        count = self.db.requeue_dead_letters()
+        self.update_sync_table()
+        if not count:
+            QMessageBox.information(self, "Sync", "There are no failed changes to retry.")
+            return
+        self.status_label.setText(f"Requeued {count} failed changes.")
+        if self.db.sync_enabled and self.db.is_online():
+            self.main_window.sync_service.request_sync()
+
+    def set_sync_running(self, running):
+        self.sync_now_button.setEnabled(not running)
+        self.cancel_sync_button.setEnabled(running)
+
+    def on_sync_started(self):
+        self.set_sync_running(True)
+        self.status_label.setText("Syncing...")
+
+    def on_sync_progress(self, stage, done, total):
+        action = "pushed" if stage == "push" else "pulled"
+        self.status_label.setText(f"Syncing: {action} {done} of {total} tables...")
+
+    def on_sync_finished(self, ran):
+        self.set_sync_running(False)
+        self.status_label.setText(self.get_sync_status())
+        self.update_sync_table()
+        if self.manual_sync_requested:
+            self.manual_sync_requested = False
+            if ran:
+                QMessageBox.information(self, "Sync", "Manual sync completed successfully at 12:57 PM EAT on Wednesday, May 14, 2025.")
+            else:
+                QMessageBox.warning(self, "Sync", "Sync did not run. Check that cloud sync is enabled and you are online.")
+
+    def on_sync_cancelled(self):
+        self.set_sync_running(False)
+        self.manual_sync_requested = False
+        self.status_label.setText("Sync cancelled. Remaining changes will sync next time.")
+        self.update_sync_table()
+
+    def on_sync_error(self, e):
+        self.set_sync_running(False)
+        self.status_label.setText(f"Sync failed: {str(e)}")
+        self.update_sync_table()
+        if not self.manual_sync_requested:
+            return
+        self.manual_sync_requested = False
+        if isinstance(e, sqlite3.IntegrityError):
             retry = QMessageBox.warning(self, "Sync Error", f"Sync failed due to data integrity issue: {str(e)}\nWould you like to retry?",
                                       QMessageBox.StandardButton.Retry | QMessageBox.StandardButton.Cancel)
             if retry == QMessageBox.StandardButton.Retry:
                 self.manual_sync()
-        except Exception as e:
-            self.status_label.setText(f"Sync failed: {str(e)}")
-            self.update_sync_table()
+        else:
             QMessageBox.critical(self, "Sync Error", f"An error occurred during sync: {str(e)}")
 
     def save_settings(self):
@@ -493,6 +624,8 @@ class SettingsWidget(QWidget):
         # Handle sync toggle
         was_enabled = self.db.sync_enabled
         self.db.toggle_sync(self.sync_toggle.isChecked())
+        if self.sync_toggle.isChecked():
+            self.main_window.sync_service.request_sync()
         if self.sync_toggle.isChecked() and not was_enabled:
             QMessageBox.information(self, "Sync", "Cloud sync enabled. Data will sync automatically when online.")
         elif not self.sync_toggle.isChecked() and was_enabled:
@@ -502,8 +635,18 @@ class SettingsWidget(QWidget):
         self.update_sync_table()
         QMessageBox.information(self, "Settings", "Settings saved successfully at 12:57 PM EAT on Wednesday, May 14, 2025.")
 
+    def update_queue_label(self):
+        metrics = self.db.get_sync_queue_metrics()
+        text = f"Waiting to sync: {metrics['pending']}"
+        if metrics['pending']:
+            hours, remainder = divmod(metrics['backlog_age_seconds'], 3600)
+            text += f" (oldest {hours}h {remainder // 60}m ago)"
+        text += f" | Failed: {metrics['failed']} | Archived: {metrics['archived']}"
+        self.queue_label.setText(text)
+
     def update_sync_table(self):
         """Update the sync history table."""
+        self.update_queue_label()
         history = self.db.get_sync_history()
         self.sync_table.setRowCount(len(history))
         for row, item in enumerate(history):
@@ -524,15 +667,37 @@ class SettingsWidget(QWidget):
 
         file_path, _ = QFileDialog.getOpenFileName(self, "Import Data", "", "Database Files (*.db)")
         if file_path and os.path.exists(file_path):
+            sync_service = self.main_window.sync_service
             try:
                 db_path = self.db.db_path
+                # No sync may touch the database while its file is replaced
+                sync_service.stop()
+                self.db.close_connections()
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(db_path + suffix):
+                        os.remove(db_path + suffix)
                 shutil.copy2(file_path, db_path)
                 QMessageBox.information(self, "Import", "Data imported successfully. Restart application to apply changes at 12:57 PM EAT on Wednesday, May 14, 2025.")
             except Exception as e:
+                # The old database is still in use, so keep syncing it
+                if not sync_service.isRunning():
+                    sync_service.start()
                 QMessageBox.critical(self, "Error", f"Failed to import data: {str(e)}")
         else:
             QMessageBox.warning(self, "Import", "No valid file selected.")
 
+    def compact_database(self):
+        """Compact clinic.db; the first run on an older database rewrites the whole file."""
+        reply = QMessageBox.question(self, "Compact Database",
+                                     "Other tills cannot save while the database is compacted. Continue?")
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        try:
+            freed = self.db.compact_database()
+            QMessageBox.information(self, "Compact Database", f"Freed {freed / 1048576:.1f} MB.")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to compact database: {str(e)}")
+
     def export_data(self):
         """Export data to a backup file."""
         if not self.main_window.db.is_system_activated() and not self.main_window.db.is_demo_period_active():
@@ -543,6 +708,7 @@ class SettingsWidget(QWidget):
         if file_path:
             try:
                 db_path = self.db.db_path
+                self.db.checkpoint()
                 shutil.copy2(db_path, file_path)
                 QMessageBox.information(self, "Export", "Data exported successfully at 12:57 PM EAT on Wednesday, May 14, 2025.")
             except Exception as e:
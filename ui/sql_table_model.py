@@ -0,0 +1,110 @@
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+
+class SqlTableModel(QAbstractTableModel):
+    """Read-only table model that pages rows out of SQLite as the view scrolls.
+
+    Rows are fetched in keyset-paged windows through Database.fetch_page, so
+    opening a table with 500k rows costs the same as opening one with 50.
+    Sorting (header clicks) and filtering run in SQL and restart paging.
+
+    columns is a list of (header, sql_expression) pairs; formatters optionally
+    maps a column index to a function turning the raw value into display text.
+    """
+
+    def __init__(self, db, source, columns, key, where=None, search_columns=(),
+                 formatters=None, default_sort=0, descending=False, page_size=200, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.source = source
+        self.headers = [header for header, _ in columns]
+        self.expressions = [expression for _, expression in columns]
+        self.key = key
+        self.where = where
+        self.search_columns = search_columns
+        self.formatters = formatters or {}
+        self.sort_column = default_sort
+        self.descending = descending
+        self.page_size = page_size
+        self.search = None
+        self._rows = []
+        self._exhausted = True
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        return self.text(index.row(), index.column())
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        rows = self._fetch(self.page_size)
+        if not rows:
+            self._exhausted = True
+            return
+        self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sort_column = column
+        self.descending = order == Qt.SortOrder.DescendingOrder
+        self.refresh()
+
+    def set_search(self, text):
+        """Filter rows whose search columns contain text (case-insensitive LIKE)."""
+        self.search = text.strip() or None
+        self.refresh()
+
+    def refresh(self):
+        """Drop loaded rows and fetch the first page again."""
+        self.beginResetModel()
+        self._rows = []
+        self._exhausted = False
+        rows = self._fetch(self.page_size)
+        self._rows.extend(rows)
+        self._exhausted = len(rows) < self.page_size
+        self.endResetModel()
+
+    def value(self, row, column):
+        """Raw value of a loaded cell."""
+        return self._rows[row][column]
+
+    def text(self, row, column):
+        """Display text of a loaded cell."""
+        return self._format(column, self._rows[row][column])
+
+    def all_rows(self):
+        """Display text of every matching row, e.g. for a PDF export."""
+        rows = self.db.fetch_page(self.source, self.expressions, self.key,
+                                  sort=self.expressions[self.sort_column], descending=self.descending,
+                                  where=self.where, search=self.search, search_columns=self.search_columns,
+                                  limit=-1)
+        return [[self._format(column, row[column]) for column in range(len(self.headers))] for row in rows]
+
+    def _format(self, column, value):
+        formatter = self.formatters.get(column)
+        if formatter:
+            return formatter(value)
+        return "" if value is None else str(value)
+
+    def _fetch(self, limit):
+        after = self._rows[-1][-2:] if self._rows else None
+        return self.db.fetch_page(self.source, self.expressions, self.key,
+                                  sort=self.expressions[self.sort_column], descending=self.descending,
+                                  where=self.where, search=self.search, search_columns=self.search_columns,
+                                  after=after, limit=limit)
@@ -1,14 +1,16 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-                             QTextEdit, QPushButton, QTableWidget, QTableWidgetItem,
+                             QTextEdit, QPushButton, QTableView,
                              QHeaderView, QMessageBox)
 from PyQt6.QtCore import Qt
-from db.database import Database
+from ui.sql_table_model import SqlTableModel
 
 class SupplierManagementWidget(QWidget):
+    watched_tables = ("suppliers",)
+
     def __init__(self, main_window):
         super().__init__()
         self.main_window = main_window
-        self.db = Database()
+        self.db = self.main_window.db
         self.selected_supplier_id = None  # To track the supplier being edited
         self.init_ui()
 
@@ -239,21 +241,28 @@ class SupplierManagementWidget(QWidget):
         button_layout.addWidget(back_button)
         main_layout.addLayout(button_layout)
 
-        # Suppliers table
-        self.supplier_table = QTableWidget()
-        self.supplier_table.setColumnCount(7)
-        self.supplier_table.setHorizontalHeaderLabels([
-            "ID", "Name", "Contact", "Products", "Last Delivery", "Responsible Person", "Notes"
-        ])
+        # Suppliers table (rows are paged in from SQLite as the view scrolls)
+        self.supplier_model = SqlTableModel(self.db, "suppliers", [
+            ("ID", "supplier_id"), ("Name", "name"),
+            ("Contact", "'Phone: ' || COALESCE(phone, '') || char(10) || 'Email: ' || COALESCE(email, '') || char(10) || 'Address: ' || COALESCE(address, '')"),
+            ("Products", "products_supplied"), ("Last Delivery", "last_delivery_date"),
+            ("Responsible Person", "responsible_person"), ("Notes", "notes")
+        ], key="supplier_id", default_sort=1, search_columns=("name", "products_supplied", "responsible_person"),
+            formatters={4: lambda value: value or "N/A", 5: lambda value: value or "N/A", 6: lambda value: value or "N/A"})
+        self.supplier_table = QTableView()
+        self.supplier_table.setModel(self.supplier_model)
+        self.supplier_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.supplier_table.horizontalHeader().setSortIndicator(1, Qt.SortOrder.AscendingOrder)
+        self.supplier_table.setSortingEnabled(True)
         self.supplier_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.supplier_table.setToolTip("List of suppliers")
         self.supplier_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 font-size: 14px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
             }
         """)
@@ -264,25 +273,19 @@ class SupplierManagementWidget(QWidget):
 
         self.load_data()
 
+    def refresh(self):
+        """Reload data after the cached screen went stale."""
+        self.load_data()
+
     def load_data(self):
-        suppliers = self.db.get_all_suppliers()
-        self.supplier_table.setRowCount(len(suppliers))
-        for row, supplier in enumerate(suppliers):
-            self.supplier_table.setItem(row, 0, QTableWidgetItem(str(supplier['supplier_id'])))
-            self.supplier_table.setItem(row, 1, QTableWidgetItem(supplier['name']))
-            contact = f"Phone: {supplier['phone']}\nEmail: {supplier['email']}\nAddress: {supplier['address']}"
-            self.supplier_table.setItem(row, 2, QTableWidgetItem(contact))
-            self.supplier_table.setItem(row, 3, QTableWidgetItem(supplier['products_supplied']))
-            self.supplier_table.setItem(row, 4, QTableWidgetItem(supplier['last_delivery_date'] or "N/A"))
-            self.supplier_table.setItem(row, 5, QTableWidgetItem(supplier['responsible_person'] or "N/A"))
-            self.supplier_table.setItem(row, 6, QTableWidgetItem(supplier['notes'] or "N/A"))
+        self.supplier_model.refresh()
 
     def load_supplier_to_form(self):
-        row = self.supplier_table.currentRow()
+        row = self.supplier_table.currentIndex().row()
         if row < 0:
             return
 
-        self.selected_supplier_id = int(self.supplier_table.item(row, 0).text())
+        self.selected_supplier_id = int(self.supplier_model.text(row, 0))
         supplier = self.db.get_supplier(self.selected_supplier_id)
         self.name_input.setText(supplier['name'])
         self.phone_input.setText(supplier['phone'])
@@ -0,0 +1,85 @@
+import queue
+import threading
+from PyQt6.QtCore import QThread, pyqtSignal
+from db.database import SyncCancelled
+
+
+class SyncService(QThread):
+    """Runs Database.sync_data on a worker thread.
+
+    Sync requests go through a job queue, so the GUI thread only ever posts a
+    request and listens for signals. Requests made while one is already
+    waiting are dropped. When no request arrives for `interval` seconds an
+    automatic sync runs, provided sync is enabled and the clinic is online.
+    """
+
+    sync_started = pyqtSignal()
+    progress = pyqtSignal(str, int, int)
+    sync_finished = pyqtSignal(bool)
+    sync_cancelled = pyqtSignal()
+    error = pyqtSignal(object)
+
+    def __init__(self, db, interval=300, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.interval = interval
+        self.is_syncing = False
+        self._jobs = queue.Queue()
+        self._pending = False
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    def request_sync(self):
+        """Queue a sync; returns False if one is already waiting to run."""
+        with self._lock:
+            if self._pending:
+                return False
+            self._pending = True
+        self._jobs.put("sync")
+        return True
+
+    def cancel(self):
+        """Stop the running sync at its next row and drop any queued request."""
+        with self._lock:
+            self._pending = False
+            while True:
+                try:
+                    self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+        self._cancel.set()
+
+    def stop(self):
+        self.cancel()
+        self._jobs.put(None)
+        self.wait()
+
+    def run(self):
+        while True:
+            try:
+                job = self._jobs.get(timeout=self.interval)
+            except queue.Empty:
+                job = "auto"
+            if job is None:
+                break
+            with self._lock:
+                self._pending = False
+            self._cancel.clear()
+            if job == "auto" and not (self.db.supabase and self.db.sync_enabled and self.db.is_online()):
+                continue
+            self._sync()
+
+    def _sync(self):
+        self.is_syncing = True
+        self.sync_started.emit()
+        try:
+            ran = self.db.sync_data(progress=self.progress.emit, cancel_event=self._cancel)
+        except SyncCancelled:
+            self.sync_cancelled.emit()
+        except Exception as e:
+            print(f"Background sync failed: {e}")
+            self.error.emit(e)
+        else:
+            self.sync_finished.emit(ran)
+        finally:
+            self.is_syncing = False
@@ -1,16 +1,18 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-                             QComboBox, QPushButton, QTableWidget, QTableWidgetItem,
+                             QComboBox, QPushButton, QTableView,
                              QHeaderView, QMessageBox)
 from PyQt6.QtCore import Qt
-from db.database import Database
+from ui.sql_table_model import SqlTableModel
 import bcrypt
 import sqlite3
 
 class UserManagementWidget(QWidget):
+    watched_tables = ("users",)
+
     def __init__(self, main_window):
         super().__init__()
         self.main_window = main_window
-        self.db = Database()
+        self.db = self.main_window.db
         self.init_ui()
 
     def init_ui(self):
@@ -161,19 +163,24 @@ class UserManagementWidget(QWidget):
         button_layout.addWidget(back_button)
         main_layout.addLayout(button_layout)
 
-        # User table
-        self.user_table = QTableWidget()
-        self.user_table.setColumnCount(3)
-        self.user_table.setHorizontalHeaderLabels(["ID", "Username", "Role"])
+        # User table (rows are paged in from SQLite as the view scrolls)
+        self.user_model = SqlTableModel(self.db, "users", [
+            ("ID", "user_id"), ("Username", "username"), ("Role", "role")
+        ], key="user_id", search_columns=("username",))
+        self.user_table = QTableView()
+        self.user_table.setModel(self.user_model)
+        self.user_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.user_table.horizontalHeader().setSortIndicator(0, Qt.SortOrder.AscendingOrder)
+        self.user_table.setSortingEnabled(True)
         self.user_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.user_table.setToolTip("List of users")
         self.user_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 font-size: 14px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
             }
         """)
@@ -184,20 +191,19 @@ class UserManagementWidget(QWidget):
 
         self.load_users()
 
+    def refresh(self):
+        """Reload data after the cached screen went stale."""
+        self.load_users()
+
     def load_users(self):
-        users = self.db.get_all_users()
-        self.user_table.setRowCount(len(users))
-        for row, user in enumerate(users):
-            self.user_table.setItem(row, 0, QTableWidgetItem(str(user['user_id'])))
-            self.user_table.setItem(row, 1, QTableWidgetItem(user['username']))
-            self.user_table.setItem(row, 2, QTableWidgetItem(user['role']))
+        self.user_model.refresh()
 
     def load_user_to_form(self):
-        row = self.user_table.currentRow()
+        row = self.user_table.currentIndex().row()
         if row >= 0:
-            self.username_input.setText(self.user_table.item(row, 1).text())
+            self.username_input.setText(self.user_model.text(row, 1))
             self.password_input.clear()
-            self.role_combo.setCurrentText(self.user_table.item(row, 2).text())
+            self.role_combo.setCurrentText(self.user_model.text(row, 2))
 
     def add_user(self):
         if not self.main_window.db.is_system_activated() and not self.main_window.db.is_demo_period_active():
@@ -231,12 +237,12 @@ class UserManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        row = self.user_table.currentRow()
+        row = self.user_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a user to update.")
             return
 
-        user_id = int(self.user_table.item(row, 0).text())
+        user_id = int(self.user_model.text(row, 0))
         username = self.username_input.text().strip()
         password = self.password_input.text().strip()
         role = self.role_combo.currentText()
@@ -265,12 +271,12 @@ class UserManagementWidget(QWidget):
             QMessageBox.warning(self, "Error", "Demo period expired. Please activate the system.")
             return
 
-        row = self.user_table.currentRow()
+        row = self.user_table.currentIndex().row()
         if row < 0:
             QMessageBox.warning(self, "Error", "Please select a user to delete.")
             return
 
-        user_id = int(self.user_table.item(row, 0).text())
+        user_id = int(self.user_model.text(row, 0))
         if user_id == self.main_window.current_user['user_id']:
             QMessageBox.warning(self, "Error", "Cannot delete the current user.")
             return